@@ -2,6 +2,8 @@
 ASGI config for MyCounselling project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve through this (e.g. uvicorn/daphne) for the dashboard's live session
+events stream, which needs long-lived async responses.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
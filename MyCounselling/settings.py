@@ -56,6 +56,7 @@ INSTALLED_APPS = [
     'rankpredictor',
     'checkout',
     'course_delivery',
+    'jobs',
 
     'tailwind',
     'theme',
@@ -129,6 +130,22 @@ DATABASES = {
         }  
     }  
 
+# SQLite (local runs): the MySQL session options don't apply, and the test database is a file
+# rather than a shared in-memory one, which can't serve concurrent transactions from several threads
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['OPTIONS'] = {}
+    DATABASES['default']['TEST'] = {'NAME': os.getenv('DB_TEST_NAME', str(BASE_DIR / 'test_db.sqlite3'))}
+
+
+# Cache
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared cache in production
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'mycounselling'),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -210,6 +227,12 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', EMAIL_HOST_USER)
 
+# Public base URL used for links in emails and calendar feeds (shared by every request)
+SITE_URL = os.getenv('SITE_URL', 'https://ecounselling.live')
+
+# Maximum expiry reminder emails per second (0 = unlimited)
+EXPIRY_NOTIFICATION_RATE_LIMIT = float(os.getenv('EXPIRY_NOTIFICATION_RATE_LIMIT', 10))
+
 
 
 
@@ -224,4 +247,63 @@ print("DEFAULT_FROM_EMAIL:", DEFAULT_FROM_EMAIL)
 
 # Razorpay Configuration
 RAZORPAY_API_KEY = os.getenv('RAZORPAY_API_KEY')
-RAZORPAY_API_SECRET_KEY = os.getenv('RAZORPAY_API_SECRET_KEY')
\ No newline at end of file
+RAZORPAY_API_SECRET_KEY = os.getenv('RAZORPAY_API_SECRET_KEY')
+
+# Payment gateway client: 'razorpay' or 'local' (in-process stub that accepts any payment; refused unless DEBUG is on)
+PAYMENT_GATEWAY = os.getenv('PAYMENT_GATEWAY', 'razorpay')
+
+# Upper bound on how long a user's entitlement snapshot is cached (it also expires with their subscriptions)
+ENTITLEMENT_CACHE_TIMEOUT = int(os.getenv('ENTITLEMENT_CACHE_TIMEOUT', 3600))
+
+# Seconds between flushes of buffered subscription access counts (0 = write every access immediately)
+ACCESS_TRACKING_FLUSH_INTERVAL = float(os.getenv('ACCESS_TRACKING_FLUSH_INTERVAL', 30))
+
+# Checkout pricing: tax percentage added to the discounted price, how long a signed quote stays valid,
+# and an upper bound on how long the price table is cached (saving a bundle or product rebuilds it sooner)
+CHECKOUT_TAX_RATE = os.getenv('CHECKOUT_TAX_RATE', '0')
+CHECKOUT_QUOTE_TTL_SECONDS = int(os.getenv('CHECKOUT_QUOTE_TTL_SECONDS', 900))
+PRICE_TABLE_CACHE_TIMEOUT = int(os.getenv('PRICE_TABLE_CACHE_TIMEOUT', 300))
+
+# Checkout retries within this window reuse the same pending order
+ORDER_IDEMPOTENCY_WINDOW_MINUTES = int(os.getenv('ORDER_IDEMPOTENCY_WINDOW_MINUTES', 15))
+
+# Background sweeps use smaller chunks and longer pauses inside this local-time window ('start-end', 24h)
+EXPIRY_SWEEP_PEAK_HOURS = os.getenv('EXPIRY_SWEEP_PEAK_HOURS', '9-23')
+
+# Incremental analytics rollups recompute this many trailing days (a full rebuild runs nightly)
+ROLLUP_INCREMENTAL_DAYS = int(os.getenv('ROLLUP_INCREMENTAL_DAYS', 3))
+
+# Archival: completed orders and expired subscriptions older than this move to the archive tables,
+# abandoned (pending/failed/cancelled) orders sooner
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 730))
+ARCHIVE_ABANDONED_ORDERS_AFTER_DAYS = int(os.getenv('ARCHIVE_ABANDONED_ORDERS_AFTER_DAYS', 90))
+
+# Background jobs (manage.py run_jobs): queue polling, when a running job counts as lost,
+# how long finished jobs are kept, and running queued jobs in-process instead.
+# JOBS_RUN_INLINE is on unless a `run_jobs` worker is deployed: queued jobs (e.g. registration and
+# password reset emails) then run right after the request's transaction commits, without retries.
+# Set it to False only once a worker runs; periodic jobs (reconciliation, expiry, rollups, archival)
+# are only ever run by a worker.
+JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', 2))
+JOBS_STALE_AFTER_SECONDS = int(os.getenv('JOBS_STALE_AFTER_SECONDS', 900))
+JOBS_KEEP_FINISHED_DAYS = int(os.getenv('JOBS_KEEP_FINISHED_DAYS', 7))
+JOBS_RUN_INLINE = os.getenv('JOBS_RUN_INLINE', 'True').lower() == 'true'
+
+# Serialised course sessions/resources are cached per course content version for this many seconds
+COURSE_CONTENT_CACHE_TIMEOUT = int(os.getenv('COURSE_CONTENT_CACHE_TIMEOUT', 86400))
+
+# Calendar feeds larger than this many bytes are streamed on every poll instead of being cached
+CALENDAR_FEED_CACHE_MAX_BYTES = int(os.getenv('CALENDAR_FEED_CACHE_MAX_BYTES', 1048576))
+
+# Live session push (Server-Sent Events, ASGI only): seconds between session status checks,
+# and how long one stream stays open before the browser reconnects
+LIVE_EVENTS_TICK_SECONDS = float(os.getenv('LIVE_EVENTS_TICK_SECONDS', 15))
+LIVE_EVENTS_MAX_SECONDS = int(os.getenv('LIVE_EVENTS_MAX_SECONDS', 3600))
+
+# Course files are downloaded through access-checked views, then handed to the web server:
+# 'nginx' (X-Accel-Redirect to the internal location below), 'apache' (X-Sendfile) or '' (Django streams them)
+PROTECTED_MEDIA_SERVER = os.getenv('PROTECTED_MEDIA_SERVER', '').lower()
+PROTECTED_MEDIA_INTERNAL_URL = os.getenv('PROTECTED_MEDIA_INTERNAL_URL', '/protected-media/')
+
+# Bulk deliverable upload: files written to storage in parallel
+BULK_UPLOAD_WORKERS = int(os.getenv('BULK_UPLOAD_WORKERS', 8))
@@ -0,0 +1,118 @@
+"""
+Payment Gateway Clients
+Thin wrappers around the payment provider so checkout views and background
+jobs share one client, and a local stub can replace Razorpay in development.
+"""
+
+import uuid
+
+import razorpay
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Creation windows longer than this are not listed: each order is fetched directly instead
+MAX_LIST_WINDOW_SECONDS = 6 * 3600
+
+
+class RazorpayGateway:
+    """Razorpay-backed gateway client"""
+
+    def __init__(self):
+        self.client = razorpay.Client(auth=(settings.RAZORPAY_API_KEY, settings.RAZORPAY_API_SECRET_KEY))
+
+    def create_order(self, data):
+        """Create a gateway order, returns the gateway payload (with 'id')"""
+        return self.client.order.create(data=data)
+
+    def verify_payment_signature(self, params):
+        """Raises if the callback signature does not match"""
+        self.client.utility.verify_payment_signature(params)
+
+    def iter_orders(self, created_from, created_to, page_size=100):
+        """Yield gateway orders created in the given unix-timestamp window, one API page at a time"""
+        skip = 0
+        while True:
+            page = self.client.order.all({
+                'from': int(created_from),
+                'to': int(created_to),
+                'count': page_size,
+                'skip': skip,
+            })
+            items = page.get('items', [])
+            yield from items
+            if len(items) < page_size:
+                break
+            skip += page_size
+
+    def fetch_order_statuses(self, razorpay_order_ids, created_from, created_to):
+        """
+        Look up the status of many gateway orders at once
+        A short creation window is listed page by page (stopping once every order is found);
+        a long one, e.g. a batch of very old orders, could span months of unrelated gateway
+        orders, so each order is fetched directly instead.
+        Returns: {razorpay_order_id: {'status': ..., 'payment_id': ...}}
+        """
+        wanted = set(razorpay_order_ids)
+        statuses = {}
+        if created_to - created_from <= MAX_LIST_WINDOW_SECONDS:
+            for item in self.iter_orders(created_from, created_to):
+                if item['id'] in wanted:
+                    statuses[item['id']] = {'status': item['status'], 'payment_id': ''}
+                    if len(statuses) == len(wanted):
+                        break
+        else:
+            for order_id in wanted:
+                item = self.client.order.fetch(order_id)
+                statuses[order_id] = {'status': item['status'], 'payment_id': ''}
+
+        # Only paid orders need a second call to find the captured payment
+        for order_id, info in statuses.items():
+            if info['status'] == 'paid':
+                payments = self.client.order.payments(order_id).get('items', [])
+                captured = [p for p in payments if p.get('status') == 'captured']
+                if captured:
+                    info['payment_id'] = captured[0]['id']
+
+        return statuses
+
+
+class LocalGateway:
+    """
+    In-process stand-in for local development and tests
+    Orders start as 'created'; tests can flip them with set_status().
+    Every payment callback is accepted, so get_gateway() refuses it unless DEBUG is on.
+    """
+    orders = {}
+
+    def create_order(self, data):
+        order_id = f"order_local_{uuid.uuid4().hex[:14]}"
+        self.orders[order_id] = {'status': 'created', 'payment_id': ''}
+        return {'id': order_id, 'amount': data.get('amount'), 'currency': data.get('currency'), 'status': 'created'}
+
+    def verify_payment_signature(self, params):
+        return True
+
+    def fetch_order_statuses(self, razorpay_order_ids, created_from, created_to):
+        return {
+            order_id: dict(self.orders[order_id])
+            for order_id in razorpay_order_ids
+            if order_id in self.orders
+        }
+
+    @classmethod
+    def set_status(cls, order_id, status, payment_id=''):
+        cls.orders[order_id] = {'status': status, 'payment_id': payment_id}
+
+
+GATEWAYS = {
+    'razorpay': RazorpayGateway,
+    'local': LocalGateway,
+}
+
+
+def get_gateway():
+    """Return the gateway client configured by PAYMENT_GATEWAY"""
+    name = getattr(settings, 'PAYMENT_GATEWAY', 'razorpay')
+    if name == 'local' and not settings.DEBUG:
+        raise ImproperlyConfigured("PAYMENT_GATEWAY='local' accepts unpaid orders and is only allowed with DEBUG on")
+    return GATEWAYS[name]()
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkout.reconciliation import reconcile_pending_orders
+
+
+class Command(BaseCommand):
+    help = "Reconcile stale pending orders against the payment gateway"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=30,
+                            help="Only look at pending orders older than this many minutes")
+        parser.add_argument('--abandon-after', type=int, default=1440,
+                            help="Fail/cancel unpaid orders older than this many minutes")
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Keep running, reconciling every N seconds (0 = run once)")
+
+    def handle(self, *args, **options):
+        while True:
+            stats = reconcile_pending_orders(
+                older_than_minutes=options['older_than'],
+                abandon_after_minutes=options['abandon_after'],
+                batch_size=options['batch_size'],
+            )
+            self.stdout.write(self.style.SUCCESS(
+                "Scanned {scanned} pending orders in {elapsed_seconds}s "
+                "({orders_per_second}/s, oldest {max_lag_seconds}s old): "
+                "{completed} completed, {failed} failed, {cancelled} cancelled, "
+                "{unchanged} unchanged".format(**stats.as_dict())
+            ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
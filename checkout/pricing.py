@@ -0,0 +1,226 @@
+"""
+Pricing & Quotes
+Catalogue prices are read from a cached price table, and checkout works from a
+signed, short-lived quote so the GET and POST legs of one purchase don't each
+re-read the catalogue rows. The quote's coupon is still re-checked when the order
+is created.
+"""
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from products.models import BundledPlan, CacheVersion, Coupon, CouponUsage, MyProducts
+from products.renewals import upgrade_credit
+
+PRICE_TABLE_CACHE_KEY = 'pricing:price_table'
+PRICE_TABLE_VERSION = 'price_table'
+QUOTE_SALT = 'checkout.pricing.quote'
+
+# Why a coupon was rejected, mapped to the message checkout shows
+COUPON_ERRORS = {
+    'missing': None,
+    'invalid': "Coupon expired or invalid",
+    'usage_limit': "Coupon usage limit reached",
+    'not_applicable': "Coupon not applicable to this item",
+}
+
+
+def price_key(item_type, slug):
+    return f"{'bundle' if item_type == 'bundle' else 'product'}:{slug}"
+
+
+def bundle_price_entry(plan):
+    return {
+        'type': 'bundle',
+        'id': plan.id,
+        'slug': plan.slug,
+        'name': plan.name,
+        'price': plan.selling_price,
+        'original_price': plan.original_price,
+        'discount_percentage': plan.discount_percentage,
+        'validity_days': plan.validity_days,
+    }
+
+
+def product_price_entry(product):
+    return {
+        'type': 'product',
+        'id': product.id,
+        'slug': product.slug,
+        'name': product.name,
+        'price': product.base_price,
+        'original_price': product.base_price,
+        'discount_percentage': 0,
+        'validity_days': product.validity_days,
+    }
+
+
+PRICE_FIELDS = {
+    'bundle': (BundledPlan, bundle_price_entry, [
+        'id', 'slug', 'name', 'selling_price', 'original_price', 'discount_percentage', 'validity_days'
+    ]),
+    'product': (MyProducts, product_price_entry, ['id', 'slug', 'name', 'base_price', 'validity_days']),
+}
+
+
+def build_price_table():
+    """Price entries for every active bundle and product, keyed by price_key()"""
+    table = {}
+    for item_type, (model, to_entry, fields) in PRICE_FIELDS.items():
+        for obj in model.objects.filter(is_active=True).only(*fields):
+            table[price_key(item_type, obj.slug)] = to_entry(obj)
+    return table
+
+
+def get_price_table():
+    """
+    Cached price table, rebuilt whenever a bundle or product is saved or deleted
+    The cache key carries the price_table CacheVersion, so the table is found with one
+    primary key lookup and a bump from any server process retires it everywhere.
+    """
+    version = CacheVersion.current(PRICE_TABLE_VERSION)[PRICE_TABLE_VERSION]
+    key = f"{PRICE_TABLE_CACHE_KEY}:{version}"
+    table = cache.get(key)
+    if table is None:
+        table = build_price_table()
+        cache.set(key, table, settings.PRICE_TABLE_CACHE_TIMEOUT)
+    return table
+
+
+@receiver([post_save, post_delete], sender=BundledPlan)
+@receiver([post_save, post_delete], sender=MyProducts)
+def bump_price_table(sender, **kwargs):
+    # Queryset .update() sends no signal: bulk updates of catalogue rows must bump PRICE_TABLE_VERSION too
+    CacheVersion.bump(PRICE_TABLE_VERSION)
+
+
+def get_price_entry(item_type, slug):
+    """
+    Price entry for one item, or None if it isn't on sale
+    Falls back to the database when the cached table predates the item.
+    """
+    entry = get_price_table().get(price_key(item_type, slug))
+    if entry is None:
+        model, to_entry, fields = PRICE_FIELDS['bundle' if item_type == 'bundle' else 'product']
+        obj = model.objects.filter(slug=slug, is_active=True).only(*fields).first()
+        entry = to_entry(obj) if obj else None
+    return entry
+
+
+def check_coupon(coupon, user, item_type, item_id):
+    """
+    Validate a coupon for one user and item
+    Returns: None if it can be applied, otherwise a COUPON_ERRORS key
+    """
+    if not coupon.is_valid():
+        return 'invalid'
+
+    if coupon.max_uses_per_user > 0:
+        user_usage_count = CouponUsage.objects.filter(coupon=coupon, user=user).count()
+        if user_usage_count >= coupon.max_uses_per_user:
+            return 'usage_limit'
+
+    if coupon.apply_to_all:
+        return None
+    if item_type == 'bundle':
+        is_applicable = coupon.applicable_plans.filter(pk=item_id).exists()
+    else:
+        is_applicable = coupon.applicable_products.filter(pk=item_id).exists()
+    return None if is_applicable else 'not_applicable'
+
+
+class PriceQuote:
+    """
+    Price of one item for one user at a point in time
+    Serialised with django.core.signing so it can round-trip through the checkout form.
+    """
+    FIELDS = [
+        'user_id', 'item_type', 'item_id', 'slug', 'name', 'base_price', 'original_price',
+        'coupon_code', 'discount_amount', 'proration_credit', 'credited_subscription_ids',
+        'tax_amount', 'final_price',
+    ]
+    DECIMAL_FIELDS = [
+        'base_price', 'original_price', 'discount_amount', 'proration_credit', 'tax_amount', 'final_price',
+    ]
+
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            setattr(self, field, values[field])
+
+    def matches(self, user, item_type, slug, coupon_code):
+        return (
+            self.user_id == user.pk and
+            self.item_type == ('bundle' if item_type == 'bundle' else 'product') and
+            self.slug == slug and
+            self.coupon_code == (coupon_code or '')
+        )
+
+    def sign(self):
+        payload = {field: getattr(self, field) for field in self.FIELDS}
+        for field in self.DECIMAL_FIELDS:
+            payload[field] = str(payload[field])
+        return signing.dumps(payload, salt=QUOTE_SALT, compress=True)
+
+    @classmethod
+    def from_token(cls, token):
+        """Return the quote in a signed token, or None if it is tampered with or expired"""
+        if not token:
+            return None
+        try:
+            payload = signing.loads(token, salt=QUOTE_SALT, max_age=settings.CHECKOUT_QUOTE_TTL_SECONDS)
+            for field in cls.DECIMAL_FIELDS:
+                payload[field] = Decimal(payload[field])
+            return cls(**payload)
+        except (signing.BadSignature, KeyError):
+            # Tampered, expired, or signed before a field was added: re-price instead
+            return None
+
+
+def build_quote(user, item_type, slug, coupon_code=None):
+    """
+    Price an item for a user, applying the coupon if it is valid for them and, for
+    bundles, the prorated credit for subscriptions the bundle upgrades
+    Returns: (quote, coupon_error) - quote is None if the item isn't on sale
+    """
+    entry = get_price_entry(item_type, slug)
+    if entry is None:
+        return None, None
+
+    price = entry['price']
+    discount_amount = Decimal('0')
+    coupon_error = None
+    if coupon_code:
+        coupon = Coupon.objects.filter(code=coupon_code, is_active=True).first()
+        coupon_error = check_coupon(coupon, user, entry['type'], entry['id']) if coupon else 'missing'
+        if coupon_error is None:
+            discount_amount = coupon.calculate_discount(price).quantize(Decimal('0.01'))
+
+    proration_credit, credited = Decimal('0'), []
+    if entry['type'] == 'bundle':
+        credit, credited = upgrade_credit(user, entry['id'])
+        proration_credit = min(credit, price - discount_amount)
+
+    taxable = price - discount_amount - proration_credit
+    tax_amount = (taxable * Decimal(settings.CHECKOUT_TAX_RATE) / Decimal('100')).quantize(Decimal('0.01'))
+
+    quote = PriceQuote(
+        user_id=user.pk,
+        item_type=entry['type'],
+        item_id=entry['id'],
+        slug=entry['slug'],
+        name=entry['name'],
+        base_price=price,
+        original_price=entry['original_price'],
+        coupon_code=coupon_code if coupon_code and coupon_error is None else '',
+        discount_amount=discount_amount,
+        proration_credit=proration_credit,
+        credited_subscription_ids=[s.pk for s in credited] if proration_credit > 0 else [],
+        tax_amount=tax_amount,
+        final_price=taxable + tax_amount,
+    )
+    return quote, coupon_error
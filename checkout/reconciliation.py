@@ -0,0 +1,134 @@
+"""
+Pending Order Reconciliation
+Pages through orders stuck in 'pending' (abandoned checkouts, lost payment
+callbacks), asks the gateway for their status in bulk and moves them on.
+"""
+
+import logging
+import time
+
+from django.db.models import Q
+from django.utils import timezone
+
+from products.models import Order
+from .gateway import get_gateway
+
+logger = logging.getLogger(__name__)
+
+# Gateway orders are created a moment after our Order row, widen the lookup window a little
+GATEWAY_WINDOW_SLACK = timezone.timedelta(minutes=10)
+
+
+class ReconcileStats:
+    """Counters and timings for one reconciliation run"""
+
+    def __init__(self):
+        self.scanned = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.unchanged = 0
+        self.batches = 0
+        self.max_lag_seconds = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def throughput(self):
+        """Orders scanned per second"""
+        return self.scanned / self.elapsed if self.elapsed > 0 else 0
+
+    def as_dict(self):
+        return {
+            'scanned': self.scanned,
+            'completed': self.completed,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+            'unchanged': self.unchanged,
+            'batches': self.batches,
+            'max_lag_seconds': int(self.max_lag_seconds),
+            'elapsed_seconds': round(self.elapsed, 2),
+            'orders_per_second': round(self.throughput, 1),
+        }
+
+
+def reconcile_pending_orders(older_than_minutes=30, abandon_after_minutes=1440, batch_size=200, gateway=None):
+    """
+    Reconcile pending orders older than `older_than_minutes`
+    - paid at the gateway            -> completed (with subscriptions)
+    - attempted, past abandon window -> failed
+    - never paid, past abandon window -> cancelled
+    Pages with a (created_at, id) keyset so each batch is an index range scan.
+    Returns: ReconcileStats
+    """
+    gateway = gateway or get_gateway()
+    stats = ReconcileStats()
+    now = timezone.now()
+    cutoff = now - timezone.timedelta(minutes=older_than_minutes)
+    abandon_cutoff = now - timezone.timedelta(minutes=abandon_after_minutes)
+
+    pending = Order.objects.filter(status='pending', created_at__lt=cutoff).order_by('created_at', 'id')
+    last_created, last_id = None, None
+
+    while True:
+        page = pending
+        if last_created is not None:
+            page = page.filter(Q(created_at__gt=last_created) | Q(created_at=last_created, id__gt=last_id))
+        orders = list(page.only('id', 'order_id', 'razorpay_order_id', 'created_at', 'status')[:batch_size])
+        if not orders:
+            break
+
+        stats.batches += 1
+        stats.scanned += len(orders)
+        last_created, last_id = orders[-1].created_at, orders[-1].id
+        if stats.batches == 1:
+            stats.max_lag_seconds = (now - orders[0].created_at).total_seconds()
+
+        razorpay_ids = [o.razorpay_order_id for o in orders if o.razorpay_order_id]
+        statuses = {}
+        if razorpay_ids:
+            statuses = gateway.fetch_order_statuses(
+                razorpay_ids,
+                (orders[0].created_at - GATEWAY_WINDOW_SLACK).timestamp(),
+                (orders[-1].created_at + GATEWAY_WINDOW_SLACK).timestamp(),
+            )
+
+        to_fail, to_cancel = [], []
+        for order in orders:
+            info = statuses.get(order.razorpay_order_id) if order.razorpay_order_id else None
+            if info and info['status'] == 'paid':
+                _, finalized = Order.finalize_payment(
+                    order.pk, payment_id=info['payment_id'], note="Completed by reconciliation"
+                )
+                if finalized:
+                    stats.completed += 1
+                else:
+                    stats.unchanged += 1
+            elif order.created_at < abandon_cutoff:
+                if info and info['status'] == 'attempted':
+                    to_fail.append(order.pk)
+                else:
+                    to_cancel.append(order.pk)
+            else:
+                stats.unchanged += 1
+
+        # The status guard keeps a late callback that completed the order in the meantime intact
+        if to_fail:
+            stats.failed += Order.objects.filter(pk__in=to_fail, status='pending').update(
+                status='failed', updated_at=timezone.now()
+            )
+        if to_cancel:
+            stats.cancelled += Order.objects.filter(pk__in=to_cancel, status='pending').update(
+                status='cancelled', updated_at=timezone.now()
+            )
+
+        logger.info(
+            "Reconciled batch %s: %s orders scanned, %.1f orders/s",
+            stats.batches, stats.scanned, stats.throughput
+        )
+
+    logger.info("Pending order reconciliation finished: %s", stats.as_dict())
+    return stats
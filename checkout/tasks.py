@@ -0,0 +1,11 @@
+import datetime
+
+from jobs.queue import job
+
+from .reconciliation import reconcile_pending_orders
+
+
+@job(every=datetime.timedelta(minutes=5), timeout=1800)
+def reconcile_orders():
+    """Settle pending orders against the payment gateway (see checkout.reconciliation)"""
+    reconcile_pending_orders()
@@ -1,3 +1,314 @@
-from django.test import TestCase
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from products.models import (
+    BundledPlan, CacheVersion, Coupon, CouponUsage, MyProducts, Order, PlanProduct, UserSubscription
+)
+
+from .gateway import LocalGateway, RazorpayGateway, get_gateway
+from .pricing import PriceQuote, build_quote, get_price_entry
+from .reconciliation import reconcile_pending_orders
+
+
+def make_paid_bundle_order(user):
+    plan = BundledPlan.objects.create(
+        name='Complete', slug='complete', plan_type='premium',
+        original_price=1000, selling_price=800
+    )
+    for i in range(3):
+        product = MyProducts.objects.create(name=f'Product {i}', slug=f'product-{i}', base_price=100)
+        PlanProduct.objects.create(plan=plan, product=product)
+    Coupon.objects.create(
+        code='SAVE10', discount_type='fixed', discount_value=10,
+        valid_from=timezone.now() - timezone.timedelta(days=1),
+        valid_until=timezone.now() + timezone.timedelta(days=1),
+    )
+    return Order.objects.create(
+        user=user, bundled_plan=plan, original_price=1000, final_price=790,
+        coupon_code='SAVE10', coupon_discount=10, razorpay_order_id='order_test_1'
+    )
+
+
+@override_settings(PAYMENT_GATEWAY='local', DEBUG=True)
+class PaymentCallbackReplayTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.order = make_paid_bundle_order(self.user)
+        self.callback = {
+            'razorpay_order_id': 'order_test_1',
+            'razorpay_payment_id': 'pay_test_1',
+            'razorpay_signature': 'sig',
+        }
+
+    def test_replayed_callback_applies_once(self):
+        for _ in range(3):
+            response = self.client.post(reverse('checkout:payment_success'), self.callback)
+            self.assertEqual(response.status_code, 200)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'completed')
+        self.assertEqual(UserSubscription.objects.filter(order=self.order).count(), 3)
+        self.assertEqual(CouponUsage.objects.filter(order=self.order).count(), 1)
+        self.assertEqual(Coupon.objects.get(code='SAVE10').current_uses, 1)
+
+    def test_bad_signature_does_not_fail_completed_order(self):
+        Order.finalize_payment(self.order.pk, payment_id='pay_test_1')
+
+        with self.settings(PAYMENT_GATEWAY='razorpay', RAZORPAY_API_KEY='key', RAZORPAY_API_SECRET_KEY='secret'):
+            self.client.post(reverse('checkout:payment_success'), self.callback)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'completed')
+
+
+class ConcurrentFinalizeTests(TransactionTestCase):
+
+    def test_concurrent_callbacks_create_one_set_of_subscriptions(self):
+        user = User.objects.create_user(username='student@example.com', password='pass12345')
+        order = make_paid_bundle_order(user)
+        barrier = threading.Barrier(4)
+        results = []
+
+        def replay():
+            try:
+                barrier.wait()
+                _, finalized = Order.finalize_payment(order.pk, payment_id='pay_test_1', signature='sig')
+                results.append(finalized)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=replay) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), [False, False, False, True])
+        self.assertEqual(UserSubscription.objects.filter(order=order).count(), 3)
+        self.assertEqual(CouponUsage.objects.filter(order=order).count(), 1)
+        self.assertEqual(Coupon.objects.get(code='SAVE10').current_uses, 1)
+
+    def test_concurrent_renewals_are_chained(self):
+        user = User.objects.create_user(username='student@example.com', password='pass12345')
+        product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100, validity_days=30)
+        orders = [
+            Order.objects.create(user=user, product=product, original_price=100, final_price=100)
+            for _ in range(3)
+        ]
+        barrier = threading.Barrier(len(orders))
+
+        def complete(order):
+            try:
+                barrier.wait()
+                Order.finalize_payment(order.pk)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=complete, args=[order]) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        rows = list(UserSubscription.objects.filter(user=user).order_by('start_date'))
+        self.assertEqual(len(rows), 3)
+        for previous, row in zip(rows, rows[1:]):
+            self.assertEqual(row.start_date, previous.expiry_date)
+
+
+class GatewayTests(TestCase):
+
+    @override_settings(PAYMENT_GATEWAY='local', DEBUG=False)
+    def test_local_gateway_refused_without_debug(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_gateway()
+
+    @override_settings(PAYMENT_GATEWAY='local', DEBUG=False)
+    def test_callback_fails_order_when_local_gateway_refused(self):
+        user = User.objects.create_user(username='student@example.com', password='pass12345')
+        order = make_paid_bundle_order(user)
+        self.client.post(reverse('checkout:payment_success'), {
+            'razorpay_order_id': 'order_test_1', 'razorpay_payment_id': 'pay_test_1', 'razorpay_signature': 'sig',
+        })
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'failed')
+        self.assertFalse(UserSubscription.objects.filter(order=order).exists())
+
+    def make_razorpay(self, listed):
+        with self.settings(RAZORPAY_API_KEY='key', RAZORPAY_API_SECRET_KEY='secret'):
+            gateway = RazorpayGateway()
+        gateway.client = mock.Mock()
+        gateway.client.order.all.return_value = {'items': listed}
+        gateway.client.order.fetch.side_effect = lambda order_id: {'id': order_id, 'status': 'created'}
+        gateway.client.order.payments.return_value = {'items': [{'id': 'pay_1', 'status': 'captured'}]}
+        return gateway
+
+    def test_short_window_is_listed(self):
+        gateway = self.make_razorpay([{'id': 'order_a', 'status': 'paid'}, {'id': 'order_x', 'status': 'paid'}])
+        statuses = gateway.fetch_order_statuses(['order_a'], 0, 3600)
+
+        self.assertEqual(statuses, {'order_a': {'status': 'paid', 'payment_id': 'pay_1'}})
+        gateway.client.order.fetch.assert_not_called()
+
+    def test_long_window_fetches_each_order(self):
+        gateway = self.make_razorpay([])
+        statuses = gateway.fetch_order_statuses(['order_a', 'order_b'], 0, 90 * 86400)
+
+        self.assertEqual(set(statuses), {'order_a', 'order_b'})
+        gateway.client.order.all.assert_not_called()
+        self.assertEqual(gateway.client.order.fetch.call_count, 2)
+
+
+@override_settings(DEBUG=True)
+class ReconcilePendingOrdersTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        LocalGateway.orders.clear()
+
+    def make_order(self, razorpay_order_id, age_minutes):
+        order = Order.objects.create(
+            user=self.user, product=self.product, original_price=100, final_price=100,
+            razorpay_order_id=razorpay_order_id
+        )
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timezone.timedelta(minutes=age_minutes))
+        return order
+
+    def test_orders_are_settled_by_gateway_status(self):
+        paid = self.make_order('order_paid', 60)
+        attempted = self.make_order('order_attempted', 2000)
+        abandoned = self.make_order('order_abandoned', 2000)
+        waiting = self.make_order('order_waiting', 60)
+        recent = self.make_order('order_recent', 5)
+        LocalGateway.set_status('order_paid', 'paid', 'pay_1')
+        LocalGateway.set_status('order_attempted', 'attempted')
+        LocalGateway.set_status('order_abandoned', 'created')
+        LocalGateway.set_status('order_waiting', 'created')
+        LocalGateway.set_status('order_recent', 'paid', 'pay_2')
+
+        stats = reconcile_pending_orders(batch_size=2, gateway=LocalGateway())
+
+        statuses = dict(Order.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[paid.pk], 'completed')
+        self.assertEqual(statuses[attempted.pk], 'failed')
+        self.assertEqual(statuses[abandoned.pk], 'cancelled')
+        self.assertEqual(statuses[waiting.pk], 'pending')
+        self.assertEqual(statuses[recent.pk], 'pending')
+        self.assertEqual(UserSubscription.objects.filter(order=paid).count(), 1)
+        self.assertEqual((stats.scanned, stats.batches), (4, 2))
+
+
+class PricingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        self.product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=500)
+
+    def test_price_table_follows_the_database_version(self):
+        self.assertEqual(get_price_entry('product', 'counselling')['price'], 500)
+
+        with self.assertNumQueries(1):
+            get_price_entry('product', 'counselling')
+
+        self.product.base_price = 400
+        self.product.save()
+        self.assertEqual(get_price_entry('product', 'counselling')['price'], 400)
+
+        # As another server process would do it: a bulk UPDATE plus a version bump, no cache access here
+        MyProducts.objects.filter(pk=self.product.pk).update(is_active=False)
+        CacheVersion.bump('price_table')
+        self.assertIsNone(get_price_entry('product', 'counselling'))
+
+    def test_quote_round_trips_and_rejects_tampering(self):
+        quote, coupon_error = build_quote(self.user, 'product', 'counselling')
+        self.assertIsNone(coupon_error)
+        token = quote.sign()
+
+        restored = PriceQuote.from_token(token)
+        self.assertEqual(restored.final_price, quote.final_price)
+        self.assertTrue(restored.matches(self.user, 'product', 'counselling', None))
+        self.assertIsNone(PriceQuote.from_token(token[:-2] + 'xx'))
+
+    def test_quote_coupon_is_revalidated_when_order_is_created(self):
+        coupon = Coupon.objects.create(
+            code='SAVE10', discount_type='fixed', discount_value=10, apply_to_all=True,
+            valid_from=timezone.now() - timezone.timedelta(days=1),
+            valid_until=timezone.now() + timezone.timedelta(days=1),
+        )
+        quote, _ = build_quote(self.user, 'product', 'counselling', 'SAVE10')
+        self.assertEqual(quote.final_price, 490)
+
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['coupon_code'] = 'SAVE10'
+        session.save()
+
+        # The coupon runs out between showing the quote and paying
+        Coupon.objects.filter(pk=coupon.pk).update(max_uses=1, current_uses=1)
+        url = reverse('checkout:checkout_view', args=['product', 'counselling'])
+        response = self.client.post(url, {'quote': quote.sign()})
+
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertNotIn('coupon_code', self.client.session)
+
+
+class ZeroAmountCheckoutTests(TestCase):
+
+    def test_fully_discounted_order_completes_without_the_gateway(self):
+        cache.clear()
+        user = User.objects.create_user(username='student@example.com', password='pass12345')
+        product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        Coupon.objects.create(
+            code='FREE', discount_type='percentage', discount_value=100, apply_to_all=True,
+            valid_from=timezone.now() - timezone.timedelta(days=1),
+            valid_until=timezone.now() + timezone.timedelta(days=1),
+        )
+        quote, _ = build_quote(user, 'product', 'counselling', 'FREE')
+        self.assertEqual(quote.final_price, 0)
+
+        self.client.force_login(user)
+        session = self.client.session
+        session['coupon_code'] = 'FREE'
+        session.save()
+        with mock.patch('checkout.views.get_gateway') as get_gateway_mock:
+            response = self.client.post(
+                reverse('checkout:checkout_view', args=['product', 'counselling']), {'quote': quote.sign()}
+            )
+
+        get_gateway_mock.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get()
+        self.assertEqual(order.status, 'completed')
+        self.assertTrue(UserSubscription.objects.filter(order=order, product=product).exists())
+
+
+class RepeatedCheckoutTests(TestCase):
+
+    def test_resubmitted_checkout_reuses_the_pending_order(self):
+        cache.clear()
+        user = User.objects.create_user(username='student@example.com', password='pass12345')
+        MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        quote, _ = build_quote(user, 'product', 'counselling')
+        url = reverse('checkout:checkout_view', args=['product', 'counselling'])
+
+        self.client.force_login(user)
+        with mock.patch('checkout.views.get_gateway') as get_gateway_mock:
+            get_gateway_mock.return_value.create_order.return_value = {'id': 'order_test_1'}
+            for _ in range(2):
+                response = self.client.post(url, {'quote': quote.sign()})
+                self.assertEqual(response.context['razorpay_order_id'], 'order_test_1')
+
+        get_gateway_mock.return_value.create_order.assert_called_once()
+        self.assertEqual(Order.objects.filter(user=user, status='pending').count(), 1)
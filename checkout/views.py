@@ -3,106 +3,115 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from products.models import MyProducts, BundledPlan, Order, Coupon, CouponUsage
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import Http404
+from products.models import MyProducts, BundledPlan, Order, Coupon
+from products.entitlements import clear_entitlements
 from django.utils import timezone
-from decimal import Decimal
-import razorpay
+from .gateway import get_gateway
+from .pricing import COUPON_ERRORS, PriceQuote, build_quote, check_coupon, get_price_entry
+
+APPLY_COUPON_ERRORS = {
+    'invalid': "This coupon is invalid or expired",
+    'usage_limit': "You have already used this coupon the maximum number of times",
+    'not_applicable': "This coupon is not applicable to this product",
+}
 
 @login_required(login_url='user:login')
 def checkout(request, type, slug):
-    # Get the item
-    if type == 'bundle':
-        item = get_object_or_404(BundledPlan, slug=slug, is_active=True)
-        price = item.selling_price
-        original_price = item.original_price
-    else:
-        item = get_object_or_404(MyProducts, slug=slug, is_active=True)
-        price = item.base_price
-        original_price = item.base_price
-
-    # Coupon Logic
-    coupon = None
-    discount_amount = Decimal('0')
     coupon_code = request.session.get('coupon_code')
     
-    if coupon_code:
-        try:
-            coupon = Coupon.objects.get(code=coupon_code, is_active=True)
-            if coupon.is_valid():
-                # Check user usage limit again
-                user_usage_count = CouponUsage.objects.filter(coupon=coupon, user=request.user).count()
-                if coupon.max_uses_per_user > 0 and user_usage_count >= coupon.max_uses_per_user:
-                    del request.session['coupon_code']
-                    messages.error(request, "Coupon usage limit reached")
-                    coupon = None
-                else:
-                    # Check applicability again
-                    is_applicable = False
-                    if coupon.apply_to_all:
-                        is_applicable = True
-                    elif type == 'bundle':
-                        if item in coupon.applicable_plans.all():
-                            is_applicable = True
-                    else:
-                        if item in coupon.applicable_products.all():
-                            is_applicable = True
-                    
-                    if is_applicable:
-                        discount_amount = coupon.calculate_discount(price)
-                    else:
-                        del request.session['coupon_code']
-                        messages.error(request, "Coupon not applicable to this item")
-                        coupon = None
-            else:
+    # On POST, reuse the quote shown on the checkout page instead of re-pricing the item
+    quote = None
+    if request.method == "POST":
+        quote = PriceQuote.from_token(request.POST.get('quote'))
+        if quote and not quote.matches(request.user, type, slug, coupon_code):
+            quote = None
+        
+        # The quote can be minutes old: the coupon may have expired or run out since
+        if quote and quote.coupon_code:
+            coupon = Coupon.objects.filter(code=quote.coupon_code, is_active=True).first()
+            coupon_error = check_coupon(coupon, request.user, quote.item_type, quote.item_id) if coupon else 'invalid'
+            if coupon_error:
                 del request.session['coupon_code']
-                messages.error(request, "Coupon expired or invalid")
-                coupon = None
-        except Coupon.DoesNotExist:
+                messages.error(request, COUPON_ERRORS[coupon_error])
+                return redirect('checkout:checkout_view', type=type, slug=slug)
+    
+    if quote is None:
+        quote, coupon_error = build_quote(request.user, type, slug, coupon_code)
+        if quote is None:
+            raise Http404("Item not found")
+        
+        # Coupon Logic
+        if coupon_error:
             del request.session['coupon_code']
-            coupon = None
-
-    final_price = price - discount_amount
+            if COUPON_ERRORS[coupon_error]:
+                messages.error(request, COUPON_ERRORS[coupon_error])
 
     if request.method == "POST":
-        # Create Order
-        order = Order.objects.create(
-            user=request.user,
-            bundled_plan=item if type == 'bundle' else None,
-            product=item if type != 'bundle' else None,
-            original_price=original_price,
-            final_price=final_price,
-            discount_amount=discount_amount,
-            coupon_code=coupon.code if coupon else '',
-            coupon_discount=discount_amount,
-            status='pending'
+        idempotency_key = Order.build_idempotency_key(
+            request.user, quote.item_type, quote.item_id, quote.final_price, quote.coupon_code
         )
         
-        # Initialize Razorpay Client
-        client = razorpay.Client(auth=(settings.RAZORPAY_API_KEY, settings.RAZORPAY_API_SECRET_KEY))
+        # Serialise checkout attempts per user so concurrent retries can't both miss the lookup
+        with transaction.atomic():
+            User.objects.select_for_update().filter(pk=request.user.pk).first()
+            order = Order.get_reusable_pending(
+                request.user, idempotency_key, settings.ORDER_IDEMPOTENCY_WINDOW_MINUTES
+            )
+            if order is None:
+                # Create Order
+                order = Order.objects.create(
+                    user=request.user,
+                    bundled_plan_id=quote.item_id if quote.item_type == 'bundle' else None,
+                    product_id=quote.item_id if quote.item_type != 'bundle' else None,
+                    original_price=quote.original_price,
+                    final_price=quote.final_price,
+                    discount_amount=quote.discount_amount,
+                    coupon_code=quote.coupon_code,
+                    coupon_discount=quote.discount_amount,
+                    proration_credit=quote.proration_credit,
+                    tax_amount=quote.tax_amount,
+                    idempotency_key=idempotency_key,
+                    status='pending'
+                )
+                order.credited_subscriptions.set(quote.credited_subscription_ids)
+        
+        # Fully covered by coupon or upgrade credit: nothing to collect, and the gateway rejects zero-amount orders
+        if quote.final_price <= 0:
+            order, _ = Order.finalize_payment(order.pk, note="No payment due")
+            clear_entitlements(request.user)
+            if 'coupon_code' in request.session:
+                del request.session['coupon_code']
+            messages.success(request, "Your subscription is active.")
+            return render(request, 'checkout/success.html', {'order': order})
         
         # Create Razorpay Order
         payment_data = {
-            'amount': int(final_price * 100), # Amount in paise
+            'amount': int(quote.final_price * 100), # Amount in paise
             'currency': 'INR',
             'receipt': order.order_id,
             'payment_capture': '1'
         }
         
         try:
-            razorpay_order = client.order.create(data=payment_data)
-            
-            # Save Razorpay Order ID to Order
-            order.razorpay_order_id = razorpay_order['id']
-            order.save()
+            # Retries reuse the Razorpay order already attached to the pending order
+            if not order.razorpay_order_id:
+                razorpay_order = get_gateway().create_order(payment_data)
+                
+                # Save Razorpay Order ID to Order
+                order.razorpay_order_id = razorpay_order['id']
+                order.save(update_fields=['razorpay_order_id', 'updated_at'])
             
             context = {
                 'order': order,
-                'razorpay_order_id': razorpay_order['id'],
+                'razorpay_order_id': order.razorpay_order_id,
                 'razorpay_merchant_key': settings.RAZORPAY_API_KEY,
                 'razorpay_amount': payment_data['amount'],
                 'currency': payment_data['currency'],
                 'callback_url': request.build_absolute_uri('/checkout/payment/success/'),
-                'item': item,
+                'item': quote,
                 'type': type
             }
             
@@ -111,14 +120,23 @@ def checkout(request, type, slug):
             messages.error(request, f"Error creating payment order: {str(e)}")
             return redirect('checkout:checkout_view', type=type, slug=slug)
 
+    # Get the item for display
+    if quote.item_type == 'bundle':
+        item = get_object_or_404(BundledPlan, pk=quote.item_id)
+    else:
+        item = get_object_or_404(MyProducts, pk=quote.item_id)
+
     context = {
         'item': item,
         'type': type,
-        'price': price,
-        'original_price': original_price,
-        'coupon': coupon,
-        'discount_amount': discount_amount,
-        'final_price': final_price,
+        'quote': quote,
+        'quote_token': quote.sign(),
+        'price': quote.base_price,
+        'original_price': quote.original_price,
+        'discount_amount': quote.discount_amount,
+        'proration_credit': quote.proration_credit,
+        'tax_amount': quote.tax_amount,
+        'final_price': quote.final_price,
     }
     return render(request, 'checkout/checkout.html', context)
 
@@ -132,8 +150,6 @@ def payment_success(request):
             
             order = Order.objects.get(razorpay_order_id=razorpay_order_id)
             
-            client = razorpay.Client(auth=(settings.RAZORPAY_API_KEY, settings.RAZORPAY_API_SECRET_KEY))
-            
             params_dict = {
                 'razorpay_order_id': razorpay_order_id,
                 'razorpay_payment_id': payment_id,
@@ -142,32 +158,16 @@ def payment_success(request):
             
             # Verify signature
             try:
-                client.utility.verify_payment_signature(params_dict)
+                get_gateway().verify_payment_signature(params_dict)
             except Exception:
                 messages.error(request, "Payment signature verification failed")
-                order.status = 'failed'
-                order.save()
+                # Never downgrade an order a previous callback already completed
+                Order.objects.filter(pk=order.pk, status='pending').update(status='failed', updated_at=timezone.now())
                 return redirect('checkout:payment_failed')
             
-            # Update Order
-            order.razorpay_payment_id = payment_id
-            order.razorpay_signature = signature
-            order.mark_completed() # This handles status and subscription
-            
-            # Record Coupon Usage
-            if order.coupon_code:
-                try:
-                    coupon = Coupon.objects.get(code=order.coupon_code)
-                    CouponUsage.objects.create(
-                        coupon=coupon,
-                        user=order.user,
-                        order=order,
-                        discount_amount=order.coupon_discount
-                    )
-                    coupon.current_uses += 1
-                    coupon.save()
-                except Coupon.DoesNotExist:
-                    pass # Should not happen if logic is correct, but safe to ignore
+            # Update Order, subscriptions and coupon usage in one locked transaction
+            order, _ = Order.finalize_payment(order.pk, payment_id=payment_id, signature=signature)
+            clear_entitlements(request.user)
             
             # Clear coupon from session
             if 'coupon_code' in request.session:
@@ -202,32 +202,14 @@ def apply_coupon(request):
         try:
             coupon = Coupon.objects.get(code=code, is_active=True)
             
-            # Check validity
-            if not coupon.is_valid():
-                messages.error(request, "This coupon is invalid or expired")
-                return redirect('checkout:checkout_view', type=type, slug=slug)
-                
-            # Check user usage limit
-            user_usage_count = CouponUsage.objects.filter(coupon=coupon, user=request.user).count()
-            if coupon.max_uses_per_user > 0 and user_usage_count >= coupon.max_uses_per_user:
-                messages.error(request, "You have already used this coupon the maximum number of times")
-                return redirect('checkout:checkout_view', type=type, slug=slug)
+            # Check validity, user usage limit and applicability
+            entry = get_price_entry(type, slug)
+            if entry is None:
+                raise Http404("Item not found")
             
-            # Check applicability
-            is_applicable = False
-            if coupon.apply_to_all:
-                is_applicable = True
-            elif type == 'bundle':
-                item = get_object_or_404(BundledPlan, slug=slug)
-                if item in coupon.applicable_plans.all():
-                    is_applicable = True
-            else:
-                item = get_object_or_404(MyProducts, slug=slug)
-                if item in coupon.applicable_products.all():
-                    is_applicable = True
-            
-            if not is_applicable:
-                messages.error(request, "This coupon is not applicable to this product")
+            coupon_error = check_coupon(coupon, request.user, entry['type'], entry['id'])
+            if coupon_error:
+                messages.error(request, APPLY_COUPON_ERRORS[coupon_error])
                 return redirect('checkout:checkout_view', type=type, slug=slug)
             
             # If all checks pass
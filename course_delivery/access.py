@@ -0,0 +1,58 @@
+"""
+Course Content Visibility
+Resolves which sessions and resources a user may see entirely in SQL, using
+EXISTS subqueries on the specific_users table instead of per-row lookups.
+A session or resource is visible if:
+- it is public, or
+- it has no specific users and no cohorts (available to every enrolled student), or
+- the user is one of its specific users, or
+- the user is a member of one of its cohorts (looked up on the (user, cohort) index)
+Listing helpers only query products the user is enrolled in.
+"""
+
+from django.db.models import Exists, OuterRef, Q
+
+from .models import CohortMembership
+
+
+def _through_rows(model, field_name):
+    """Rows of an M2M table pointing at the outer session/resource, and the name of their other side"""
+    field = model._meta.get_field(field_name)
+    rows = field.remote_field.through.objects.filter(**{field.m2m_field_name(): OuterRef('pk')})
+    return rows, field.m2m_reverse_field_name()
+
+
+def annotate_visibility(queryset, user):
+    """
+    Annotate `has_specific_users`, `user_is_specific`, `has_cohorts` and `user_in_cohort`
+    on sessions or resources
+    """
+    specific_users, user_field = _through_rows(queryset.model, 'specific_users')
+    cohorts, cohort_field = _through_rows(queryset.model, 'cohorts')
+    return queryset.annotate(
+        has_specific_users=Exists(specific_users),
+        user_is_specific=Exists(specific_users.filter(**{user_field: user.pk})),
+        has_cohorts=Exists(cohorts),
+        user_in_cohort=Exists(cohorts.filter(**{
+            f"{cohort_field}_id__in": CohortMembership.objects.filter(user=user.pk).values('cohort_id')
+        })),
+    )
+
+
+def visible_to(queryset, user):
+    """Narrow a CourseSession or CourseResource queryset to the rows this user may see (lazy)"""
+    return annotate_visibility(queryset, user).filter(
+        Q(is_public=True) |
+        Q(has_specific_users=False, has_cohorts=False) |
+        Q(user_is_specific=True) |
+        Q(user_in_cohort=True)
+    )
+
+
+def can_view(obj, user, enrolment):
+    """Access check for a single session or resource, in at most one query"""
+    if obj.is_public:
+        return True
+    if not enrolment.is_enrolled(obj.product_id):
+        return False
+    return visible_to(type(obj).objects.filter(pk=obj.pk), user).exists()
@@ -1,12 +1,23 @@
-from django.contrib import admin
-from .models import CourseSession, CourseResource, StudentDeliverable
+import time
+import zipfile
+
+from django.contrib import admin, messages
+from django.db.models import Count
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import path
+from django.utils.text import capfirst
+
+from .bulk_upload import ManifestError, upload_deliverables
+from .cohorts import assign_members, enrolled_user_ids, sole_audience_of, users_from_csv
+from .forms import BulkDeliverableUploadForm, CohortAssignForm
+from .models import CalendarFeedToken, Cohort, CohortMembership, CourseSession, CourseResource, StudentDeliverable
 
 @admin.register(CourseSession)
 class CourseSessionAdmin(admin.ModelAdmin):
     list_display = ('title', 'product', 'start_time', 'meeting_platform', 'status', 'is_public')
     list_filter = ('meeting_platform', 'start_time', 'is_public', 'product')
     search_fields = ('title', 'product__name', 'description')
-    autocomplete_fields = ['product', 'specific_users']
+    autocomplete_fields = ['product', 'specific_users', 'cohorts']
     date_hierarchy = 'start_time'
     
     fieldsets = (
@@ -20,8 +31,8 @@ class CourseSessionAdmin(admin.ModelAdmin):
             'fields': ('meeting_platform', 'meeting_link', 'meeting_password', 'recording_url')
         }),
         ('Access Control', {
-            'fields': ('is_public', 'specific_users'),
-            'description': 'Leave "Specific users" empty to make this session available to ALL enrolled students.'
+            'fields': ('is_public', 'specific_users', 'cohorts'),
+            'description': 'Leave "Specific users" and "Cohorts" empty to make this session available to ALL enrolled students.'
         }),
     )
 
@@ -30,7 +41,7 @@ class CourseResourceAdmin(admin.ModelAdmin):
     list_display = ('title', 'product', 'resource_type', 'display_order', 'created_at')
     list_filter = ('resource_type', 'product', 'created_at')
     search_fields = ('title', 'product__name', 'content')
-    autocomplete_fields = ['product', 'specific_users']
+    autocomplete_fields = ['product', 'specific_users', 'cohorts']
     list_editable = ('display_order',)
     
     fieldsets = (
@@ -41,8 +52,8 @@ class CourseResourceAdmin(admin.ModelAdmin):
             'fields': ('content', 'video_url', 'file_upload')
         }),
         ('Access Control', {
-            'fields': ('is_public', 'specific_users'),
-            'description': 'Leave "Specific users" empty to make this resource available to ALL enrolled students.'
+            'fields': ('is_public', 'specific_users', 'cohorts'),
+            'description': 'Leave "Specific users" and "Cohorts" empty to make this resource available to ALL enrolled students.'
         }),
     )
 
@@ -52,6 +63,7 @@ class StudentDeliverableAdmin(admin.ModelAdmin):
     list_filter = ('product', 'created_at')
     search_fields = ('title', 'student__username', 'student__email')
     autocomplete_fields = ['student', 'product', 'session']
+    change_list_template = 'admin/course_delivery/deliverable_change_list.html'
     
     fieldsets = (
         ('Recipient', {
@@ -61,3 +73,118 @@ class StudentDeliverableAdmin(admin.ModelAdmin):
         'fields': ('title', 'file_upload', 'remarks')
     }),
     )
+    
+    def get_urls(self):
+        return [
+            path('bulk-upload/', self.admin_site.admin_view(self.bulk_upload_view), name='course_delivery_bulk_upload'),
+        ] + super().get_urls()
+    
+    def bulk_upload_view(self, request):
+        if not self.has_add_permission(request):
+            return redirect('admin:course_delivery_studentdeliverable_changelist')
+        
+        form = BulkDeliverableUploadForm(request.POST, request.FILES) if request.method == 'POST' else BulkDeliverableUploadForm()
+        if request.method == 'POST' and form.is_valid():
+            started = time.monotonic()
+            try:
+                created = upload_deliverables(
+                    form.cleaned_data['archive'],
+                    manifest=form.cleaned_data['manifest'],
+                )
+            except ManifestError as e:
+                for error in e.errors[:50]:
+                    form.add_error(None, error)
+                if len(e.errors) > 50:
+                    form.add_error(None, f"... and {len(e.errors) - 50} more")
+            except zipfile.BadZipFile as e:
+                form.add_error('archive', str(e))
+            else:
+                elapsed = time.monotonic() - started
+                messages.success(request, f"Created {created} deliverables in {elapsed:.1f}s.")
+                return redirect('admin:course_delivery_studentdeliverable_changelist')
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Bulk upload deliverables',
+            'form': form,
+            'opts': self.model._meta,
+        }
+        return render(request, 'admin/course_delivery/bulk_upload.html', context)
+
+
+@admin.register(Cohort)
+class CohortAdmin(admin.ModelAdmin):
+    list_display = ('name', 'product', 'member_count', 'created_at')
+    list_filter = ('product',)
+    search_fields = ('name',)
+    autocomplete_fields = ['product']
+    fields = ('name', 'product', 'description')
+    change_form_template = 'admin/course_delivery/cohort_change_form.html'
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(member_count=Count('memberships'))
+    
+    @admin.display(ordering='member_count')
+    def member_count(self, obj):
+        return obj.member_count
+    
+    def get_deleted_objects(self, objs, request):
+        # List content that only these cohorts can see as protected, so the delete page refuses it
+        deleted, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        protected = list(protected) + [
+            f"{capfirst(item._meta.verbose_name)}: {item}"
+            for item in sole_audience_of(*[obj.pk for obj in objs])
+        ]
+        return deleted, model_count, perms_needed, protected
+    
+    def get_urls(self):
+        return [
+            path('<int:cohort_id>/assign/', self.admin_site.admin_view(self.assign_view), name='course_delivery_cohort_assign'),
+        ] + super().get_urls()
+    
+    def assign_view(self, request, cohort_id):
+        cohort = get_object_or_404(Cohort, pk=cohort_id)
+        if not self.has_change_permission(request, cohort):
+            return redirect('admin:course_delivery_cohort_changelist')
+        
+        form = CohortAssignForm(request.POST, request.FILES) if request.method == 'POST' else CohortAssignForm()
+        if request.method == 'POST' and form.is_valid():
+            user_ids = set()
+            if form.cleaned_data['csv_file']:
+                found, unknown = users_from_csv(form.cleaned_data['csv_file'])
+                user_ids |= found
+                if unknown:
+                    shown = ", ".join(unknown[:20]) + (" ..." if len(unknown) > 20 else "")
+                    messages.warning(request, f"{len(unknown)} entries matched no user: {shown}")
+            if form.cleaned_data['enrolled_in']:
+                user_ids |= enrolled_user_ids(form.cleaned_data['enrolled_in'])
+            
+            added, removed = assign_members(cohort, user_ids, replace=form.cleaned_data['replace'])
+            messages.success(request, f"{cohort}: {added} members added, {removed} removed.")
+            return redirect('admin:course_delivery_cohort_change', cohort.pk)
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'title': f'Assign students to {cohort}',
+            'form': form,
+            'cohort': cohort,
+            'opts': self.model._meta,
+        }
+        return render(request, 'admin/course_delivery/cohort_assign.html', context)
+
+
+@admin.register(CohortMembership)
+class CohortMembershipAdmin(admin.ModelAdmin):
+    list_display = ('user', 'cohort', 'added_at')
+    list_filter = ('cohort',)
+    search_fields = ('user__username', 'user__email', 'cohort__name')
+    autocomplete_fields = ['user', 'cohort']
+    list_select_related = ('user', 'cohort')
+
+
+@admin.register(CalendarFeedToken)
+class CalendarFeedTokenAdmin(admin.ModelAdmin):
+    list_display = ('user', 'created_at')
+    search_fields = ('user__username', 'user__email')
+    readonly_fields = ('token', 'created_at')
+    autocomplete_fields = ['user']
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CourseDeliveryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'course_delivery'
+
+    def ready(self):
+        # Register content version and cohort deletion signals
+        from . import cohorts, content_cache  # noqa: F401
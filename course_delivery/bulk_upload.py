@@ -0,0 +1,236 @@
+"""
+Bulk Deliverable Upload
+Creates StudentDeliverables for many students from one ZIP archive and a manifest CSV.
+Manifest columns (header row required):
+- file: path of the file inside the ZIP
+- student: username or email
+- product: product slug or id
+- title
+- remarks, session (session id): optional
+The manifest can be given separately or included in the ZIP as manifest.csv.
+Every row is checked before anything is written, so a bad manifest uploads nothing.
+Files are streamed out of the ZIP into storage by a thread pool a chunk at a time,
+then the rows are inserted with bulk_create. A ZipFile and its file handle can't be
+shared between threads, so every worker opens the archive itself, from its path
+(an upload without a temporary file is copied to one first).
+"""
+
+import contextlib
+import csv
+import io
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+
+from products.models import MyProducts
+
+from .models import CourseSession, StudentDeliverable
+
+MANIFEST_NAME = 'manifest.csv'
+REQUIRED_COLUMNS = ('file', 'student', 'product', 'title')
+
+
+class ManifestError(Exception):
+    """The manifest doesn't match the archive or names unknown students/products"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"{len(errors)} problem(s) in the manifest: " + "; ".join(errors[:5]))
+
+
+def read_manifest(zf, manifest=None):
+    """Manifest rows as dicts, from the given file or manifest.csv in the archive"""
+    if manifest is None:
+        if MANIFEST_NAME not in zf.namelist():
+            raise ManifestError([f"No manifest given and no {MANIFEST_NAME} in the archive"])
+        manifest = zf.open(MANIFEST_NAME)
+    data = manifest.read()
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+
+    reader = csv.DictReader(io.StringIO(text))
+    columns = [c.strip().lower() for c in reader.fieldnames or []]
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise ManifestError([f"Manifest is missing column(s): {', '.join(missing)}"])
+    return [
+        {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+        for row in reader
+    ]
+
+
+def _lookup(rows):
+    """Students, products and sessions named in the manifest, each loaded in one query"""
+    identifiers = {row['student'] for row in rows}
+    users = User.objects.filter(Q(username__in=identifiers) | Q(email__in=identifiers))
+    students = {}
+    for user in users:
+        students.setdefault(user.username, []).append(user)
+        if user.email and user.email != user.username:
+            students.setdefault(user.email, []).append(user)
+
+    keys = {row['product'] for row in rows}
+    product_ids = [int(key) for key in keys if key.isdigit()]
+    products = {}
+    for product in MyProducts.objects.filter(Q(slug__in=keys) | Q(id__in=product_ids)):
+        products[product.slug] = product
+        products[str(product.id)] = product
+
+    session_ids = [int(row['session']) for row in rows if row.get('session', '').isdigit()]
+    sessions = CourseSession.objects.in_bulk(session_ids)
+    return students, products, sessions
+
+
+def plan_upload(zf, rows):
+    """
+    Match every manifest row to its archive member and an unsaved StudentDeliverable
+    Returns: list of (ZipInfo, StudentDeliverable); raises ManifestError listing every bad row
+    """
+    members = {info.filename: info for info in zf.infolist() if not info.is_dir()}
+    students, products, sessions = _lookup(rows)
+
+    errors = []
+    planned = []
+    # Line 1 is the header
+    for line, row in enumerate(rows, start=2):
+        problems = []
+        info = members.get(row['file'])
+        if info is None:
+            problems.append(f"file '{row['file']}' is not in the archive")
+
+        matches = students.get(row['student'], [])
+        if not matches:
+            problems.append(f"no student '{row['student']}'")
+        elif len(matches) > 1:
+            problems.append(f"'{row['student']}' matches more than one user")
+
+        product = products.get(row['product'])
+        if product is None:
+            problems.append(f"no product '{row['product']}'")
+
+        if not row['title']:
+            problems.append("title is empty")
+
+        session = None
+        if row.get('session'):
+            session = sessions.get(int(row['session'])) if row['session'].isdigit() else None
+            if session is None:
+                problems.append(f"no session '{row['session']}'")
+            elif product is not None and session.product_id != product.id:
+                problems.append(f"session {session.id} is not part of '{product.slug}'")
+
+        if problems:
+            errors.append(f"Line {line}: " + ", ".join(problems))
+            continue
+        planned.append((info, StudentDeliverable(
+            student=matches[0],
+            product=product,
+            session=session,
+            title=row['title'][:200],
+            remarks=row.get('remarks', ''),
+        )))
+
+    if not rows:
+        errors.append("The manifest has no rows")
+    if errors:
+        raise ManifestError(errors)
+    return planned
+
+
+def archive_path(archive, stack):
+    """Filesystem path of the archive, copying a file object without one to a temporary file"""
+    if isinstance(archive, (str, os.PathLike)):
+        return archive
+    if hasattr(archive, 'temporary_file_path'):
+        return archive.temporary_file_path()
+    copy = stack.enter_context(tempfile.NamedTemporaryFile(suffix='.zip'))
+    archive.seek(0)
+    shutil.copyfileobj(archive, copy)
+    copy.flush()
+    return copy.name
+
+
+class WorkerArchives:
+    """One ZipFile per worker thread, opened on first use and closed together"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.opened = []
+
+    def get(self):
+        zf = getattr(self.local, 'zf', None)
+        if zf is None:
+            zf = self.local.zf = zipfile.ZipFile(self.path)
+            with self.lock:
+                self.opened.append(zf)
+        return zf
+
+    def close(self):
+        for zf in self.opened:
+            zf.close()
+
+
+def _store(archives, info, field, storage):
+    """Copy one archive member into storage, chunk by chunk; returns its storage name"""
+    filename = os.path.basename(info.filename)
+    with archives.get().open(info) as handle:
+        content = File(handle, name=filename)
+        # Known from the archive; avoids seeking through the compressed stream to measure it
+        content.size = info.file_size
+        return storage.save(field.generate_filename(None, filename), content)
+
+
+def upload_deliverables(archive, manifest=None, workers=None, progress=None):
+    """
+    Store every file in the archive and create its StudentDeliverable
+    - archive: path or file object of the ZIP
+    - manifest: file object of the manifest CSV (defaults to manifest.csv in the ZIP)
+    - progress: called with (files stored, total) as each file is written
+    If anything fails, files already stored are deleted and no rows are created.
+    Returns: number of deliverables created
+    """
+    field = StudentDeliverable._meta.get_field('file_upload')
+    storage = field.storage
+
+    with contextlib.ExitStack() as stack:
+        path = archive_path(archive, stack)
+        with zipfile.ZipFile(path) as zf:
+            planned = plan_upload(zf, read_manifest(zf, manifest))
+        archives = WorkerArchives(path)
+        stack.callback(archives.close)
+
+        futures = {}
+        try:
+            with ThreadPoolExecutor(max_workers=workers or settings.BULK_UPLOAD_WORKERS) as pool:
+                futures = {
+                    pool.submit(_store, archives, info, field, storage): deliverable
+                    for info, deliverable in planned
+                }
+                try:
+                    for stored, future in enumerate(as_completed(futures), start=1):
+                        futures[future].file_upload = future.result()
+                        if progress:
+                            progress(stored, len(planned))
+                except BaseException:
+                    pool.shutdown(cancel_futures=True)
+                    raise
+
+            with transaction.atomic():
+                StudentDeliverable.objects.bulk_create([d for _, d in planned], batch_size=500)
+        except BaseException:
+            for future in futures:
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    storage.delete(future.result())
+            raise
+
+    return len(planned)
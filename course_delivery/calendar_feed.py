@@ -0,0 +1,147 @@
+"""
+Calendar Feed
+A user's course sessions as an iCalendar (.ics) feed for calendar apps, from the
+same visibility-resolved session set as the dashboard.
+- the feed is identified by everything it depends on: the user, the courses they're
+  enrolled in and each course's content version; that identity is the ETag
+- calendar apps poll often, so a matching If-None-Match/If-Modified-Since is answered
+  with 304 before any session is loaded
+- otherwise the body comes from the cache, or is streamed from the database a chunk
+  of sessions at a time and cached as it completes; feeds over
+  CALENDAR_FEED_CACHE_MAX_BYTES are not held in memory or cached
+- DTSTAMP is when the feed was generated and LAST-MODIFIED when the session last changed
+The cached body is shared by every request for the feed, so links and UIDs are built
+from SITE_URL rather than the requesting host. Meeting passwords are left out: the
+token URL is handed to calendar providers, which store and sync the events.
+"""
+
+import datetime
+import hashlib
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+
+from .content_cache import get_content_versions
+
+# Part of the feed identity; bump when the generated calendar changes shape
+FEED_FORMAT = 3
+
+# Sessions loaded per query while streaming
+CHUNK_SIZE = 500
+
+# How often calendar apps are asked to refresh
+REFRESH_INTERVAL = 'PT1H'
+
+
+def feed_digest(user_id, product_ids):
+    """Identity of a user's feed: changes whenever its enrolments or their content change"""
+    versions = get_content_versions(sorted(product_ids))
+    identity = ":".join([str(FEED_FORMAT), str(user_id)] + [f"{p}={v}" for p, v in versions.items()])
+    return hashlib.md5(identity.encode()).hexdigest()
+
+
+def feed_cache_key(user_id, digest):
+    return f"calendar_feed:{user_id}:{digest}"
+
+
+def escape_text(value):
+    """Escape a TEXT value (RFC 5545 3.3.11)"""
+    return (
+        (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n')
+    )
+
+
+def fold(line):
+    """Fold a content line to 75 octets per physical line (RFC 5545 3.1)"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        # Don't split a multi-byte character
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        # Continuation lines start with a space, which counts towards their 75
+        limit = 74
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def format_datetime(value):
+    return value.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def calendar_header(name):
+    return ''.join(fold(line) for line in [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//EduCounsel//Course Sessions//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape_text(name)}',
+        f'REFRESH-INTERVAL;VALUE=DURATION:{REFRESH_INTERVAL}',
+        f'X-PUBLISHED-TTL:{REFRESH_INTERVAL}',
+    ])
+
+
+def session_event(session, generated_at):
+    description = [session.description]
+    if session.meeting_link:
+        description.append(f"Join: {session.meeting_link}")
+    if session.recording_url:
+        description.append(f"Recording: {session.recording_url}")
+    details = "\n".join(d for d in description if d)
+    url = settings.SITE_URL + reverse('dashboard:course_delivery:session_detail', args=[session.id])
+
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:session-{session.id}@{urlsplit(settings.SITE_URL).netloc}',
+        f'DTSTAMP:{format_datetime(generated_at)}',
+        f'LAST-MODIFIED:{format_datetime(session.updated_at)}',
+        f'DTSTART:{format_datetime(session.start_time)}',
+        f'DTEND:{format_datetime(session.end_time)}',
+        f'SUMMARY:{escape_text(session.title)}',
+        f'DESCRIPTION:{escape_text(details)}',
+        f'LOCATION:{escape_text(session.get_meeting_platform_display())}',
+        f'CATEGORIES:{escape_text(session.product.name)}',
+        f'URL:{url}',
+        'END:VEVENT',
+    ]
+    return ''.join(fold(line) for line in lines)
+
+
+def feed_parts(sessions, generated_at):
+    yield calendar_header('EduCounsel sessions')
+    for session in sessions.iterator(chunk_size=CHUNK_SIZE):
+        yield session_event(session, generated_at)
+    yield 'END:VCALENDAR\r\n'
+
+
+def stream_feed(sessions, cache_key):
+    """
+    Yield the calendar a chunk at a time; once complete it is cached for the next poll
+    The body is only kept while it stays under CALENDAR_FEED_CACHE_MAX_BYTES, so a large
+    feed is streamed without being held in memory and rebuilt on each poll instead.
+    """
+    generated_at = timezone.now()
+    parts, size = [], 0
+    for part in feed_parts(sessions, generated_at):
+        if parts is not None:
+            size += len(part.encode('utf-8'))
+            if size > settings.CALENDAR_FEED_CACHE_MAX_BYTES:
+                parts = None
+            else:
+                parts.append(part)
+        yield part
+    if parts is not None:
+        cache.set(cache_key, {
+            'generated_at': generated_at,
+            'body': ''.join(parts),
+        }, settings.COURSE_CONTENT_CACHE_TIMEOUT)
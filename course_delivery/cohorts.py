@@ -0,0 +1,99 @@
+"""
+Cohort Assignment
+Adds students to cohorts in bulk, either from a CSV of usernames/emails or from a
+filter (everyone currently enrolled in a course). Memberships are written with
+bulk_create, and the content version of every course using the cohort is bumped
+so per-user caches pick up the new audience.
+A cohort that is the only audience of a session or resource can't be deleted:
+without it the item would have no restriction left and open up to every enrolled
+student. Remove it from those items (or restrict them otherwise) first.
+"""
+
+import csv
+import io
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, ProtectedError, Q
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from products.models import UserSubscription
+
+from .access import _through_rows
+from .content_cache import bump_content_version, cohort_product_ids
+from .models import Cohort, CohortMembership, CourseResource, CourseSession
+
+# Memberships inserted per query
+BATCH_SIZE = 1000
+
+
+def users_from_csv(file):
+    """
+    User ids for the usernames/emails in a CSV's first column (a header row is skipped)
+    Returns: (user ids, identifiers that matched no user)
+    """
+    data = file.read()
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    identifiers = {
+        row[0].strip() for row in csv.reader(io.StringIO(text))
+        if row and row[0].strip() and row[0].strip().lower() not in ('username', 'email', 'user')
+    }
+    found = User.objects.filter(Q(username__in=identifiers) | Q(email__in=identifiers)).values_list('id', 'username', 'email')
+    user_ids = set()
+    matched = set()
+    for user_id, username, email in found:
+        user_ids.add(user_id)
+        matched.update([username, email])
+    return user_ids, sorted(identifiers - matched)
+
+
+def enrolled_user_ids(product):
+    """Users with an active subscription to this course"""
+    return set(UserSubscription.objects.filter(
+        product=product, status='active', is_active=True, expiry_date__gt=timezone.now()
+    ).values_list('user_id', flat=True))
+
+
+def assign_members(cohort, user_ids, replace=False):
+    """
+    Add these users to the cohort (and with replace, remove everyone else)
+    Returns: (added, removed)
+    """
+    user_ids = set(user_ids)
+    with transaction.atomic():
+        removed = 0
+        if replace:
+            removed, _ = cohort.memberships.exclude(user_id__in=user_ids).delete()
+        existing = set(cohort.memberships.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+        new = [CohortMembership(cohort=cohort, user_id=user_id) for user_id in user_ids - existing]
+        CohortMembership.objects.bulk_create(new, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        if new or removed:
+            bump_content_version(*cohort_product_ids(cohort.pk))
+    return len(new), removed
+
+
+def sole_audience_of(*cohort_ids):
+    """Non-public sessions and resources restricted to these cohorts and nothing else"""
+    items = []
+    for model in (CourseSession, CourseResource):
+        specific_users, _ = _through_rows(model, 'specific_users')
+        cohorts, cohort_field = _through_rows(model, 'cohorts')
+        items.extend(model.objects.filter(cohorts__in=cohort_ids, is_public=False).annotate(
+            has_specific_users=Exists(specific_users),
+            has_other_cohorts=Exists(cohorts.exclude(**{f"{cohort_field}_id__in": cohort_ids})),
+        ).filter(has_specific_users=False, has_other_cohorts=False).distinct())
+    return items
+
+
+@receiver(pre_delete, sender=Cohort)
+def protect_restricted_content(sender, instance, **kwargs):
+    # Deleting the cohort removes its M2M rows without m2m_changed, which would silently open these items
+    items = sole_audience_of(instance.pk)
+    if items:
+        raise ProtectedError(
+            f"Cohort '{instance}' is the only audience of {len(items)} sessions/resources; "
+            "remove it from them before deleting it",
+            set(items),
+        )
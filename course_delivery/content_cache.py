@@ -0,0 +1,165 @@
+"""
+Course Content Cache
+Serialised sessions and resources are shared by every student of a course, so they
+are cached per object under the course's content version:
+- each product has a version counter (products.CacheVersion), bumped in the writer's
+  transaction whenever its sessions or resources are saved, deleted or have their
+  specific users or cohorts changed, when members of those cohorts change or a cohort
+  is deleted, and when the product itself is saved (its name is in the payload)
+- the counter lives in the database, so a bump made by one server process is seen by
+  every other one even with a per-process cache
+- fragments are keyed by product, version and object id, so a bump orphans all of
+  a course's fragments at once and they expire after COURSE_CONTENT_CACHE_TIMEOUT
+Which objects a user sees is still decided per request by the visibility queries;
+only the serialisation is shared.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.urls import reverse
+
+from products.models import CacheVersion, MyProducts
+
+from .models import Cohort, CohortMembership, CourseResource, CourseSession
+
+
+# Part of every fragment key; bump when the serialised shape changes so old fragments are ignored
+FRAGMENT_FORMAT = 2
+
+
+def content_version_name(product_id):
+    return f"course_content:{product_id}"
+
+
+def get_content_version(product_id):
+    """Current content version of a product"""
+    name = content_version_name(product_id)
+    return CacheVersion.current(name)[name]
+
+
+def get_content_versions(product_ids):
+    """Current content versions of several products in one query, keyed by product id"""
+    names = {product_id: content_version_name(product_id) for product_id in product_ids}
+    versions = CacheVersion.current(*names.values())
+    return {product_id: versions[name] for product_id, name in names.items()}
+
+
+def bump_content_version(*product_ids):
+    """
+    Give these products a new content version in the current transaction
+    Other processes see it when the transaction commits, together with the changed rows.
+    """
+    CacheVersion.bump(*[content_version_name(product_id) for product_id in set(product_ids) if product_id])
+
+
+def serialize_session(session):
+    return {
+        'id': session.id,
+        'title': session.title,
+        'description': session.description,
+        'start_time': session.start_time.isoformat(),
+        'end_time': session.end_time.isoformat(),
+        'platform': session.get_meeting_platform_display(),
+        'meeting_link': session.meeting_link,
+        'meeting_password': session.meeting_password,
+        'recording_url': session.recording_url,
+        'product_name': session.product.name,
+    }
+
+
+def serialize_resource(resource):
+    return {
+        'id': resource.id,
+        'title': resource.title,
+        'resource_type': resource.resource_type,
+        'resource_type_display': resource.get_resource_type_display(),
+        'content': resource.content,
+        'video_url': resource.video_url,
+        'file_url': reverse('dashboard:course_delivery:resource_download', args=[resource.id]) if resource.file_upload else None,
+        'product_name': resource.product.name,
+    }
+
+
+def _fragments(kind, model, serialize, product_id, ids, version=None):
+    """
+    Serialised objects for these ids, in order; misses are loaded in one query and cached
+    Pass the product's content version when the caller already has it.
+    """
+    if not ids:
+        return []
+    if version is None:
+        version = get_content_version(product_id)
+    keys = {obj_id: f"course_content:{FRAGMENT_FORMAT}:{product_id}:{version}:{kind}:{obj_id}" for obj_id in ids}
+    cached = cache.get_many(keys.values())
+
+    missing = [obj_id for obj_id, key in keys.items() if key not in cached]
+    if missing:
+        loaded = {
+            keys[obj.id]: serialize(obj)
+            for obj in model.objects.filter(id__in=missing).select_related('product')
+        }
+        cache.set_many(loaded, settings.COURSE_CONTENT_CACHE_TIMEOUT)
+        cached.update(loaded)
+
+    return [cached[keys[obj_id]] for obj_id in ids if keys[obj_id] in cached]
+
+
+def session_fragments(product_id, session_ids, version=None):
+    return _fragments('session', CourseSession, serialize_session, product_id, session_ids, version)
+
+
+def resource_fragments(product_id, resource_ids, version=None):
+    return _fragments('resource', CourseResource, serialize_resource, product_id, resource_ids, version)
+
+
+@receiver([post_save, post_delete], sender=CourseSession)
+@receiver([post_save, post_delete], sender=CourseResource)
+def bump_on_content_change(sender, instance, **kwargs):
+    bump_content_version(instance.product_id)
+
+
+@receiver(m2m_changed, sender=CourseSession.specific_users.through)
+@receiver(m2m_changed, sender=CourseResource.specific_users.through)
+@receiver(m2m_changed, sender=CourseSession.cohorts.through)
+@receiver(m2m_changed, sender=CourseResource.cohorts.through)
+def bump_on_visibility_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        bump_content_version(instance.product_id)
+        return
+    # Changed from the user's/cohort's side: pk_set holds the sessions/resources
+    content_model = CourseSession if sender in (CourseSession.specific_users.through, CourseSession.cohorts.through) else CourseResource
+    if pk_set:
+        product_ids = content_model.objects.filter(pk__in=pk_set).values_list('product_id', flat=True)
+    else:
+        # post_clear doesn't say what was removed, so bump every course
+        product_ids = content_model.objects.order_by().values_list('product_id', flat=True).distinct()
+    bump_content_version(*product_ids)
+
+
+def cohort_product_ids(*cohort_ids):
+    """Courses with sessions or resources restricted to these cohorts"""
+    product_ids = set()
+    for model in (CourseSession, CourseResource):
+        product_ids.update(model.objects.filter(cohorts__in=cohort_ids).values_list('product_id', flat=True))
+    return product_ids
+
+
+@receiver([post_save, post_delete], sender=CohortMembership)
+def bump_on_membership_change(sender, instance, **kwargs):
+    # Bulk assignment (course_delivery.cohorts) inserts without signals and bumps itself
+    bump_content_version(*cohort_product_ids(instance.cohort_id))
+
+
+@receiver(pre_delete, sender=Cohort)
+def bump_on_cohort_delete(sender, instance, **kwargs):
+    # Its M2M rows are cascade-deleted without m2m_changed, so find the courses while they still exist
+    bump_content_version(*cohort_product_ids(instance.pk))
+
+
+@receiver(post_save, sender=MyProducts)
+def bump_on_product_change(sender, instance, **kwargs):
+    bump_content_version(instance.pk)
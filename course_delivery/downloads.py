@@ -0,0 +1,153 @@
+"""
+Protected File Delivery
+Course materials and student deliverables are downloaded through views that check
+access first. The transfer itself is then handed off, per PROTECTED_MEDIA_SERVER:
+- 'nginx':  X-Accel-Redirect to PROTECTED_MEDIA_INTERNAL_URL + the file's storage name.
+            Needs an internal location serving MEDIA_ROOT, e.g.
+                location /protected-media/ { internal; alias /path/to/media/; }
+            and no public location for course_materials/ or student_specific_files/
+- 'apache': X-Sendfile with the file's absolute path (mod_xsendfile)
+- '':       Django streams it with FileResponse, which uses the WSGI server's
+            file wrapper (sendfile) where one is available
+When Django serves the file itself it supports resumable and parallel downloads:
+a strong ETag, If-None-Match/If-Range, and single byte ranges ('Range: bytes=a-b')
+answered with 206 Partial Content, read from the storage backend in chunks.
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, quote_etag
+
+# Bytes read from storage per chunk of a partial response
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _local_path(field_file):
+    """Absolute path of the file, or None for storages that aren't on the local filesystem"""
+    try:
+        return field_file.path
+    except NotImplementedError:
+        return None
+
+
+def _modified_time(field_file):
+    try:
+        return field_file.storage.get_modified_time(field_file.name)
+    except (NotImplementedError, OSError):
+        return None
+
+
+def file_etag(field_file, modified):
+    """
+    Strong ETag from the storage name, size and modification time
+    Uploads get unique storage names, so this changes whenever the bytes can have changed.
+    """
+    stamp = modified.timestamp() if modified else ''
+    digest = hashlib.md5(f"{field_file.name}:{field_file.size}:{stamp}".encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def parse_range(header, size):
+    """
+    The (start, end) byte positions (inclusive) asked for by a single-range header
+    Returns: (start, end), None to serve the whole file (no range, or several),
+             or False if the range can't be satisfied
+    """
+    match = RANGE_RE.match(header.strip().replace(' ', ''))
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(field_file, start, end):
+    """Yield bytes start..end (inclusive) of the file, one chunk at a time"""
+    remaining = end - start + 1
+    with field_file.open('rb') as handle:
+        handle.seek(start)
+        while remaining > 0:
+            chunk = handle.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, field_file, as_attachment=True):
+    """Response delivering a stored file, handed to the web server where configured"""
+    filename = os.path.basename(field_file.name)
+    server = settings.PROTECTED_MEDIA_SERVER
+    path = _local_path(field_file)
+
+    if server == 'nginx' or (server == 'apache' and path):
+        response = HttpResponse()
+        content_type, _ = mimetypes.guess_type(filename)
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        if server == 'nginx':
+            response['X-Accel-Redirect'] = settings.PROTECTED_MEDIA_INTERNAL_URL + quote(field_file.name)
+        else:
+            response['X-Sendfile'] = path
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+        return response
+
+    size = field_file.size
+    modified = _modified_time(field_file)
+    etag = file_etag(field_file, modified)
+    last_modified = modified.timestamp() if modified else None
+
+    # 304 for a client whose copy is still current
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and request.method in ('GET', 'HEAD'):
+        # If-Range: only resume if the file is still the one the client started on
+        if_range = request.headers.get('If-Range')
+        if not if_range or if_range.strip() == etag:
+            byte_range = parse_range(range_header, size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+    elif byte_range:
+        start, end = byte_range
+        content_type, _ = mimetypes.guess_type(filename)
+        response = StreamingHttpResponse(
+            _read_range(field_file, start, end),
+            status=206,
+            content_type=content_type or 'application/octet-stream'
+        )
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    else:
+        response = FileResponse(field_file.open('rb'), as_attachment=as_attachment, filename=filename)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
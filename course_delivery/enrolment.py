@@ -0,0 +1,58 @@
+"""
+Enrolment Context
+The user's enrolled products for the current request, computed once and shared by
+every course-delivery helper. Helpers take an `enrolment` argument and otherwise
+discover the one memoised on the user object (request.user lives for one request).
+"""
+
+from django.utils.functional import cached_property
+
+from products.entitlements import get_entitlements
+from products.models import MyProducts
+
+
+class EnrolmentContext:
+    """A user's enrolments: the entitlement snapshot plus the enrolled product rows"""
+
+    def __init__(self, user, entitlements=None):
+        self.user = user
+        self.entitlements = entitlements or get_entitlements(user)
+
+    def __repr__(self):
+        return f"<EnrolmentContext user={self.user.pk} products={sorted(self.product_ids)}>"
+
+    @property
+    def product_ids(self):
+        return self.entitlements.active_product_ids
+
+    @cached_property
+    def products(self):
+        """Enrolled products, in the snapshot's order, loaded with one query"""
+        enrolled = self.entitlements.enrolled_products
+        products = MyProducts.objects.in_bulk([p.id for p in enrolled])
+        return [products[p.id] for p in enrolled if p.id in products]
+
+    @cached_property
+    def products_by_id(self):
+        return {product.id: product for product in self.products}
+
+    def product(self, product_id):
+        """The enrolled product with this id, or None if the user isn't enrolled in it"""
+        try:
+            return self.products_by_id.get(int(product_id))
+        except (TypeError, ValueError):
+            return None
+
+    def is_enrolled(self, product):
+        return self.entitlements.is_enrolled(product)
+
+
+def get_enrolment(user, enrolment=None):
+    """The given context, or the one memoised on this user for the current request"""
+    if enrolment is not None:
+        return enrolment
+    enrolment = getattr(user, '_enrolment', None)
+    if enrolment is None:
+        enrolment = EnrolmentContext(user)
+        user._enrolment = enrolment
+    return enrolment
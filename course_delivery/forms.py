@@ -0,0 +1,44 @@
+import zipfile
+
+from django import forms
+
+from products.models import MyProducts
+
+
+class BulkDeliverableUploadForm(forms.Form):
+    archive = forms.FileField(help_text="ZIP of the files to deliver")
+    manifest = forms.FileField(
+        required=False,
+        help_text="CSV with columns file, student, product, title (and optionally remarks, session). "
+                  "Leave empty if the ZIP contains manifest.csv."
+    )
+
+    def clean_archive(self):
+        archive = self.cleaned_data['archive']
+        if not zipfile.is_zipfile(archive):
+            raise forms.ValidationError("This is not a ZIP file.")
+        archive.seek(0)
+        return archive
+
+
+class CohortAssignForm(forms.Form):
+    csv_file = forms.FileField(
+        required=False,
+        label="CSV of students",
+        help_text="Usernames or emails in the first column"
+    )
+    enrolled_in = forms.ModelChoiceField(
+        queryset=MyProducts.objects.all(),
+        required=False,
+        help_text="Add everyone currently enrolled in this course"
+    )
+    replace = forms.BooleanField(
+        required=False,
+        help_text="Remove current members who aren't in this selection"
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('csv_file') and not cleaned_data.get('enrolled_in'):
+            raise forms.ValidationError("Upload a CSV or choose a course.")
+        return cleaned_data
@@ -0,0 +1,192 @@
+"""
+Live Session Events
+Pushes session status changes to open dashboards over Server-Sent Events (ASGI only):
+- 'started' when a session goes live
+- 'ended' when it finishes
+- 'recording' when a finished session gets its recording link
+Each server process runs one broadcaster. While anyone is connected it checks the
+database once per tick (LIVE_EVENTS_TICK_SECONDS) with a single bounded query,
+however many clients there are, and fans each event out to the queues of connected
+users who are enrolled in that course and can see the session.
+"""
+
+import asyncio
+import datetime
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .content_cache import serialize_session
+from .models import CourseSession
+
+logger = logging.getLogger(__name__)
+
+# Finished sessions are watched this long for a recording link being added
+RECORDING_WATCH_WINDOW = datetime.timedelta(days=1)
+
+# Comment line sent when idle so proxies don't close the connection
+KEEPALIVE_SECONDS = 20
+
+# Events a client may fall behind by before it is told to reload instead
+QUEUE_SIZE = 100
+
+# How long the browser waits before reconnecting (milliseconds)
+RECONNECT_MS = 10000
+
+EVENT_STATUS = {'started': 'Live', 'ended': 'Completed', 'recording': 'Completed'}
+
+
+def format_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+class Subscriber:
+    """One connected client: the courses it listens to and its pending events"""
+
+    def __init__(self, user_id, product_ids):
+        self.user_id = user_id
+        self.product_ids = frozenset(product_ids)
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = False
+
+    def push(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped = True
+
+
+class SessionEventBroadcaster:
+    """Single per-process scheduler that turns session start/end/recording changes into events"""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.task = None
+        self.last_tick = None
+        # Recently finished sessions already known to have a recording
+        self.recordings = None
+
+    def subscribe(self, user_id, product_ids):
+        subscriber = Subscriber(user_id, product_ids)
+        self.subscribers.add(subscriber)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def run(self):
+        """Tick while anyone is listening; stops with the last subscriber"""
+        self.last_tick = timezone.now()
+        self.recordings = None
+        try:
+            while self.subscribers:
+                await asyncio.sleep(settings.LIVE_EVENTS_TICK_SECONDS)
+                try:
+                    await self.tick()
+                except Exception:
+                    logger.exception("Live session event tick failed")
+        finally:
+            self.task = None
+
+    async def tick(self):
+        now = timezone.now()
+        product_ids = set().union(*(s.product_ids for s in self.subscribers))
+        if product_ids:
+            events = await sync_to_async(self.collect)(product_ids, self.last_tick, now)
+        else:
+            events = []
+        self.last_tick = now
+
+        for product_id, allowed_user_ids, message in events:
+            for subscriber in list(self.subscribers):
+                if product_id not in subscriber.product_ids:
+                    continue
+                if allowed_user_ids is not None and subscriber.user_id not in allowed_user_ids:
+                    continue
+                subscriber.push(message)
+
+    def collect(self, product_ids, since, now):
+        """
+        Events for sessions that started, ended or got a recording since the last tick
+        Returns: list of (product_id, user ids allowed to see it or None for everyone, message)
+        """
+        sessions = list(CourseSession.objects.filter(product_id__in=product_ids).filter(
+            Q(start_time__gt=since, start_time__lte=now) |
+            Q(end_time__gt=since, end_time__lte=now) |
+            Q(end_time__gt=now - RECORDING_WATCH_WINDOW, end_time__lte=now, recording_url__gt='')
+        ).select_related('product').order_by('start_time'))
+
+        recordings = {s.id for s in sessions if s.recording_url and s.end_time <= now}
+        known_recordings, self.recordings = self.recordings, recordings
+
+        restricted = audiences([s.id for s in sessions if not s.is_public])
+
+        events = []
+        for session in sessions:
+            names = []
+            if since < session.start_time <= now:
+                names.append('started')
+            if since < session.end_time <= now:
+                names.append('ended')
+            elif known_recordings is not None and session.id in recordings and session.id not in known_recordings:
+                names.append('recording')
+
+            allowed = None if session.is_public else restricted.get(session.id)
+            for name in names:
+                data = dict(serialize_session(session), status=EVENT_STATUS[name], product_id=session.product_id)
+                events.append((session.product_id, allowed, format_event(name, data)))
+        return events
+
+
+def audiences(session_ids):
+    """
+    User ids allowed to see each restricted session: its specific users plus its cohorts' members
+    Sessions missing from the result are open to everyone enrolled.
+    """
+    restricted = {}
+    specific_users = CourseSession.specific_users.through.objects.filter(coursesession_id__in=session_ids)
+    for session_id, user_id in specific_users.values_list('coursesession_id', 'user_id'):
+        restricted.setdefault(session_id, set()).add(user_id)
+    cohorts = CourseSession.cohorts.through.objects.filter(coursesession_id__in=session_ids)
+    for session_id, user_id in cohorts.values_list('coursesession_id', 'cohort__memberships__user'):
+        members = restricted.setdefault(session_id, set())
+        if user_id is not None:
+            members.add(user_id)
+    return restricted
+
+
+broadcaster = SessionEventBroadcaster()
+
+
+async def event_stream(user_id, product_ids):
+    """
+    SSE body for one client
+    Ends after LIVE_EVENTS_MAX_SECONDS so the browser reconnects and enrolment is checked again.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.LIVE_EVENTS_MAX_SECONDS
+    subscriber = broadcaster.subscribe(user_id, product_ids)
+    try:
+        yield f"retry: {RECONNECT_MS}\n\n"
+        while True:
+            if subscriber.dropped:
+                # Fell too far behind: the client reloads rather than replaying a partial backlog
+                yield format_event('resync', {})
+                return
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), timeout=min(KEEPALIVE_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield message
+    finally:
+        broadcaster.unsubscribe(subscriber)
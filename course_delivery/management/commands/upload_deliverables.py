@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from course_delivery.bulk_upload import ManifestError, upload_deliverables
+
+
+class Command(BaseCommand):
+    help = "Create student deliverables from a ZIP of files and a manifest CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('archive', help="ZIP file containing the deliverables")
+        parser.add_argument('--manifest', default=None,
+                            help="Manifest CSV (defaults to manifest.csv inside the ZIP)")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Files written in parallel (defaults to BULK_UPLOAD_WORKERS)")
+
+    def handle(self, *args, **options):
+        def progress(stored, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{stored}/{total} files stored")
+
+        started = time.monotonic()
+        manifest = open(options['manifest'], 'rb') if options['manifest'] else None
+        try:
+            created = upload_deliverables(
+                options['archive'],
+                manifest=manifest,
+                workers=options['workers'],
+                progress=progress,
+            )
+        except ManifestError as e:
+            raise CommandError("\n".join(["Nothing was uploaded:"] + e.errors))
+        except OSError as e:
+            raise CommandError(str(e))
+        finally:
+            if manifest:
+                manifest.close()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Created {created} deliverables in {elapsed:.1f}s"))
@@ -1,3 +1,5 @@
+import secrets
+
 from django.db import models
 from django.contrib.auth.models import User
 from products.models import MyProducts
@@ -42,12 +44,24 @@ class CourseSession(models.Model):
         related_name='special_sessions',
         help_text="Select users ONLY for 1-on-1 or special group sessions. Leave empty for all enrolled students."
     )
+    # Same rule for groups: members of any selected cohort can see it too
+    cohorts = models.ManyToManyField(
+        'Cohort',
+        blank=True,
+        related_name='sessions',
+        help_text="Groups of students who can see this session. Leave empty (with no specific users) for all enrolled students."
+    )
 
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['start_time']
         verbose_name = "Live Session"
+        indexes = [
+            # Live / upcoming / completed lookups per course
+            models.Index(fields=['product', 'start_time', 'end_time']),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.start_time.strftime('%d %b %H:%M')}"
@@ -93,6 +107,12 @@ class CourseResource(models.Model):
         related_name='special_resources',
         help_text="Limit visibility to specific users only."
     )
+    cohorts = models.ManyToManyField(
+        'Cohort',
+        blank=True,
+        related_name='resources',
+        help_text="Limit visibility to members of these groups."
+    )
 
     display_order = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -131,3 +151,71 @@ class StudentDeliverable(models.Model):
 
     def __str__(self):
         return f"File for {self.student.username}: {self.title}"
+
+
+class Cohort(models.Model):
+    """
+    A named group of students (e.g. a batch or a counselling group).
+    Sessions and resources restricted to a cohort are visible to all its members.
+    """
+    name = models.CharField(max_length=200, unique=True)
+    product = models.ForeignKey(
+        MyProducts, on_delete=models.SET_NULL, null=True, blank=True, related_name='cohorts',
+        help_text="Optional: the course this group belongs to"
+    )
+    description = models.TextField(blank=True)
+    members = models.ManyToManyField(User, through='CohortMembership', related_name='cohorts', blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class CohortMembership(models.Model):
+    """
+    One student in one cohort. Visibility checks look memberships up by user.
+    """
+    cohort = models.ForeignKey(Cohort, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cohort_memberships')
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cohort', 'user'], name='unique_cohort_membership'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'cohort']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} in {self.cohort.name}"
+
+
+class CalendarFeedToken(models.Model):
+    """
+    Secret token in a user's calendar (.ics) feed URL.
+    Calendar apps can't log in, so the token alone identifies the user; regenerate it to revoke old links.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='calendar_feed_token')
+    token = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        if not self.token:
+            self.token = secrets.token_urlsafe(32)
+        super().save(*args, **kwargs)
+
+    def regenerate(self):
+        self.token = secrets.token_urlsafe(32)
+        self.save(update_fields=['token'])
+
+    class Meta:
+        verbose_name = 'Calendar Feed Token'
+        verbose_name_plural = 'Calendar Feed Tokens'
+
+    def __str__(self):
+        return f"Calendar feed for {self.user.username}"
@@ -1,3 +1,468 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.db.models import ProtectedError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from products.models import MyProducts, Order
+
+from .access import visible_to
+from .views import get_session_buckets
+from .bulk_upload import ManifestError, upload_deliverables
+from .cohorts import assign_members, users_from_csv
+from .content_cache import get_content_version
+from .enrolment import get_enrolment
+from .live_events import SessionEventBroadcaster
+from .models import CalendarFeedToken, Cohort, CourseResource, CourseSession, StudentDeliverable
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    buffer.seek(0)
+    return buffer
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class BulkUploadTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        self.students = [
+            User.objects.create_user(username=f'student{i}', email=f'student{i}@example.com', password='pass12345')
+            for i in range(12)
+        ]
+
+    def archive(self, rows=None):
+        files = {f'reports/{s.username}.pdf': f'report for {s.username}'.encode() * 1000 for s in self.students}
+        files['manifest.csv'] = "file,student,product,title\n" + "".join(
+            rows or [f"reports/{s.username}.pdf,{s.email},counselling,Report\n" for s in self.students]
+        )
+        return make_zip(files)
+
+    def test_every_worker_reads_its_own_copy_of_the_archive(self):
+        created = upload_deliverables(self.archive(), workers=4)
+
+        self.assertEqual(created, 12)
+        for deliverable in StudentDeliverable.objects.select_related('student'):
+            with deliverable.file_upload.open('rb') as handle:
+                self.assertEqual(handle.read(), f'report for {deliverable.student.username}'.encode() * 1000)
+
+    def test_bad_manifest_uploads_nothing(self):
+        rows = ["reports/student0.pdf,student0,counselling,Report\n", "missing.pdf,nobody,counselling,\n"]
+        with self.assertRaises(ManifestError) as caught:
+            upload_deliverables(self.archive(rows))
+
+        self.assertEqual(len(caught.exception.errors), 1)
+        self.assertFalse(StudentDeliverable.objects.exists())
+
+    def test_admin_page_reports_an_empty_post(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass12345'))
+        url = reverse('admin:course_delivery_bulk_upload')
+
+        response = self.client.post(url, {})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+
+        archive = SimpleUploadedFile('deliverables.zip', self.archive().getvalue(), 'application/zip')
+        response = self.client.post(url, {'archive': archive})
+        self.assertRedirects(response, reverse('admin:course_delivery_studentdeliverable_changelist'))
+        self.assertEqual(StudentDeliverable.objects.count(), 12)
+
+
+def make_session(product, title, **kwargs):
+    start = timezone.now() + datetime.timedelta(days=1)
+    kwargs.setdefault('meeting_link', 'https://meet.example.com/room')
+    return CourseSession.objects.create(
+        product=product, title=title, start_time=start, end_time=start + datetime.timedelta(hours=1), **kwargs
+    )
+
+
+def enrol(user, product):
+    Order.objects.create(user=user, product=product, original_price=100, final_price=100).mark_completed()
+
+
+class EnrolmentTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        self.other = MyProducts.objects.create(name='Mentoring', slug='mentoring', base_price=100)
+        self.user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        enrol(self.user, self.product)
+
+    def test_enrolment_is_loaded_once_per_user_object(self):
+        user = User.objects.get(pk=self.user.pk)
+        enrolment = get_enrolment(user)
+        self.assertEqual(enrolment.products, [self.product])
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_enrolment(user), enrolment)
+            self.assertEqual(enrolment.product(str(self.product.pk)), self.product)
+            self.assertIsNone(enrolment.product(self.other.pk))
+            self.assertIsNone(enrolment.product('not-a-number'))
+            self.assertFalse(enrolment.is_enrolled(self.other))
+
+
+class SessionBucketTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        self.user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        enrol(self.user, self.product)
+
+    def test_sessions_are_split_into_bounded_buckets(self):
+        now = timezone.now()
+        hour = datetime.timedelta(hours=1)
+        live = make_session(self.product, 'Live')
+        CourseSession.objects.filter(pk=live.pk).update(start_time=now - hour, end_time=now + hour)
+        for i in range(3):
+            make_session(self.product, f'Upcoming {i}')
+        recorded = make_session(self.product, 'Recorded', recording_url='https://video.example.com/1')
+        unrecorded = make_session(self.product, 'Unrecorded')
+        CourseSession.objects.filter(pk__in=[recorded.pk, unrecorded.pk]).update(
+            start_time=now - 3 * hour, end_time=now - 2 * hour
+        )
+
+        buckets = get_session_buckets(self.user, upcoming_limit=2)
+
+        self.assertEqual([s.title for s in buckets['live']], ['Live'])
+        self.assertEqual([s.title for s in buckets['upcoming']], ['Upcoming 0', 'Upcoming 1'])
+        self.assertEqual([s.title for s in buckets['completed']], ['Recorded'])
+
+
+class CourseContentApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        self.user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        enrol(self.user, self.product)
+        self.session = make_session(self.product, 'Mock interview')
+        self.url = reverse('dashboard:course_delivery:get_course_content_by_product', args=[self.product.pk])
+        self.client.force_login(self.user)
+
+    def test_unchanged_content_is_not_modified_until_the_course_changes(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()['upcoming_sessions'][0]['title'], 'Mock interview')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        self.session.title = 'Group session'
+        self.session.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['upcoming_sessions'][0]['title'], 'Group session')
+
+    def test_not_modified_is_answered_before_serialising(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with mock.patch('course_delivery.views.session_fragments') as fragments:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        fragments.assert_not_called()
+
+    def test_content_version_survives_a_cache_reset(self):
+        self.session.save()
+        version = get_content_version(self.product.pk)
+
+        # Another process's cache knows nothing of the bump; the version is in the database
+        cache.clear()
+        self.assertEqual(get_content_version(self.product.pk), version)
+        self.assertGreater(version, 0)
+
+    def test_other_courses_are_refused(self):
+        other = MyProducts.objects.create(name='Mentoring', slug='mentoring', base_price=100)
+        response = self.client.get(reverse('dashboard:course_delivery:get_course_content_by_product', args=[other.pk]))
+        self.assertEqual(response.status_code, 403)
+
+
+class LiveEventTests(TestCase):
+
+    def setUp(self):
+        self.product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        self.member = User.objects.create_user(username='member', email='member@example.com', password='pass12345')
+        cohort = Cohort.objects.create(name='Batch A', product=self.product)
+        cohort.members.add(self.member)
+        self.now = timezone.now()
+        self.open = make_session(self.product, 'Open')
+        self.restricted = make_session(self.product, 'Restricted')
+        self.restricted.cohorts.add(cohort)
+        CourseSession.objects.filter(pk__in=[self.open.pk, self.restricted.pk]).update(
+            start_time=self.now - datetime.timedelta(seconds=5), end_time=self.now + datetime.timedelta(hours=1)
+        )
+
+    def parse(self, message):
+        event, data = message.strip().split('\n')
+        return event[len('event: '):], json.loads(data[len('data: '):])
+
+    def test_started_sessions_are_sent_to_their_audience(self):
+        broadcaster = SessionEventBroadcaster()
+        with self.assertNumQueries(3):
+            events = broadcaster.collect({self.product.pk}, self.now - datetime.timedelta(seconds=10), self.now)
+
+        allowed = {self.parse(message)[1]['title']: users for _, users, message in events}
+        self.assertEqual(allowed, {'Open': None, 'Restricted': {self.member.pk}})
+        self.assertEqual({self.parse(message)[0] for _, _, message in events}, {'started'})
+
+    def test_recording_added_after_the_end_is_sent_once(self):
+        CourseSession.objects.filter(pk=self.open.pk).update(
+            start_time=self.now - datetime.timedelta(hours=2), end_time=self.now - datetime.timedelta(hours=1)
+        )
+        broadcaster = SessionEventBroadcaster()
+        broadcaster.collect({self.product.pk}, self.now - datetime.timedelta(seconds=10), self.now)
+
+        CourseSession.objects.filter(pk=self.open.pk).update(recording_url='https://video.example.com/1')
+        later = self.now + datetime.timedelta(seconds=10)
+        names = [self.parse(message)[0] for _, _, message in broadcaster.collect({self.product.pk}, self.now, later)]
+        self.assertEqual(names, ['recording'])
+        self.assertEqual(broadcaster.collect({self.product.pk}, later, later + datetime.timedelta(seconds=10)), [])
+
+
+class VisibilityTests(TestCase):
+
+    def setUp(self):
+        self.product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+        self.cohort = Cohort.objects.create(name='Batch A', product=self.product)
+        self.cohort.members.add(self.alice)
+
+        self.open = make_session(self.product, 'Open')
+        self.public = make_session(self.product, 'Public', is_public=True)
+        self.for_bob = make_session(self.product, 'For Bob')
+        self.for_bob.specific_users.add(self.bob)
+        self.for_cohort = make_session(self.product, 'For Batch A')
+        self.for_cohort.cohorts.add(self.cohort)
+
+    def visible_titles(self, user):
+        return set(visible_to(CourseSession.objects.all(), user).values_list('title', flat=True))
+
+    def test_restricted_sessions_are_only_visible_to_their_audience(self):
+        self.public.cohorts.add(self.cohort)
+
+        self.assertEqual(self.visible_titles(self.alice), {'Open', 'Public', 'For Batch A'})
+        self.assertEqual(self.visible_titles(self.bob), {'Open', 'Public', 'For Bob'})
+
+    def test_specific_users_and_cohorts_combine(self):
+        self.for_bob.cohorts.add(self.cohort)
+
+        self.assertIn('For Bob', self.visible_titles(self.alice))
+        self.assertIn('For Bob', self.visible_titles(self.bob))
+
+
+class CohortTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        self.students = [
+            User.objects.create_user(username=f'student{i}', email=f'student{i}@example.com', password='pass12345')
+            for i in range(3)
+        ]
+        self.cohort = Cohort.objects.create(name='Batch A', product=self.product)
+        self.session = make_session(self.product, 'For Batch A')
+        self.session.cohorts.add(self.cohort)
+
+    def test_users_from_csv_matches_usernames_and_emails(self):
+        csv_file = io.BytesIO(b"username\nstudent0\nstudent1@example.com\nnobody\n")
+
+        user_ids, unmatched = users_from_csv(csv_file)
+
+        self.assertEqual(user_ids, {self.students[0].pk, self.students[1].pk})
+        self.assertEqual(unmatched, ['nobody'])
+
+    def test_assign_members_adds_replaces_and_bumps_the_course(self):
+        version = get_content_version(self.product.pk)
+        added, removed = assign_members(self.cohort, [s.pk for s in self.students[:2]])
+        self.assertEqual((added, removed), (2, 0))
+        self.assertNotEqual(get_content_version(self.product.pk), version)
+
+        added, removed = assign_members(self.cohort, [self.students[2].pk], replace=True)
+        self.assertEqual((added, removed), (1, 2))
+        self.assertEqual(list(self.cohort.members.all()), [self.students[2]])
+
+    def test_cohort_that_is_the_only_audience_cannot_be_deleted(self):
+        self.cohort.members.add(self.students[0])
+
+        with self.assertRaises(ProtectedError), transaction.atomic():
+            self.cohort.delete()
+
+        self.assertTrue(Cohort.objects.filter(pk=self.cohort.pk).exists())
+        self.assertEqual(list(visible_to(CourseSession.objects.all(), self.students[1])), [])
+
+    def test_deleting_a_cohort_bumps_its_courses(self):
+        self.session.specific_users.add(self.students[0])
+        version = get_content_version(self.product.pk)
+
+        self.cohort.delete()
+
+        self.assertNotEqual(get_content_version(self.product.pk), version)
+        self.assertEqual(list(visible_to(CourseSession.objects.all(), self.students[1])), [])
+
+    def test_admin_delete_page_lists_the_protected_sessions(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass12345'))
+
+        response = self.client.post(
+            reverse('admin:course_delivery_cohort_delete', args=[self.cohort.pk]), {'post': 'yes'}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('For Batch A', ''.join(response.context['protected']))
+        self.assertTrue(Cohort.objects.filter(pk=self.cohort.pk).exists())
+
+
+@override_settings(SITE_URL='https://courses.example.com', ALLOWED_HOSTS=['testserver', '.example.net'])
+class CalendarFeedTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        self.user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        Order.objects.create(
+            user=self.user, product=self.product, original_price=100, final_price=100, status='pending'
+        ).mark_completed()
+        self.session = make_session(self.product, 'Mock interview', meeting_password='s3cret')
+        self.url = reverse('dashboard:course_delivery:calendar_feed', args=[
+            CalendarFeedToken.objects.create(user=self.user).token
+        ])
+
+    def fetch(self, **headers):
+        response = self.client.get(self.url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body.decode()
+
+    def test_feed_links_to_the_site_and_leaves_out_meeting_passwords(self):
+        response, body = self.fetch(HTTP_HOST='attacker.example.net')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('SUMMARY:Mock interview', body)
+        self.assertIn(f'UID:session-{self.session.pk}@courses.example.com', body)
+        self.assertIn('URL:https://courses.example.com/', body)
+        self.assertNotIn('attacker.example.net', body)
+        self.assertNotIn('s3cret', body)
+
+    def test_unchanged_feed_is_not_modified_until_a_session_changes(self):
+        response, first = self.fetch()
+
+        _, body = self.fetch(HTTP_HOST='other.example.net')
+        self.assertEqual(body, first)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        self.session.title = 'Group session'
+        self.session.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_events_are_stamped_with_the_generation_time(self):
+        CourseSession.objects.filter(pk=self.session.pk).update(
+            updated_at=timezone.now() - datetime.timedelta(days=3)
+        )
+        self.session.refresh_from_db()
+
+        _, body = self.fetch()
+
+        updated = self.session.updated_at.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        self.assertIn(f'LAST-MODIFIED:{updated}', body)
+        self.assertNotIn(f'DTSTAMP:{updated}', body)
+
+    @override_settings(CALENDAR_FEED_CACHE_MAX_BYTES=200)
+    def test_large_feeds_are_streamed_without_being_cached(self):
+        response, body = self.fetch()
+
+        self.assertTrue(response.streaming)
+        self.assertIn('SUMMARY:Mock interview', body)
+        self.assertTrue(self.fetch()[0].streaming)
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, PROTECTED_MEDIA_SERVER='')
+class DownloadTests(TestCase):
+
+    def setUp(self):
+        self.product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        self.student = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='pass12345')
+        Order.objects.create(
+            user=self.student, product=self.product, original_price=100, final_price=100, status='pending'
+        ).mark_completed()
+        self.content = bytes(range(256)) * 40
+        self.resource = CourseResource.objects.create(product=self.product, title='Workbook', resource_type='pdf')
+        self.resource.file_upload.save('workbook.pdf', ContentFile(self.content))
+        self.deliverable = StudentDeliverable.objects.create(student=self.student, product=self.product, title='Report')
+        self.deliverable.file_upload.save('report.pdf', ContentFile(b'your report'))
+
+    def download(self, user, url, **headers):
+        self.client.force_login(user)
+        response = self.client.get(url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_only_enrolled_students_download_course_files(self):
+        url = reverse('dashboard:course_delivery:resource_download', args=[self.resource.pk])
+
+        response, body = self.download(self.student, url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+        response, _ = self.download(self.other, url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_deliverables_are_only_served_to_their_student(self):
+        url = reverse('dashboard:course_delivery:deliverable_download', args=[self.deliverable.pk])
+
+        response, body = self.download(self.student, url)
+        self.assertEqual(body, b'your report')
+        response, _ = self.download(self.other, url)
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(PROTECTED_MEDIA_SERVER='nginx', PROTECTED_MEDIA_INTERNAL_URL='/protected-media/')
+    def test_transfer_is_handed_to_nginx(self):
+        url = reverse('dashboard:course_delivery:resource_download', args=[self.resource.pk])
+
+        response, body = self.download(self.student, url)
+
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.resource.file_upload.name)
+        self.assertEqual(body, b'')
+
+    def test_byte_ranges_resume_only_while_the_file_is_unchanged(self):
+        url = reverse('dashboard:course_delivery:resource_download', args=[self.resource.pk])
+        response, _ = self.download(self.student, url)
+        etag = response['ETag']
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response, body = self.download(self.student, url, HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(body, self.content[100:200])
+
+        response, body = self.download(self.student, url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(body, self.content[-10:])
+
+        response, body = self.download(self.student, url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+        response, _ = self.download(self.student, url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(self.download(self.student, url, HTTP_IF_NONE_MATCH=etag)[0].status_code, 304)
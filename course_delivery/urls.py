@@ -8,7 +8,18 @@ urlpatterns = [
     path('api/content/', views.get_course_content_api, name='get_course_content'),
     path('api/content/<int:product_id>/', views.get_course_content_api, name='get_course_content_by_product'),
     
+    # Live session status push (Server-Sent Events, ASGI)
+    path('events/', views.live_session_events, name='live_session_events'),
+    
     # Detail pages
     path('session/<int:session_id>/', views.session_detail, name='session_detail'),
     path('resource/<int:resource_id>/', views.resource_detail, name='resource_detail'),
+    
+    # Protected file downloads
+    path('resource/<int:resource_id>/download/', views.resource_download, name='resource_download'),
+    path('deliverable/<int:deliverable_id>/download/', views.deliverable_download, name='deliverable_download'),
+    
+    # Calendar (.ics) feed of the user's sessions
+    path('calendar/', views.calendar_settings, name='calendar'),
+    path('calendar/<str:token>.ics', views.calendar_feed, name='calendar_feed'),
 ]
@@ -1,114 +1,90 @@
-from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+import hashlib
+
+from django.core.cache import cache
+from django.shortcuts import redirect, render, get_object_or_404
+from django.urls import reverse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET
 
-from .models import CourseSession, CourseResource, StudentDeliverable
-from products.models import MyProducts, UserSubscription
+from .access import can_view, visible_to
+from .calendar_feed import feed_cache_key, feed_digest, stream_feed
+from .content_cache import get_content_versions, resource_fragments, session_fragments
+from .downloads import serve_file
+from .models import CalendarFeedToken, CourseSession, CourseResource, StudentDeliverable
+from .enrolment import get_enrolment
+from .live_events import event_stream
+from products.models import MyProducts
 
 
-def get_user_enrolled_products(user):
+def get_user_enrolled_products(user, enrolment=None):
     """
     Get all active products that a user is enrolled in via their subscriptions.
+    Loaded once per request, see course_delivery.enrolment.
     """
-    active_subscriptions = UserSubscription.objects.filter(
-        user=user,
-        status='active',
-        is_active=True,
-        expiry_date__gt=timezone.now()
-    ).select_related('product')
-    
-    # Get unique products
-    products = []
-    seen_ids = set()
-    for sub in active_subscriptions:
-        if sub.product and sub.product.id not in seen_ids:
-            products.append(sub.product)
-            seen_ids.add(sub.product.id)
-    
-    return products
+    return get_enrolment(user, enrolment).products
+
+
+def _enrolled_product_filter(enrolment, product):
+    """Products to list content for: the given one if enrolled, else all enrolled ones"""
+    if product:
+        return [product] if enrolment.is_enrolled(product) else []
+    return enrolment.product_ids
 
 
-def get_sessions_for_user(user, product=None):
+def get_sessions_for_user(user, product=None, enrolment=None):
     """
     Get all sessions accessible to a user for a specific product or all enrolled products.
-    Logic:
-    - If is_public=True, anyone can see
-    - If specific_users is populated, only those users can see
-    - If specific_users is empty, all enrolled students can see
+    Visibility (public / specific users / all enrolled) is resolved in one query,
+    see course_delivery.access. Returns a lazy queryset ordered by start time.
     """
-    enrolled_products = get_user_enrolled_products(user)
-    
-    if product:
-        if product not in enrolled_products:
-            return CourseSession.objects.none()
-        products_to_query = [product]
-    else:
-        products_to_query = enrolled_products
-    
-    # Get sessions that are:
-    # 1. Public OR
-    # 2. User is in specific_users OR
-    # 3. No specific users set (available to all enrolled)
-    sessions = CourseSession.objects.filter(
-        Q(product__in=products_to_query) &
-        (
-            Q(is_public=True) |
-            Q(specific_users=user) |
-            Q(specific_users__isnull=True)
-        )
-    ).distinct().select_related('product').order_by('start_time')
+    products_to_query = _enrolled_product_filter(get_enrolment(user, enrolment), product)
+    if not products_to_query:
+        return CourseSession.objects.none()
     
-    # Handle empty ManyToMany (no specific users = all enrolled can see)
-    accessible_sessions = []
-    for session in sessions:
-        if session.is_public:
-            accessible_sessions.append(session)
-        elif session.specific_users.exists():
-            if session.specific_users.filter(id=user.id).exists():
-                accessible_sessions.append(session)
-        else:
-            # No specific users = available to all enrolled
-            accessible_sessions.append(session)
-    
-    return accessible_sessions
+    sessions = CourseSession.objects.filter(product__in=products_to_query)
+    return visible_to(sessions, user).select_related('product').order_by('start_time')
 
 
-def get_resources_for_user(user, product=None):
+def get_resources_for_user(user, product=None, enrolment=None):
     """
     Get all resources accessible to a user for a specific product or all enrolled products.
+    Returns a lazy queryset, resolved like get_sessions_for_user.
     """
-    enrolled_products = get_user_enrolled_products(user)
-    
-    if product:
-        if product not in enrolled_products:
-            return CourseResource.objects.none()
-        products_to_query = [product]
-    else:
-        products_to_query = enrolled_products
-    
-    resources = CourseResource.objects.filter(
-        Q(product__in=products_to_query) &
-        (
-            Q(is_public=True) |
-            Q(specific_users=user) |
-            Q(specific_users__isnull=True)
-        )
-    ).distinct().select_related('product').order_by('display_order', '-created_at')
+    products_to_query = _enrolled_product_filter(get_enrolment(user, enrolment), product)
+    if not products_to_query:
+        return CourseResource.objects.none()
     
-    # Handle empty ManyToMany
-    accessible_resources = []
-    for resource in resources:
-        if resource.is_public:
-            accessible_resources.append(resource)
-        elif resource.specific_users.exists():
-            if resource.specific_users.filter(id=user.id).exists():
-                accessible_resources.append(resource)
-        else:
-            accessible_resources.append(resource)
+    resources = CourseResource.objects.filter(product__in=products_to_query)
+    return visible_to(resources, user).select_related('product').order_by('display_order', '-created_at')
+
+
+def get_session_buckets(user, product=None, enrolment=None, upcoming_limit=5, recordings_limit=10, ids_only=False):
+    """
+    Split a user's sessions into live, upcoming and completed-with-recording.
+    Each bucket is its own bounded query on the (product, start_time, end_time) index,
+    so past sessions are never loaded just to be skipped.
+    Returns: dict of lists (of sessions, or their ids) keyed 'live', 'upcoming' and 'completed'
+    """
+    now = timezone.now()
+    sessions = get_sessions_for_user(user, product, enrolment)
+    if ids_only:
+        sessions = sessions.values_list('id', flat=True)
     
-    return accessible_resources
+    return {
+        'live': list(sessions.filter(start_time__lte=now, end_time__gte=now)),
+        'upcoming': list(sessions.filter(start_time__gt=now)[:upcoming_limit]),
+        'completed': list(
+            sessions.filter(end_time__lt=now)
+            .exclude(recording_url__isnull=True)
+            .exclude(recording_url='')[:recordings_limit]
+        ),
+    }
 
 
 def get_deliverables_for_user(user, product=None):
@@ -130,64 +106,49 @@ def get_course_content_api(request, product_id=None):
     Returns JSON with sessions, resources, and deliverables.
     """
     user = request.user
-    enrolled_products = get_user_enrolled_products(user)
+    enrolment = get_enrolment(user)
+    enrolled_products = get_user_enrolled_products(user, enrolment)
     
     # Determine active product
     if product_id:
-        product = get_object_or_404(MyProducts, id=product_id)
-        if product not in enrolled_products:
+        product = enrolment.product(product_id)
+        if product is None:
+            get_object_or_404(MyProducts, id=product_id)
             return JsonResponse({'error': 'Not enrolled in this course'}, status=403)
     else:
         product = enrolled_products[0] if enrolled_products else None
     
-    now = timezone.now()
-    
-    # Get sessions for the product
-    all_sessions = get_sessions_for_user(user, product)
-    
-    # Categorize sessions
-    upcoming_sessions = [s for s in all_sessions if s.start_time > now][:5]
-    live_sessions = [s for s in all_sessions if s.start_time <= now <= s.end_time]
-    completed_sessions = [s for s in all_sessions if s.end_time < now and s.recording_url][:10]
+    # Which sessions and resources this user sees is resolved per request;
+    # their serialised form is shared by the whole course, see content_cache
+    session_ids = get_session_buckets(user, product, enrolment, ids_only=True)
+    resource_ids = list(get_resources_for_user(user, product, enrolment).values_list('id', flat=True)[:20])
+    deliverables = list(get_deliverables_for_user(user, product)[:10])
     
-    # Get resources
-    resources = get_resources_for_user(user, product)
+    # Polling clients send the ETag back and get a 304 while nothing they see has changed:
+    # it covers what is visible and the content versions, so it's known before serialising
+    versions = get_content_versions([p.id for p in enrolled_products])
+    identity = [
+        user.pk, product.id if product else None, sorted(versions.items()), session_ids, resource_ids,
+        [(d.id, d.title, d.remarks, d.file_upload.name) for d in deliverables],
+    ]
+    etag = quote_etag(hashlib.md5(repr(identity).encode()).hexdigest())
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        patch_cache_control(not_modified, private=True, no_cache=True)
+        return not_modified
     
-    # Get deliverables
-    deliverables = get_deliverables_for_user(user, product)
+    version = versions[product.id] if product else None
     
-    def serialize_session(session):
-        return {
-            'id': session.id,
-            'title': session.title,
-            'description': session.description,
-            'start_time': session.start_time.isoformat(),
-            'end_time': session.end_time.isoformat(),
-            'platform': session.get_meeting_platform_display(),
-            'meeting_link': session.meeting_link,
-            'meeting_password': session.meeting_password,
-            'recording_url': session.recording_url,
-            'status': session.status,
-            'product_name': session.product.name,
-        }
-    
-    def serialize_resource(resource):
-        return {
-            'id': resource.id,
-            'title': resource.title,
-            'resource_type': resource.resource_type,
-            'resource_type_display': resource.get_resource_type_display(),
-            'content': resource.content,
-            'video_url': resource.video_url,
-            'file_url': resource.file_upload.url if resource.file_upload else None,
-            'product_name': resource.product.name,
-        }
+    def sessions_with_status(ids, status):
+        fragments = session_fragments(product.id, ids, version) if product else []
+        return [dict(fragment, status=status) for fragment in fragments]
     
     def serialize_deliverable(deliverable):
         return {
             'id': deliverable.id,
             'title': deliverable.title,
-            'file_url': deliverable.file_upload.url if deliverable.file_upload else None,
+            'file_url': reverse('dashboard:course_delivery:deliverable_download', args=[deliverable.id]) if deliverable.file_upload else None,
             'remarks': deliverable.remarks,
             'created_at': deliverable.created_at.isoformat(),
             'product_name': deliverable.product.name,
@@ -203,14 +164,42 @@ def get_course_content_api(request, product_id=None):
             'name': product.name,
             'slug': product.slug
         } if product else None,
-        'live_sessions': [serialize_session(s) for s in live_sessions],
-        'upcoming_sessions': [serialize_session(s) for s in upcoming_sessions],
-        'completed_sessions': [serialize_session(s) for s in completed_sessions],
-        'resources': [serialize_resource(r) for r in resources[:20]],
-        'deliverables': [serialize_deliverable(d) for d in deliverables[:10]],
+        'live_sessions': sessions_with_status(session_ids['live'], 'Live'),
+        'upcoming_sessions': sessions_with_status(session_ids['upcoming'], 'Upcoming'),
+        'completed_sessions': sessions_with_status(session_ids['completed'], 'Completed'),
+        'resources': resource_fragments(product.id, resource_ids, version) if product else [],
+        'deliverables': [serialize_deliverable(d) for d in deliverables],
     }
     
-    return JsonResponse(data)
+    response = JsonResponse(data)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required
+async def live_session_events(request):
+    """
+    Server-Sent Events stream of session starts, ends and new recordings for the user's courses.
+    Needs the ASGI server; under WSGI (or with nothing enrolled) it answers 204, which tells
+    the browser not to reconnect.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    
+    user = await request.auser()
+    enrolment = await sync_to_async(get_enrolment)(user)
+    if not enrolment.product_ids:
+        return HttpResponse(status=204)
+    
+    response = StreamingHttpResponse(
+        event_stream(user.pk, enrolment.product_ids),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required
@@ -222,18 +211,7 @@ def session_detail(request, session_id):
     session = get_object_or_404(CourseSession, id=session_id)
     
     # Check access
-    enrolled_products = get_user_enrolled_products(user)
-    
-    has_access = False
-    if session.is_public:
-        has_access = True
-    elif session.product in enrolled_products:
-        if session.specific_users.exists():
-            has_access = session.specific_users.filter(id=user.id).exists()
-        else:
-            has_access = True
-    
-    if not has_access:
+    if not can_view(session, user, get_enrolment(user)):
         return render(request, 'course_delivery/access_denied.html', status=403)
     
     context = {
@@ -252,18 +230,7 @@ def resource_detail(request, resource_id):
     resource = get_object_or_404(CourseResource, id=resource_id)
     
     # Check access
-    enrolled_products = get_user_enrolled_products(user)
-    
-    has_access = False
-    if resource.is_public:
-        has_access = True
-    elif resource.product in enrolled_products:
-        if resource.specific_users.exists():
-            has_access = resource.specific_users.filter(id=user.id).exists()
-        else:
-            has_access = True
-    
-    if not has_access:
+    if not can_view(resource, user, get_enrolment(user)):
         return render(request, 'course_delivery/access_denied.html', status=403)
     
     context = {
@@ -271,3 +238,87 @@ def resource_detail(request, resource_id):
         'product': resource.product,
     }
     return render(request, 'course_delivery/resource_detail.html', context)
+
+
+@login_required
+def resource_download(request, resource_id):
+    """
+    Download a resource's file, with the same access rules as its detail page.
+    """
+    user = request.user
+    resource = get_object_or_404(CourseResource, id=resource_id)
+    
+    if not can_view(resource, user, get_enrolment(user)):
+        return render(request, 'course_delivery/access_denied.html', status=403)
+    if not resource.file_upload:
+        raise Http404("This resource has no file")
+    
+    return serve_file(request, resource.file_upload)
+
+
+@login_required
+def deliverable_download(request, deliverable_id):
+    """
+    Download a student-specific file; only its student (or staff) may.
+    """
+    user = request.user
+    deliverables = StudentDeliverable.objects.all() if user.is_staff else StudentDeliverable.objects.filter(student=user)
+    deliverable = get_object_or_404(deliverables, id=deliverable_id)
+    
+    return serve_file(request, deliverable.file_upload)
+
+
+@login_required
+def calendar_settings(request):
+    """
+    Page with the user's calendar feed link; POST replaces the link (revoking the old one).
+    """
+    feed_token, _ = CalendarFeedToken.objects.get_or_create(user=request.user)
+    if request.method == 'POST':
+        feed_token.regenerate()
+        return redirect('dashboard:course_delivery:calendar')
+    
+    feed_url = request.build_absolute_uri(
+        reverse('dashboard:course_delivery:calendar_feed', args=[feed_token.token])
+    )
+    context = {
+        'feed_url': feed_url,
+        'webcal_url': 'webcal://' + feed_url.split('://', 1)[1],
+    }
+    return render(request, 'course_delivery/calendar.html', context)
+
+
+@require_GET
+def calendar_feed(request, token):
+    """
+    iCalendar feed of the sessions the token's user can see; the token stands in for a login.
+    Unchanged feeds get a 304, see course_delivery.calendar_feed.
+    """
+    feed_token = get_object_or_404(CalendarFeedToken.objects.select_related('user'), token=token)
+    user = feed_token.user
+    if not user.is_active:
+        raise Http404("Calendar feed not found")
+    
+    enrolment = get_enrolment(user)
+    digest = feed_digest(user.pk, enrolment.product_ids)
+    etag = quote_etag(digest)
+    cache_key = feed_cache_key(user.pk, digest)
+    cached = cache.get(cache_key)
+    last_modified = int(cached['generated_at'].timestamp()) if cached else None
+    
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+    
+    content_type = 'text/calendar; charset=utf-8'
+    if cached:
+        response = HttpResponse(cached['body'], content_type=content_type)
+        response['Last-Modified'] = http_date(last_modified)
+    else:
+        sessions = get_sessions_for_user(user, enrolment=enrolment)
+        response = StreamingHttpResponse(stream_feed(sessions, cache_key), content_type=content_type)
+        response['Last-Modified'] = http_date()
+    response['ETag'] = etag
+    response['Content-Disposition'] = 'inline; filename="sessions.ics"'
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -1,13 +1,13 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.utils import timezone
 
 from course_delivery.views import (
     get_user_enrolled_products,
-    get_sessions_for_user,
+    get_session_buckets,
     get_resources_for_user,
     get_deliverables_for_user
 )
+from course_delivery.enrolment import get_enrolment
 from products.models import MyProducts
 
 
@@ -19,8 +19,9 @@ def dashboard(request):
     """
     user = request.user
     
-    # Get all enrolled products for the user
-    enrolled_products = get_user_enrolled_products(user)
+    # Get all enrolled products for the user, once for the whole request
+    enrolment = get_enrolment(user)
+    enrolled_products = get_user_enrolled_products(user, enrolment)
     
     # Determine which product to show (from query param or first enrolled)
     selected_product_id = request.GET.get('course')
@@ -39,8 +40,6 @@ def dashboard(request):
     if not active_product and enrolled_products:
         active_product = enrolled_products[0]
     
-    now = timezone.now()
-    
     # Initialize empty data
     live_sessions = []
     upcoming_sessions = []
@@ -49,16 +48,14 @@ def dashboard(request):
     deliverables = []
     
     if active_product:
-        # Get sessions for the active product
-        all_sessions = get_sessions_for_user(user, active_product)
-        
-        # Categorize sessions by status
-        live_sessions = [s for s in all_sessions if s.start_time <= now <= s.end_time]
-        upcoming_sessions = [s for s in all_sessions if s.start_time > now][:5]
-        completed_sessions = [s for s in all_sessions if s.end_time < now and s.recording_url][:10]
+        # Get sessions for the active product, bucketed by status in the database
+        sessions = get_session_buckets(user, active_product, enrolment)
+        live_sessions = sessions['live']
+        upcoming_sessions = sessions['upcoming']
+        completed_sessions = sessions['completed']
         
         # Get resources and deliverables
-        resources = get_resources_for_user(user, active_product)[:10]
+        resources = get_resources_for_user(user, active_product, enrolment)[:10]
         deliverables = get_deliverables_for_user(user, active_product)[:5]
     
     context = {
@@ -0,0 +1,25 @@
+from django.contrib import admin
+from django.utils import timezone
+from .models import Job
+from .queue import REGISTRY
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'max_attempts', 'run_after', 'locked_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'last_error')
+    readonly_fields = ('created_at', 'finished_at', 'locked_by', 'locked_at', 'last_error')
+    date_hierarchy = 'created_at'
+    actions = ['retry_now']
+    
+    def retry_now(self, request, queryset):
+        # Finished sensitive jobs no longer have their payload to run with
+        sensitive = [name for name, job_type in REGISTRY.items() if job_type.sensitive]
+        count = queryset.exclude(status='running').exclude(
+            name__in=sensitive, status__in=['succeeded', 'failed']
+        ).update(
+            status='queued', run_after=timezone.now(), attempts=0, finished_at=None
+        )
+        self.message_user(request, f"{count} jobs queued to run again.")
+    retry_now.short_description = "Queue selected jobs to run again now"
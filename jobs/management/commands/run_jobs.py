@@ -0,0 +1,75 @@
+import os
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from jobs.queue import REGISTRY, claim, ensure_periodic, purge_finished, requeue_stale, run
+
+# Seconds between housekeeping passes (stale jobs, periodic schedules, purging)
+HOUSEKEEPING_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs; start several processes for more throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', action='append', default=None, metavar='JOB',
+                            help="Only run this job type (repeatable)")
+        parser.add_argument('--burst', action='store_true',
+                            help="Exit once no jobs are due instead of waiting for more")
+        parser.add_argument('--max-jobs', type=int, default=None,
+                            help="Exit after running this many jobs")
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Seconds to wait when the queue is empty (defaults to JOBS_POLL_INTERVAL)")
+
+    def handle(self, *args, **options):
+        names = options['only']
+        unknown = set(names or []) - set(REGISTRY)
+        if unknown:
+            raise CommandError(f"Unknown job types: {', '.join(sorted(unknown))}")
+
+        poll_interval = options['poll_interval'] or settings.JOBS_POLL_INTERVAL
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = False
+
+        def stop(signum, frame):
+            # Finish the current job, then exit
+            self.stopping = True
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(f"Worker {worker_id} started ({len(names or REGISTRY)} job types)")
+        processed = succeeded = 0
+        last_housekeeping = 0
+        while not self.stopping:
+            close_old_connections()
+            if time.monotonic() - last_housekeeping >= HOUSEKEEPING_INTERVAL:
+                requeue_stale()
+                ensure_periodic()
+                purge_finished()
+                last_housekeeping = time.monotonic()
+
+            job = claim(worker_id, names)
+            if job is None:
+                if options['burst']:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            started = time.monotonic()
+            ok = run(job, worker_id)
+            processed += 1
+            succeeded += ok
+            if options['verbosity'] > 1:
+                outcome = 'done' if ok else 'failed'
+                self.stdout.write(f"{job.name} #{job.pk} {outcome} in {time.monotonic() - started:.2f}s")
+            if options['max_jobs'] and processed >= options['max_jobs']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Worker {worker_id} stopped after {processed} jobs ({processed - succeeded} failed)"
+        ))
@@ -0,0 +1,235 @@
+"""
+Job Queue
+Deferred work stored in the project database; no broker is needed.
+- @job registers a function as a job type, and `func.enqueue(**kwargs)` queues a run
+- workers (manage.py run_jobs) claim due jobs with SELECT ... FOR UPDATE SKIP LOCKED
+- failed runs are retried with exponential backoff, up to max_attempts
+- `concurrency` caps how many jobs of a type run at once across all workers
+- `every` makes a job periodic: each finished run queues the next one
+- `sensitive` jobs have their payload cleared once they finish, so it isn't kept
+  with the job's history
+A job is created in the caller's transaction, so work queued alongside a write only
+becomes visible to workers once that write commits.
+"""
+
+import datetime
+import functools
+import logging
+import random
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job, JobTypeLock
+
+logger = logging.getLogger(__name__)
+
+# Registered job types by name
+REGISTRY = {}
+
+# Longest wait between retries
+MAX_BACKOFF_SECONDS = 3600
+
+
+class JobType:
+    """A registered job function and how it is queued, retried and limited"""
+
+    def __init__(self, func, name, max_attempts=5, backoff=30, concurrency=None, timeout=None, every=None,
+                 sensitive=False):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.every = every
+        self.sensitive = sensitive
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return f"<JobType {self.name}>"
+
+    def enqueue(self, run_after=None, **payload):
+        return enqueue(self.name, payload, run_after)
+
+    def retry_delay(self, attempts):
+        """Seconds to wait before retry number `attempts`, doubling each time with some jitter"""
+        delay = min(self.backoff * 2 ** max(attempts - 1, 0), MAX_BACKOFF_SECONDS)
+        return delay * random.uniform(0.9, 1.1)
+
+
+def job(name=None, max_attempts=5, backoff=30, concurrency=None, timeout=None, every=None, sensitive=False):
+    """
+    Register a function as a job type
+    - name: defaults to '<module>.<function>'
+    - backoff: seconds before the first retry; doubles on each further attempt
+    - concurrency: most jobs of this type running at once (None = unlimited)
+    - timeout: seconds after which a running job is assumed lost and requeued
+      (defaults to JOBS_STALE_AFTER_SECONDS)
+    - every: timedelta between runs of a periodic job; periodic jobs never overlap
+    - sensitive: clear the payload once the job succeeds or fails for good
+    Payload values must be JSON serialisable; the function receives them as keyword arguments.
+    Prefer ids over secrets in payloads: look the record up in the job.
+    """
+    def decorator(func):
+        job_type = JobType(
+            func,
+            name or f"{func.__module__}.{func.__name__}",
+            max_attempts=max_attempts,
+            backoff=backoff,
+            concurrency=concurrency or (1 if every else None),
+            timeout=timeout,
+            every=every,
+            sensitive=sensitive,
+        )
+        REGISTRY[job_type.name] = job_type
+        return job_type
+    return decorator
+
+
+def enqueue(name, payload=None, run_after=None):
+    """
+    Queue a run of a registered job type
+    With JOBS_RUN_INLINE the job instead runs in-process once the current transaction
+    commits (for development without a worker).
+    """
+    job_type = REGISTRY.get(name)
+    if job_type is None:
+        raise LookupError(f"No job type registered as {name!r}")
+    payload = payload or {}
+
+    if settings.JOBS_RUN_INLINE:
+        transaction.on_commit(lambda: job_type.func(**payload))
+        return None
+
+    return Job.objects.create(
+        name=name,
+        payload=payload,
+        run_after=run_after or timezone.now(),
+        max_attempts=job_type.max_attempts,
+    )
+
+
+def claim(worker_id, names=None):
+    """Lock and return the next due job for this worker, or None"""
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_after__lte=now, name__in=names or list(REGISTRY))
+    due_names = list(due.order_by().values_list('name', flat=True).distinct())
+    # Visit job types in random order so a busy type can't starve the others
+    random.shuffle(due_names)
+    for name in due_names:
+        claimed = _claim_one(worker_id, REGISTRY[name], due.filter(name=name), now)
+        if claimed:
+            return claimed
+    return None
+
+
+def _claim_one(worker_id, job_type, due, now):
+    with transaction.atomic():
+        if job_type.concurrency:
+            # Serialise claims of this type so two workers can't both see a free slot
+            JobTypeLock.objects.get_or_create(name=job_type.name)
+            JobTypeLock.objects.select_for_update().get(name=job_type.name)
+            running = Job.objects.filter(name=job_type.name, status='running').count()
+            if running >= job_type.concurrency:
+                return None
+
+        claimed = due.select_for_update(skip_locked=True).order_by('run_after', 'id').first()
+        if claimed is None:
+            return None
+        claimed.status = 'running'
+        claimed.locked_by = worker_id
+        claimed.locked_at = now
+        claimed.attempts += 1
+        claimed.save(update_fields=['status', 'locked_by', 'locked_at', 'attempts'])
+    return claimed
+
+
+def run(claimed, worker_id):
+    """
+    Run a claimed job and record the outcome
+    Returns: True if it succeeded
+    """
+    job_type = REGISTRY.get(claimed.name)
+    updates = {'locked_by': '', 'locked_at': None}
+    try:
+        if job_type is None:
+            raise LookupError(f"No job type registered as {claimed.name!r}")
+        job_type.func(**claimed.payload)
+    except Exception:
+        logger.exception("Job %s failed (attempt %s of %s)", claimed, claimed.attempts, claimed.max_attempts)
+        now = timezone.now()
+        updates['last_error'] = traceback.format_exc()[-5000:]
+        if job_type is not None and claimed.attempts < claimed.max_attempts:
+            updates['status'] = 'queued'
+            updates['run_after'] = now + datetime.timedelta(seconds=job_type.retry_delay(claimed.attempts))
+        else:
+            updates['status'] = 'failed'
+            updates['finished_at'] = now
+        succeeded = False
+    else:
+        updates.update(status='succeeded', finished_at=timezone.now(), last_error='')
+        succeeded = True
+    if job_type is not None and job_type.sensitive and updates['status'] != 'queued':
+        updates['payload'] = {}
+
+    # Only record the outcome if the job wasn't requeued as stale meanwhile
+    Job.objects.filter(pk=claimed.pk, locked_by=worker_id).update(**updates)
+
+    if job_type is not None and job_type.every and updates['status'] != 'queued':
+        schedule_next(job_type)
+    return succeeded
+
+
+def schedule_next(job_type, run_after=None):
+    """Queue the next run of a periodic job unless one is already waiting"""
+    if Job.objects.filter(name=job_type.name, status__in=['queued', 'running']).exists():
+        return None
+    # Always a queued row, even with JOBS_RUN_INLINE: schedules are only run by workers
+    return Job.objects.create(
+        name=job_type.name,
+        run_after=run_after or timezone.now() + job_type.every,
+        max_attempts=job_type.max_attempts,
+    )
+
+
+def ensure_periodic():
+    """Make sure every periodic job type has a run queued (e.g. on first deploy)"""
+    for job_type in REGISTRY.values():
+        if job_type.every:
+            schedule_next(job_type, run_after=timezone.now())
+
+
+def requeue_stale():
+    """
+    Return jobs whose worker died mid-run to the queue
+    Returns: number of jobs requeued or failed
+    """
+    now = timezone.now()
+    count = 0
+    running_names = Job.objects.filter(status='running').order_by().values_list('name', flat=True).distinct()
+    for name in list(running_names):
+        job_type = REGISTRY.get(name)
+        timeout = (job_type and job_type.timeout) or settings.JOBS_STALE_AFTER_SECONDS
+        stale = Job.objects.filter(name=name, status='running', locked_at__lt=now - datetime.timedelta(seconds=timeout))
+        lost = {'locked_by': '', 'locked_at': None, 'last_error': f"Worker lost after {timeout}s"}
+        given_up = dict(lost, status='failed', finished_at=now)
+        if job_type is not None and job_type.sensitive:
+            given_up['payload'] = {}
+        count += stale.filter(attempts__gte=F('max_attempts')).update(**given_up)
+        count += stale.update(status='queued', run_after=now, **lost)
+    return count
+
+
+def purge_finished(days=None):
+    """Delete succeeded jobs older than JOBS_KEEP_FINISHED_DAYS; failed ones are kept for inspection"""
+    days = settings.JOBS_KEEP_FINISHED_DAYS if days is None else days
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    deleted, _ = Job.objects.filter(status='succeeded', finished_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,127 @@
+import datetime
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Job, JobTypeLock
+from .queue import claim, enqueue, job, purge_finished, requeue_stale, run
+
+calls = []
+
+
+@job(name='jobs.tests.record', max_attempts=3, backoff=10)
+def record(value):
+    calls.append(value)
+
+
+@job(name='jobs.tests.explode', max_attempts=2, backoff=10)
+def explode():
+    raise RuntimeError("boom")
+
+
+@job(name='jobs.tests.single', concurrency=1)
+def single():
+    pass
+
+
+@job(name='jobs.tests.secret', sensitive=True)
+def secret(token_id):
+    pass
+
+
+@override_settings(JOBS_RUN_INLINE=False)
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_claim_locks_the_job_for_one_worker(self):
+        queued = record.enqueue(value=1)
+
+        claimed = claim('worker-a', ['jobs.tests.record'])
+        self.assertEqual(claimed.pk, queued.pk)
+        self.assertEqual((claimed.status, claimed.locked_by, claimed.attempts), ('running', 'worker-a', 1))
+        self.assertIsNone(claim('worker-b', ['jobs.tests.record']))
+
+        self.assertTrue(run(claimed, 'worker-a'))
+        self.assertEqual(calls, [1])
+        self.assertEqual(Job.objects.get(pk=queued.pk).status, 'succeeded')
+
+    def test_jobs_scheduled_later_are_not_claimed(self):
+        record.enqueue(value=1, run_after=timezone.now() + datetime.timedelta(minutes=5))
+        self.assertIsNone(claim('worker-a', ['jobs.tests.record']))
+
+    def test_failures_are_retried_with_backoff_then_fail(self):
+        queued = explode.enqueue()
+
+        self.assertFalse(run(claim('worker-a', ['jobs.tests.explode']), 'worker-a'))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, 'queued')
+        self.assertGreater(queued.run_after, timezone.now() + datetime.timedelta(seconds=8))
+        self.assertIn('boom', queued.last_error)
+
+        Job.objects.filter(pk=queued.pk).update(run_after=timezone.now())
+        self.assertFalse(run(claim('worker-a', ['jobs.tests.explode']), 'worker-a'))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('failed', 2))
+        self.assertIsNotNone(queued.finished_at)
+
+    @override_settings(JOBS_STALE_AFTER_SECONDS=60)
+    def test_stale_jobs_are_requeued_and_the_lost_worker_cannot_overwrite(self):
+        queued = record.enqueue(value=1)
+        claimed = claim('worker-a', ['jobs.tests.record'])
+        Job.objects.filter(pk=queued.pk).update(locked_at=timezone.now() - datetime.timedelta(minutes=5))
+
+        self.assertEqual(requeue_stale(), 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.locked_by), ('queued', ''))
+
+        # The lost worker finishing late doesn't mark the requeued job as done
+        run(claimed, 'worker-a')
+        self.assertEqual(Job.objects.get(pk=queued.pk).status, 'queued')
+
+    @override_settings(JOBS_STALE_AFTER_SECONDS=60)
+    def test_stale_job_out_of_attempts_fails(self):
+        queued = record.enqueue(value=1)
+        Job.objects.filter(pk=queued.pk).update(
+            status='running', attempts=3, locked_by='worker-a',
+            locked_at=timezone.now() - datetime.timedelta(minutes=5)
+        )
+        requeue_stale()
+        self.assertEqual(Job.objects.get(pk=queued.pk).status, 'failed')
+
+    def test_concurrency_limit_is_checked_under_the_type_lock(self):
+        single.enqueue()
+        single.enqueue()
+
+        first = claim('worker-a', ['jobs.tests.single'])
+        self.assertIsNotNone(first)
+        self.assertTrue(JobTypeLock.objects.filter(name='jobs.tests.single').exists())
+        self.assertIsNone(claim('worker-b', ['jobs.tests.single']))
+
+        run(first, 'worker-a')
+        self.assertIsNotNone(claim('worker-b', ['jobs.tests.single']))
+
+    def test_sensitive_payload_is_cleared_when_the_job_finishes(self):
+        queued = secret.enqueue(token_id=7)
+        self.assertEqual(queued.payload, {'token_id': 7})
+
+        run(claim('worker-a', ['jobs.tests.secret']), 'worker-a')
+        self.assertEqual(Job.objects.get(pk=queued.pk).payload, {})
+
+    def test_old_succeeded_jobs_are_purged(self):
+        old = record.enqueue(value=1)
+        Job.objects.filter(pk=old.pk).update(status='succeeded', finished_at=timezone.now() - datetime.timedelta(days=30))
+        failed = record.enqueue(value=2)
+        Job.objects.filter(pk=failed.pk).update(status='failed', finished_at=timezone.now() - datetime.timedelta(days=30))
+
+        self.assertEqual(purge_finished(days=7), 1)
+        self.assertEqual(list(Job.objects.values_list('pk', flat=True)), [failed.pk])
+
+    @override_settings(JOBS_RUN_INLINE=True)
+    def test_inline_mode_runs_after_commit_without_a_job_row(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(enqueue('jobs.tests.record', {'value': 3}))
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [3])
+        self.assertFalse(Job.objects.exists())
@@ -5,6 +5,7 @@ from django.contrib import messages
 from .forms import ContactForm, ConsultationForm
 from .models import ContactSubmission, ConsultationRequest
 from products.models import MyProducts, BundledPlan
+from checkout.pricing import bundle_price_entry, product_price_entry
 
 COLLEGE_DATA = [
     {
@@ -236,6 +237,7 @@ def index(request):
     
     # Normalize bundle data
     for b in bundles:
+        pricing = bundle_price_entry(b)
         featured_services.append({
             'name': b.name,
             'thumbnail': b.thumbnail,
@@ -244,9 +246,9 @@ def index(request):
             'description': b.description,
             'validity_days': b.validity_days,
             'features': b.features,
-            'price': b.selling_price,
-            'original_price': b.original_price,
-            'discount_percentage': b.discount_percentage,
+            'price': pricing['price'],
+            'original_price': pricing['original_price'],
+            'discount_percentage': pricing['discount_percentage'],
             'slug': b.slug,
             'type': 'bundle',
             'tag': b.get_plan_type_display() if hasattr(b, 'get_plan_type_display') else 'Bundle',
@@ -255,6 +257,7 @@ def index(request):
 
     # Normalize product data
     for p in products:
+        pricing = product_price_entry(p)
         featured_services.append({
             'name': p.name,
             'thumbnail': p.thumbnail,
@@ -263,7 +266,7 @@ def index(request):
             'description': p.description,
             'validity_days': p.validity_days,
             'features': p.features,
-            'price': p.base_price,
+            'price': pricing['price'],
             'original_price': None,
             'discount_percentage': 0,
             'slug': p.slug,
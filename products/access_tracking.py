@@ -0,0 +1,162 @@
+"""
+Write-behind Subscription Access Tracking
+UserSubscription.record_access() only counts the access in memory; a background
+thread flushes the counts every ACCESS_TRACKING_FLUSH_INTERVAL seconds as one
+`access_count = access_count + n` UPDATE per distinct n, instead of a full-row
+save on every page view. Pending counts are flushed at interpreter exit.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Keep each UPDATE's IN (...) list and CASE expression bounded
+FLUSH_CHUNK_SIZE = 500
+
+
+class AccessBuffer:
+    """Thread-safe, per-process buffer of subscription access events"""
+
+    def __init__(self, flush_interval=None):
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}  # subscription id -> [count, last accessed]
+        self._thread = None
+        self._pid = os.getpid()
+        self.last_flush_at = None
+        self.last_flush_rows = 0
+        self.flushed_events = 0
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return settings.ACCESS_TRACKING_FLUSH_INTERVAL
+
+    def record(self, subscription_id, accessed_at=None):
+        """Count one access; written through immediately when buffering is disabled"""
+        accessed_at = accessed_at or timezone.now()
+        self._reset_after_fork()
+        with self._lock:
+            entry = self._pending.get(subscription_id)
+            if entry is None:
+                self._pending[subscription_id] = [1, accessed_at]
+            else:
+                entry[0] += 1
+                entry[1] = max(entry[1], accessed_at)
+
+        if not self.flush_interval:
+            self.flush()
+        else:
+            self._ensure_flusher()
+
+    def stats(self):
+        with self._lock:
+            backlog_rows = len(self._pending)
+            backlog_events = sum(count for count, _ in self._pending.values())
+        return {
+            'flush_interval': self.flush_interval,
+            'backlog_rows': backlog_rows,
+            'backlog_events': backlog_events,
+            'last_flush_at': self.last_flush_at,
+            'last_flush_rows': self.last_flush_rows,
+            'flushed_events': self.flushed_events,
+        }
+
+    def flush(self):
+        """Write all pending counts; anything that fails to write goes back into the buffer"""
+        from .models import UserSubscription
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        # Rows accessed the same number of times share one UPDATE
+        by_count = {}
+        for subscription_id, (count, accessed_at) in pending.items():
+            by_count.setdefault(count, []).append((subscription_id, accessed_at))
+
+        written = {}
+        try:
+            for count, items in by_count.items():
+                for start in range(0, len(items), FLUSH_CHUNK_SIZE):
+                    chunk = items[start:start + FLUSH_CHUNK_SIZE]
+                    UserSubscription.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+                        access_count=F('access_count') + count,
+                        last_accessed=Case(
+                            *[When(pk=pk, then=Value(accessed_at)) for pk, accessed_at in chunk],
+                            output_field=DateTimeField()
+                        ),
+                    )
+                    written.update((pk, count) for pk, _ in chunk)
+        except Exception:
+            logger.exception("Flushing subscription access counts failed, keeping them for the next flush")
+            self._requeue({pk: value for pk, value in pending.items() if pk not in written})
+            raise
+        finally:
+            events = sum(written.values())
+            self.flushed_events += events
+            self.last_flush_at = timezone.now()
+            self.last_flush_rows = len(written)
+
+        logger.info(
+            "Flushed %s access events for %s subscriptions (interval %ss, backlog %s rows)",
+            events, len(written), self.flush_interval, self.stats()['backlog_rows']
+        )
+        return len(written)
+
+    def _requeue(self, pending):
+        with self._lock:
+            for subscription_id, (count, accessed_at) in pending.items():
+                entry = self._pending.get(subscription_id)
+                if entry is None:
+                    self._pending[subscription_id] = [count, accessed_at]
+                else:
+                    entry[0] += count
+                    entry[1] = max(entry[1], accessed_at)
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='access-tracking-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval or 1)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                pass  # Already logged; counts were requeued
+
+    def _reset_after_fork(self):
+        # A forked worker inherits the parent's buffer but not its flusher thread
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._pending = {}
+            self._thread = None
+            self._lock = threading.Lock()
+
+
+access_buffer = AccessBuffer()
+
+
+@atexit.register
+def flush_on_shutdown():
+    try:
+        access_buffer.flush()
+    except Exception:
+        logger.exception("Could not flush subscription access counts on shutdown")
@@ -1,9 +1,15 @@
 from django.contrib import admin
+from django.shortcuts import render
+from django.urls import path
 from django.utils.html import format_html
+from .entitlements import invalidate_entitlements
 from .models import (
     ExamType, ProductCategory, MyProducts, BundledPlan, PlanProduct,
-    Order, UserSubscription, Coupon, CouponUsage
+    Order, UserSubscription, Coupon, CouponUsage, ExpiryNotification,
+    DailyRevenueRollup, ActiveSubscriberRollup, WeeklyExpiryRollup, CouponRevenueRollup,
+    ArchivedOrder, ArchivedSubscription
 )
+from .rollups import dashboard_summary
 
 
 @admin.register(ExamType)
@@ -162,18 +168,24 @@ class OrderAdmin(admin.ModelAdmin):
     actions = ['mark_as_completed', 'mark_as_failed', 'mark_as_cancelled']
     
     def mark_as_completed(self, request, queryset):
+        count = 0
         for order in queryset:
-            order.mark_completed()
-        self.message_user(request, f"{queryset.count()} orders marked as completed.")
+            _, finalized = Order.finalize_payment(order.pk, note=f"Marked completed by {request.user.username}")
+            count += finalized
+        self.message_user(request, f"{count} orders marked as completed.")
     mark_as_completed.short_description = "Mark selected orders as completed"
     
     def mark_as_failed(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         queryset.update(status='failed')
+        invalidate_entitlements(*user_ids)
         self.message_user(request, f"{queryset.count()} orders marked as failed.")
     mark_as_failed.short_description = "Mark selected orders as failed"
     
     def mark_as_cancelled(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
         queryset.update(status='cancelled')
+        invalidate_entitlements(*user_ids)
         self.message_user(request, f"{queryset.count()} orders marked as cancelled.")
     mark_as_cancelled.short_description = "Mark selected orders as cancelled"
 
@@ -224,7 +236,10 @@ class UserSubscriptionAdmin(admin.ModelAdmin):
     check_and_update_status.short_description = "Check and update subscription status"
     
     def mark_as_cancelled(self, request, queryset):
+        # Bulk updates send no signals, retire the affected users' cached entitlements explicitly
+        user_ids = list(queryset.values_list('user_id', flat=True))
         queryset.update(status='cancelled', is_active=False)
+        invalidate_entitlements(*user_ids)
         self.message_user(request, f"{queryset.count()} subscriptions cancelled.")
     mark_as_cancelled.short_description = "Cancel selected subscriptions"
 
@@ -285,3 +300,98 @@ class CouponUsageAdmin(admin.ModelAdmin):
     search_fields = ['user__username', 'user__email', 'coupon__code', 'order__order_id']
     readonly_fields = ['used_at']
     ordering = ['-used_at']
+
+
+@admin.register(ExpiryNotification)
+class ExpiryNotificationAdmin(admin.ModelAdmin):
+    list_display = ['subscription', 'expiry_date', 'sent_at']
+    list_filter = ['sent_at']
+    search_fields = ['subscription__user__username', 'subscription__user__email']
+    raw_id_fields = ['subscription']
+    readonly_fields = ['sent_at']
+    ordering = ['-sent_at']
+
+
+class RollupAdmin(admin.ModelAdmin):
+    """Rollups are written by the build_rollups command only"""
+    change_list_template = 'admin/products/rollup_change_list.html'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DailyRevenueRollup)
+class DailyRevenueRollupAdmin(RollupAdmin):
+    list_display = ['date', 'product', 'bundled_plan', 'order_count', 'revenue', 'discount_amount', 'tax_amount']
+    list_filter = ['date']
+    date_hierarchy = 'date'
+    
+    def get_urls(self):
+        return [
+            path('dashboard/', self.admin_site.admin_view(self.dashboard_view), name='products_analytics_dashboard'),
+        ] + super().get_urls()
+    
+    def dashboard_view(self, request):
+        try:
+            days = min(max(int(request.GET.get('days', 30)), 1), 366)
+        except ValueError:
+            days = 30
+        context = {
+            **self.admin_site.each_context(request),
+            **dashboard_summary(days=days),
+            'title': 'Subscription Analytics',
+            'days': days,
+            'opts': self.model._meta,
+        }
+        return render(request, 'admin/products/analytics_dashboard.html', context)
+
+
+@admin.register(ActiveSubscriberRollup)
+class ActiveSubscriberRollupAdmin(RollupAdmin):
+    list_display = ['date', 'product', 'active_subscribers', 'active_subscriptions']
+    list_filter = ['date', 'product']
+
+
+@admin.register(WeeklyExpiryRollup)
+class WeeklyExpiryRollupAdmin(RollupAdmin):
+    list_display = ['week_start', 'product', 'expiring_subscriptions']
+    list_filter = ['product']
+
+
+@admin.register(CouponRevenueRollup)
+class CouponRevenueRollupAdmin(RollupAdmin):
+    list_display = ['date', 'coupon', 'order_count', 'revenue', 'discount_amount']
+    list_filter = ['date', 'coupon']
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['order_id', 'user', 'item_name', 'status', 'final_price', 'created_at', 'archived_at']
+    list_filter = ['status', 'item_type', 'archived_at']
+    search_fields = ['order_id', 'user__username', 'user__email', 'item_name']
+    raw_id_fields = ['user']
+    ordering = ['-created_at']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedSubscription)
+class ArchivedSubscriptionAdmin(admin.ModelAdmin):
+    list_display = ['subscription_id', 'user', 'product_name', 'order_id', 'expiry_date', 'archived_at']
+    list_filter = ['status', 'archived_at']
+    search_fields = ['order_id', 'user__username', 'user__email', 'product_name']
+    raw_id_fields = ['user']
+    ordering = ['-expiry_date']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,179 @@
+"""
+Order & Subscription Archival
+Moves old rows out of the live orders, user_subscriptions and coupon_usages tables
+so they (and their indexes) stay small. Archived rows are kept in the archive
+tables, which purchase history reads through to, and can also be written to
+gzip-compressed JSONL files for cold storage. A batch is written to the file only
+once its delete has committed, so a rolled back batch never appears in an export.
+
+What is archived:
+- subscriptions that expired more than ARCHIVE_AFTER_DAYS ago
+- completed/refunded orders older than ARCHIVE_AFTER_DAYS, and pending/failed/cancelled
+  orders older than ARCHIVE_ABANDONED_ORDERS_AFTER_DAYS, once no live subscription
+  refers to them; their coupon usage goes with them, except usage of coupons that
+  can still be redeemed (per-user limits are counted from it)
+"""
+
+import datetime
+import gzip
+import json
+import os
+from functools import partial
+
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .entitlements import invalidate_entitlements
+from .models import ArchivedOrder, ArchivedSubscription, CouponUsage, Order, UserSubscription
+
+SETTLED_STATUSES = ['completed', 'refunded']
+
+
+class ArchiveExport:
+    """
+    Appends archived records to one gzip-compressed JSONL file per kind
+    Each write appends a complete gzip member, so a file is readable after every batch and
+    writes deferred to transaction commit don't depend on the file still being open.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+        self.paths = []
+
+    def write(self, kind, records):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{kind}-{self.stamp}.jsonl.gz")
+        if path not in self.paths:
+            self.paths.append(path)
+        with gzip.open(path, 'at', encoding='utf-8') as handle:
+            for record in records:
+                handle.write(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+
+
+def serialize(objects):
+    return serializers.serialize('python', objects)
+
+
+def archivable_subscriptions(now=None):
+    now = now or timezone.now()
+    cutoff = now - datetime.timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    return UserSubscription.objects.filter(expiry_date__lt=cutoff)
+
+
+def archivable_orders(now=None):
+    now = now or timezone.now()
+    settled_cutoff = now - datetime.timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    abandoned_cutoff = now - datetime.timedelta(days=settings.ARCHIVE_ABANDONED_ORDERS_AFTER_DAYS)
+    live_subscriptions = UserSubscription.objects.filter(order=OuterRef('pk'))
+    redeemable_coupon_usage = CouponUsage.objects.filter(
+        order=OuterRef('pk'),
+        coupon__is_active=True,
+        coupon__valid_until__gte=now
+    )
+    return Order.objects.filter(
+        Q(status__in=SETTLED_STATUSES, created_at__lt=settled_cutoff) |
+        (Q(created_at__lt=abandoned_cutoff) & ~Q(status__in=SETTLED_STATUSES))
+    ).exclude(Exists(live_subscriptions)).exclude(Exists(redeemable_coupon_usage))
+
+
+def _batches(queryset, batch_size):
+    """Walk a queryset in primary key order; each batch is re-queried after the previous one is deleted"""
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1].id
+        yield batch
+
+
+def archive_subscriptions(batch_size=500, export=None, now=None, progress=None):
+    archived = 0
+    subscriptions = archivable_subscriptions(now).select_related('product', 'order')
+    for batch in _batches(subscriptions, batch_size):
+        records = serialize(batch)
+        with transaction.atomic():
+            ArchivedSubscription.objects.bulk_create([
+                ArchivedSubscription(
+                    subscription_id=subscription.id,
+                    user_id=subscription.user_id,
+                    product_name=subscription.product.name if subscription.product else '',
+                    order_id=subscription.order.order_id,
+                    start_date=subscription.start_date,
+                    expiry_date=subscription.expiry_date,
+                    status=subscription.status,
+                    data=record,
+                )
+                for subscription, record in zip(batch, records)
+            ], ignore_conflicts=True)
+            if export:
+                transaction.on_commit(partial(export.write, 'subscriptions', records))
+            UserSubscription.objects.filter(id__in=[s.id for s in batch]).delete()
+            invalidate_entitlements(*[s.user_id for s in batch])
+        archived += len(batch)
+        if progress:
+            progress('subscriptions', archived)
+    return archived
+
+
+def _item_name(order):
+    item = order.bundled_plan or order.product
+    return item.name if item else ''
+
+
+def archive_orders(batch_size=500, export=None, now=None, progress=None):
+    archived = 0
+    orders = archivable_orders(now).select_related('product', 'bundled_plan').prefetch_related('coupon_usage')
+    for batch in _batches(orders, batch_size):
+        records = []
+        for order, record in zip(batch, serialize(batch)):
+            record['coupon_usage'] = serialize(order.coupon_usage.all())
+            records.append(record)
+
+        with transaction.atomic():
+            ArchivedOrder.objects.bulk_create([
+                ArchivedOrder(
+                    order_id=order.order_id,
+                    user_id=order.user_id,
+                    item_type='bundle' if order.bundled_plan_id else 'product',
+                    item_name=_item_name(order),
+                    status=order.status,
+                    final_price=order.final_price,
+                    created_at=order.created_at,
+                    payment_completed_at=order.payment_completed_at,
+                    data=record,
+                )
+                for order, record in zip(batch, records)
+            ], ignore_conflicts=True)
+            if export:
+                transaction.on_commit(partial(export.write, 'orders', records))
+            # Coupon usage rows are removed with their orders (on_delete=CASCADE)
+            Order.objects.filter(id__in=[o.id for o in batch]).delete()
+        archived += len(batch)
+        if progress:
+            progress('orders', archived)
+    return archived
+
+
+def archive_records(batch_size=500, export_dir=None, progress=None):
+    """
+    Archive everything that is due
+    Subscriptions go first, which frees the orders they pointed at.
+    Returns: dict of rows archived per table
+    """
+    now = timezone.now()
+    export = ArchiveExport(export_dir) if export_dir else None
+    return {
+        'subscriptions': archive_subscriptions(batch_size, export, now, progress),
+        'orders': archive_orders(batch_size, export, now, progress),
+    }
+
+
+def archive_horizon():
+    """Earliest date whose orders and subscriptions are guaranteed to still be in the live tables"""
+    return timezone.localdate() - datetime.timedelta(days=settings.ARCHIVE_AFTER_DAYS)
@@ -0,0 +1,182 @@
+"""
+User Entitlements
+Loads a user's subscriptions once into an immutable snapshot so access checks
+during a request are answered from in-memory sets instead of repeated queries.
+Snapshots are also cached across requests under a per-user version counter kept
+in the database, which is bumped whenever the user's subscriptions or orders change.
+"""
+
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import CacheVersion, Order, UserSubscription
+
+Entitlement = namedtuple('Entitlement', [
+    'subscription_id', 'order_id', 'product_id', 'product_slug', 'product_name', 'product_category_slug',
+    'bundled_plan_id', 'status', 'is_active', 'start_date', 'expiry_date',
+])
+
+EnrolledProduct = namedtuple('EnrolledProduct', ['id', 'slug', 'name', 'expiry_date'])
+
+
+class EntitlementSnapshot:
+    """
+    Immutable view of one user's subscriptions at load time
+    `entries` holds every subscription (newest first); the active_* sets only
+    those that were active when the snapshot was taken.
+    """
+
+    def __init__(self, user_id, entries, loaded_at=None):
+        self.user_id = user_id
+        self.loaded_at = loaded_at or timezone.now()
+        self.entries = tuple(entries)
+        self.active_entries = tuple(
+            e for e in self.entries
+            if e.status == 'active' and e.is_active and e.expiry_date > self.loaded_at
+        )
+
+        # Enrolled products in subscription order, keeping the latest expiry per product
+        products = {}
+        for e in self.active_entries:
+            if e.product_id is None:
+                continue
+            current = products.get(e.product_id)
+            if current is None or e.expiry_date > current.expiry_date:
+                products[e.product_id] = EnrolledProduct(e.product_id, e.product_slug, e.product_name, e.expiry_date)
+        self.enrolled_products = tuple(products.values())
+
+        self.active_product_ids = frozenset(products)
+        self.active_product_slugs = frozenset(p.slug for p in self.enrolled_products)
+        self.active_bundle_ids = frozenset(e.bundled_plan_id for e in self.active_entries if e.bundled_plan_id)
+        self.purchased_product_slugs = frozenset(e.product_slug for e in self.entries if e.product_slug)
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            raise AttributeError("EntitlementSnapshot is immutable")
+        super().__setattr__(name, value)
+
+    def __repr__(self):
+        return f"<EntitlementSnapshot user={self.user_id} active_products={sorted(self.active_product_ids)}>"
+
+    def is_enrolled(self, product):
+        """True if the user has active access to a product (instance, id or slug)"""
+        if isinstance(product, str):
+            return product in self.active_product_slugs
+        return getattr(product, 'pk', product) in self.active_product_ids
+
+    def expiry_for(self, product_id):
+        """Latest expiry among active subscriptions to a product, or None"""
+        for product in self.enrolled_products:
+            if product.id == product_id:
+                return product.expiry_date
+        return None
+
+    def bundle_purchase_count(self, bundled_plan_id):
+        """Number of orders through which the user bought a bundle"""
+        return len({e.order_id for e in self.entries if e.bundled_plan_id == bundled_plan_id})
+
+    def expiring_within(self, days):
+        threshold = self.loaded_at + timezone.timedelta(days=days)
+        return tuple(e for e in self.active_entries if e.expiry_date <= threshold)
+
+    def expired_entries(self):
+        return tuple(e for e in self.entries if e.expiry_date <= self.loaded_at)
+
+
+# Bumped whenever Entitlement gains or loses a field, so snapshots cached in the old shape are ignored
+SNAPSHOT_FORMAT = 2
+
+
+def entitlement_version_name(user_id):
+    return f'entitlements:user:{user_id}'
+
+
+def entitlement_cache_key(user_id, version):
+    return f'entitlements:{SNAPSHOT_FORMAT}:user:{user_id}:{version}'
+
+
+def load_entitlements(user):
+    """Build a fresh snapshot for a user with a single query"""
+    if not getattr(user, 'is_authenticated', False):
+        return EntitlementSnapshot(None, [])
+
+    rows = UserSubscription.objects.filter(user_id=user.pk).order_by('-created_at').values_list(
+        'id', 'order_id', 'product_id', 'product__slug', 'product__name', 'product__category__slug',
+        'bundled_plan_id', 'status', 'is_active', 'start_date', 'expiry_date',
+    )
+    return EntitlementSnapshot(user.pk, [Entitlement(*row) for row in rows])
+
+
+def get_cached_entitlements(user):
+    """
+    Snapshot shared across requests through the cache
+    Keyed on the user's entitlement version, read from the database with a primary key
+    lookup, so a change committed by any server process retires the cached snapshot.
+    Kept until the earliest active subscription expires (capped at ENTITLEMENT_CACHE_TIMEOUT),
+    so a cached snapshot never reports access that has lapsed.
+    """
+    if not getattr(user, 'is_authenticated', False):
+        return load_entitlements(user)
+
+    name = entitlement_version_name(user.pk)
+    key = entitlement_cache_key(user.pk, CacheVersion.current(name)[name])
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = load_entitlements(user)
+        timeout = settings.ENTITLEMENT_CACHE_TIMEOUT
+        if snapshot.active_entries:
+            earliest_expiry = min(e.expiry_date for e in snapshot.active_entries)
+            timeout = min(timeout, int((earliest_expiry - snapshot.loaded_at).total_seconds()))
+        if timeout > 0:
+            cache.set(key, snapshot, timeout)
+    return snapshot
+
+
+def get_entitlements(user):
+    """
+    Snapshot for a user, loaded at most once per request
+    Memoised on the user object, which Django keeps for the lifetime of request.user.
+    """
+    snapshot = getattr(user, '_entitlements', None)
+    if snapshot is None:
+        snapshot = get_cached_entitlements(user)
+        user._entitlements = snapshot
+    return snapshot
+
+
+def clear_entitlements(user):
+    """Drop the memoised snapshot, e.g. after a purchase within the same request"""
+    if hasattr(user, '_entitlements'):
+        del user._entitlements
+
+
+def invalidate_entitlements(*user_ids):
+    """
+    Bump these users' entitlement versions in the current transaction
+    Snapshots cached under the old versions are never read again. Outside a transaction,
+    call it after the write so a concurrent request can't cache the old rows under the new version.
+    """
+    CacheVersion.bump(*[entitlement_version_name(user_id) for user_id in set(user_ids) if user_id])
+
+
+# Fields written on every access; they don't change what a user is entitled to
+ACCESS_TRACKING_FIELDS = frozenset(['last_accessed', 'access_count', 'updated_at'])
+
+
+@receiver([post_save, post_delete], sender=UserSubscription)
+def invalidate_on_subscription_change(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= ACCESS_TRACKING_FIELDS:
+        return
+    invalidate_entitlements(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Order)
+def invalidate_on_order_change(sender, instance, **kwargs):
+    # Subscriptions are bulk created on completion, which sends no signals of its own
+    invalidate_entitlements(instance.user_id)
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.archive import archivable_orders, archivable_subscriptions, archive_records
+
+
+class Command(BaseCommand):
+    help = "Move old orders, subscriptions and coupon usage out of the live tables into the archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--export-dir', default=None,
+                            help="Also write archived rows to gzip-compressed JSONL files in this directory")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many rows are due for archival")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(
+                f"Due for archival: {archivable_subscriptions().count()} subscriptions, "
+                f"{archivable_orders().count()} orders"
+            )
+            return
+
+        def progress(kind, count):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{count} {kind} archived")
+
+        started = time.monotonic()
+        archived = archive_records(
+            batch_size=options['batch_size'],
+            export_dir=options['export_dir'],
+            progress=progress,
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived['subscriptions']} subscriptions and {archived['orders']} orders in {elapsed:.1f}s"
+        ))
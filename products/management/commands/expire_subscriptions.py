@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.utils import update_expired_subscriptions
+
+
+class Command(BaseCommand):
+    help = "Mark subscriptions past their expiry date as expired, in chunked set-based updates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Seconds to sleep between chunks outside peak hours")
+        parser.add_argument('--peak-chunk-size', type=int, default=200)
+        parser.add_argument('--peak-pause', type=float, default=1.0,
+                            help="Seconds to sleep between chunks during EXPIRY_SWEEP_PEAK_HOURS")
+
+    def handle(self, *args, **options):
+        def progress(count, rate):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{count} subscriptions expired ({rate:.0f} rows/s)")
+
+        started = time.monotonic()
+        count = update_expired_subscriptions(
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+            peak_chunk_size=options['peak_chunk_size'],
+            peak_pause=options['peak_pause'],
+            progress=progress,
+        )
+        elapsed = time.monotonic() - started
+        rate = count / elapsed if elapsed > 0 else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {count} subscriptions in {elapsed:.1f}s ({rate:.0f} rows/s)"
+        ))
@@ -0,0 +1,42 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from products.notifications import send_expiry_notifications
+
+
+class Command(BaseCommand):
+    help = "Email reminders to users whose subscriptions expire soon"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7,
+                            help="Remind about subscriptions expiring within this many days")
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help="Messages handed to the mail connection per send")
+        parser.add_argument('--rate', type=float, default=None,
+                            help="Maximum messages per second (defaults to EXPIRY_NOTIFICATION_RATE_LIMIT)")
+        parser.add_argument('--backend', default=None,
+                            help="Email backend to use instead of EMAIL_BACKEND, e.g. "
+                                 "django.core.mail.backends.console.EmailBackend")
+        parser.add_argument('--file-path', default=None,
+                            help="Output directory for the file-based email backend")
+
+    def handle(self, *args, **options):
+        backend_kwargs = {'file_path': options['file_path']} if options['file_path'] else {}
+        connection = get_connection(options['backend'], **backend_kwargs)
+
+        def progress(sent):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{sent} reminders sent")
+
+        started = time.monotonic()
+        sent = send_expiry_notifications(
+            days=options['days'],
+            batch_size=options['batch_size'],
+            rate_limit=options['rate'],
+            connection=connection,
+            progress=progress,
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Sent {sent} expiry reminders in {elapsed:.1f}s"))
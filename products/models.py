@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from decimal import Decimal
+import hashlib
 import uuid
 
 
@@ -255,9 +257,18 @@ class Order(models.Model):
     coupon_code = models.CharField(max_length=50, blank=True)
     coupon_discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     
+    # Credit for unused time on subscriptions replaced by an upgrade, and the rows it was for
+    proration_credit = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    credited_subscriptions = models.ManyToManyField(
+        'UserSubscription', related_name='crediting_orders', blank=True
+    )
+    
     # Tax details
     tax_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     
+    # Idempotency key so checkout retries reuse the same pending order
+    idempotency_key = models.CharField(max_length=64, blank=True, editable=False)
+    
     # Razorpay payment details
     razorpay_order_id = models.CharField(max_length=200, blank=True, help_text="Razorpay Order ID")
     razorpay_payment_id = models.CharField(max_length=200, blank=True, help_text="Razorpay Payment ID")
@@ -284,11 +295,32 @@ class Order(models.Model):
             models.Index(fields=['order_id']),
             models.Index(fields=['user', 'status']),
             models.Index(fields=['created_at']),
+            models.Index(fields=['user', 'idempotency_key', 'status']),
         ]
     
     def __str__(self):
         return f"Order {self.order_id} - {self.user.username}"
     
+    @staticmethod
+    def build_idempotency_key(user, item_type, item_id, final_price, coupon_code=''):
+        """Build a stable key identifying one purchase attempt of an item at a given price"""
+        raw = f"{user.pk}:{item_type}:{item_id}:{Decimal(final_price):.2f}:{coupon_code or ''}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+    
+    @classmethod
+    def get_reusable_pending(cls, user, idempotency_key, window_minutes=15):
+        """
+        Return the most recent pending order for this key created within the reuse window,
+        so double-clicks and refreshes don't create a new order each time
+        """
+        since = timezone.now() - timezone.timedelta(minutes=window_minutes)
+        return cls.objects.filter(
+            user=user,
+            idempotency_key=idempotency_key,
+            status='pending',
+            created_at__gte=since
+        ).order_by('-created_at').first()
+    
     def save(self, *args, **kwargs):
         if not self.order_id:
             self.order_id = self.generate_order_id()
@@ -304,39 +336,77 @@ class Order(models.Model):
         return int(self.final_price * 100)
 
     def mark_completed(self):
-        """Mark order as completed"""
-        self.status = 'completed'
-        self.payment_completed_at = timezone.now()
-        self.save()
+        """Mark order as completed and create its subscriptions atomically"""
+        with transaction.atomic():
+            self.status = 'completed'
+            self.payment_completed_at = timezone.now()
+            self.save()
+            
+            # Create user subscription
+            self.create_user_subscription()
+    
+    @classmethod
+    def finalize_payment(cls, pk, payment_id='', signature='', note=''):
+        """
+        Complete a paid order exactly once
+        Claims the order row with a conditional update, skips it if a previous callback
+        already completed it, then applies status, subscriptions and coupon usage in one
+        transaction. The update takes the row lock (the whole database on SQLite, which
+        ignores SELECT ... FOR UPDATE) and re-checks the status once it holds it.
+        Returns: (order, finalized)
+        """
+        with transaction.atomic():
+            claimed = cls.objects.filter(pk=pk).exclude(status__in=('completed', 'refunded')).update(
+                updated_at=timezone.now()
+            )
+            order = cls.objects.select_for_update().get(pk=pk)
+            if not claimed:
+                return order, False
+            
+            if payment_id:
+                order.razorpay_payment_id = payment_id
+            if signature:
+                order.razorpay_signature = signature
+            if note:
+                order.notes = f"{order.notes}\n{note}" if order.notes else note
+            order.mark_completed() # This handles status and subscription
+            
+            # Record Coupon Usage
+            if order.coupon_code:
+                coupon = Coupon.objects.filter(code=order.coupon_code).first()
+                if coupon:
+                    CouponUsage.objects.create(
+                        coupon=coupon,
+                        user_id=order.user_id,
+                        order=order,
+                        discount_amount=order.coupon_discount
+                    )
+                    Coupon.objects.filter(pk=coupon.pk).update(current_uses=models.F('current_uses') + 1)
         
-        # Create user subscription
-        self.create_user_subscription()
+        return order, True
     
     def create_user_subscription(self):
-        """Create user subscription after successful payment"""
-        if self.status == 'completed':
-            if self.bundled_plan:
-                # Create subscriptions for all products in the bundled plan
-                for plan_product in self.bundled_plan.planproduct_set.all():
-                    UserSubscription.objects.create(
-                        user=self.user,
-                        order=self,
-                        bundled_plan=self.bundled_plan,
-                        product=plan_product.product,
-                        validity_days=plan_product.get_validity_days(),
-                        start_date=timezone.now(),
-                        expiry_date=timezone.now() + timezone.timedelta(days=plan_product.get_validity_days())
-                    )
-            elif self.product:
-                # Create subscription for individual product
-                UserSubscription.objects.create(
-                    user=self.user,
-                    order=self,
-                    product=self.product,
-                    validity_days=self.product.validity_days,
-                    start_date=timezone.now(),
-                    expiry_date=timezone.now() + timezone.timedelta(days=self.product.validity_days)
-                )
+        """
+        Grant access after successful payment
+        The order gets one row per product, chained after or replacing the user's current
+        rows (see products.renewals); bundles resolve all their products in one query.
+        """
+        from .renewals import apply_purchase
+        
+        if self.status != 'completed':
+            return []
+        
+        if self.bundled_plan_id:
+            # Subscriptions for all products in the bundled plan
+            plan_products = PlanProduct.objects.filter(plan_id=self.bundled_plan_id).select_related('product')
+            items = [(plan_product.product, plan_product.get_validity_days()) for plan_product in plan_products]
+        elif self.product_id:
+            # Subscription for individual product
+            items = [(self.product, self.product.validity_days)]
+        else:
+            return []
+        
+        return apply_purchase(self, items)
 
 
 class UserSubscription(models.Model):
@@ -406,10 +476,15 @@ class UserSubscription(models.Model):
         return self.status
     
     def record_access(self):
-        """Record when user accesses the service"""
+        """
+        Record when user accesses the service
+        Counted in memory and written in periodic batches (see products.access_tracking).
+        """
+        from .access_tracking import access_buffer
+
         self.last_accessed = timezone.now()
         self.access_count += 1
-        self.save()
+        access_buffer.record(self.pk, self.last_accessed)
     
     # def days_remaining(self):
     #     """Get days remaining in subscription"""
@@ -418,6 +493,26 @@ class UserSubscription(models.Model):
     #     return 0
 
 
+class ExpiryNotification(models.Model):
+    """
+    Log of expiry reminder emails, one per subscription per expiry date
+    Used to dedupe reminders across runs; a renewed subscription gets a new expiry date
+    and therefore a new reminder.
+    """
+    subscription = models.ForeignKey(UserSubscription, on_delete=models.CASCADE, related_name='expiry_notifications')
+    expiry_date = models.DateTimeField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'expiry_notifications'
+        verbose_name = 'Expiry Notification'
+        verbose_name_plural = 'Expiry Notifications'
+        unique_together = [['subscription', 'expiry_date']]
+    
+    def __str__(self):
+        return f"{self.subscription} - {self.expiry_date:%d %b %Y}"
+
+
 class Coupon(models.Model):
     """
     Discount coupons for orders
@@ -548,3 +643,183 @@ class CouponUsage(models.Model):
     
     def __str__(self):
         return f"{self.user.username} - {self.coupon.code}"
+
+
+class DailyRevenueRollup(models.Model):
+    """
+    Completed-order revenue per day (by order creation date) per product or bundled plan
+    Rebuilt by products.rollups; the admin dashboard reads these instead of scanning orders.
+    """
+    date = models.DateField()
+    product = models.ForeignKey(MyProducts, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    bundled_plan = models.ForeignKey(BundledPlan, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    order_count = models.IntegerField(default=0)
+    gross_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    discount_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    tax_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'rollup_daily_revenue'
+        verbose_name = 'Daily Revenue'
+        verbose_name_plural = 'Daily Revenue'
+        ordering = ['-date']
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+    
+    def __str__(self):
+        item = self.bundled_plan or self.product or 'Unknown item'
+        return f"{self.date} - {item}: {self.revenue}"
+
+
+class ActiveSubscriberRollup(models.Model):
+    """Active subscribers per product, one snapshot per day"""
+    date = models.DateField()
+    product = models.ForeignKey(MyProducts, on_delete=models.CASCADE, related_name='+')
+    active_subscribers = models.IntegerField(default=0)
+    active_subscriptions = models.IntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'rollup_active_subscribers'
+        verbose_name = 'Active Subscribers'
+        verbose_name_plural = 'Active Subscribers'
+        ordering = ['-date']
+        unique_together = [['date', 'product']]
+    
+    def __str__(self):
+        return f"{self.date} - {self.product}: {self.active_subscribers}"
+
+
+class WeeklyExpiryRollup(models.Model):
+    """Active subscriptions expiring per week (weeks start on Monday) per product"""
+    week_start = models.DateField()
+    product = models.ForeignKey(MyProducts, on_delete=models.CASCADE, related_name='+')
+    expiring_subscriptions = models.IntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'rollup_weekly_expiries'
+        verbose_name = 'Weekly Expiries'
+        verbose_name_plural = 'Weekly Expiries'
+        ordering = ['week_start']
+        unique_together = [['week_start', 'product']]
+    
+    def __str__(self):
+        return f"Week of {self.week_start} - {self.product}: {self.expiring_subscriptions}"
+
+
+class CouponRevenueRollup(models.Model):
+    """Revenue from completed orders that used a coupon, per day per coupon"""
+    date = models.DateField()
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name='+')
+    order_count = models.IntegerField(default=0)
+    discount_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'rollup_coupon_revenue'
+        verbose_name = 'Coupon Revenue'
+        verbose_name_plural = 'Coupon Revenue'
+        ordering = ['-date']
+        unique_together = [['date', 'coupon']]
+    
+    def __str__(self):
+        return f"{self.date} - {self.coupon.code}: {self.revenue}"
+
+
+class ArchivedOrder(models.Model):
+    """
+    An order moved out of the live orders table by products.archive
+    Keeps what purchase history displays as columns and the full order, with its
+    coupon usage, as serialized JSON.
+    """
+    order_id = models.CharField(max_length=100, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    item_type = models.CharField(max_length=20)
+    item_name = models.CharField(max_length=200)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    final_price = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    payment_completed_at = models.DateTimeField(null=True, blank=True)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'archived_orders'
+        verbose_name = 'Archived Order'
+        verbose_name_plural = 'Archived Orders'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"Archived order {self.order_id}"
+
+
+class ArchivedSubscription(models.Model):
+    """A long-expired subscription moved out of the live user_subscriptions table"""
+    subscription_id = models.BigIntegerField(unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_subscriptions')
+    product_name = models.CharField(max_length=200, blank=True)
+    order_id = models.CharField(max_length=100)
+    start_date = models.DateTimeField()
+    expiry_date = models.DateTimeField()
+    status = models.CharField(max_length=20)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'archived_user_subscriptions'
+        verbose_name = 'Archived Subscription'
+        verbose_name_plural = 'Archived Subscriptions'
+        ordering = ['-expiry_date']
+        indexes = [
+            models.Index(fields=['user', 'expiry_date']),
+        ]
+    
+    def __str__(self):
+        return f"Archived subscription {self.subscription_id} - {self.product_name}"
+
+
+class CacheVersion(models.Model):
+    """
+    Named version counters for cached data
+    Cache keys embed the counter, so bumping it retires every entry built from older rows.
+    Kept in the database rather than the cache so a bump made by one server process is
+    seen by all of them, whatever the cache backend.
+    """
+    name = models.CharField(max_length=150, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'cache_versions'
+        verbose_name = 'Cache Version'
+        verbose_name_plural = 'Cache Versions'
+    
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+    
+    @classmethod
+    def bump(cls, *names):
+        """
+        Increment the named counters in the caller's transaction
+        The new versions become visible to other processes when that transaction commits.
+        """
+        names = set(names)
+        if not names:
+            return
+        cls.objects.bulk_create([cls(name=name) for name in names], ignore_conflicts=True)
+        cls.objects.filter(name__in=names).update(version=models.F('version') + 1, updated_at=timezone.now())
+    
+    @classmethod
+    def current(cls, *names):
+        """Current version of each named counter; 0 for counters never bumped"""
+        versions = dict.fromkeys(names, 0)
+        versions.update(cls.objects.filter(name__in=names).values_list('name', 'version'))
+        return versions
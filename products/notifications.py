@@ -0,0 +1,162 @@
+"""
+Subscription Expiry Notifications
+Pages through users with expiring subscriptions, renders reminders from one compiled
+template and sends them in batches over a single reused mail connection, rate limited
+and deduplicated through ExpiryNotification.
+A bundle holder gets one reminder for the bundle, not one per product in it, and it
+links to the bundle's checkout.
+"""
+
+import math
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Exists, OuterRef
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import ExpiryNotification, UserSubscription
+
+EXPIRY_NOTICE_TEMPLATE = 'products/emails/expiry_notice.txt'
+
+
+class RateLimiter:
+    """Blocks just long enough to keep the send rate under `rate` messages per second"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.sent = 0
+
+    def wait(self, count):
+        if self.rate:
+            earliest = self.started + (self.sent + count) / self.rate
+            delay = earliest - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.sent += count
+
+
+def get_expiring_subscriptions(days=7, now=None):
+    """
+    Active subscriptions expiring within `days` that haven't been reminded for this expiry yet
+    Rows already renewed (another active row for the product runs past them) need no reminder.
+    """
+    now = now or timezone.now()
+    already_sent = ExpiryNotification.objects.filter(
+        subscription=OuterRef('pk'),
+        expiry_date=OuterRef('expiry_date')
+    )
+    renewed = UserSubscription.objects.filter(
+        user_id=OuterRef('user_id'),
+        product_id=OuterRef('product_id'),
+        status='active',
+        is_active=True,
+        expiry_date__gt=OuterRef('expiry_date')
+    )
+    return UserSubscription.objects.filter(
+        status='active',
+        is_active=True,
+        expiry_date__lte=now + timezone.timedelta(days=days),
+        expiry_date__gt=now
+    ).exclude(Exists(already_sent)).exclude(Exists(renewed)).exclude(user__email='').order_by('id')
+
+
+def group_reminders(subscriptions):
+    """
+    One reminder per bundle a user holds and one per separately bought product
+    Returns: list of subscription lists, each sent as a single message
+    """
+    groups = {}
+    for subscription in subscriptions:
+        if subscription.bundled_plan_id:
+            key = ('bundle', subscription.user_id, subscription.bundled_plan_id)
+        else:
+            key = ('product', subscription.pk)
+        groups.setdefault(key, []).append(subscription)
+    return list(groups.values())
+
+
+def renew_url(subscription):
+    """Checkout for what the user bought: the bundle, the product, or the catalogue if neither is on sale"""
+    plan, product = subscription.bundled_plan, subscription.product
+    if plan and plan.is_active:
+        path = reverse('checkout:checkout_view', kwargs={'type': 'bundle', 'slug': plan.slug})
+    elif product and product.is_active and not plan:
+        path = reverse('checkout:checkout_view', kwargs={'type': 'product', 'slug': product.slug})
+    else:
+        path = reverse('dashboard:products:products')
+    return settings.SITE_URL + path
+
+
+def build_expiry_message(template, subscriptions, now, connection):
+    first = min(subscriptions, key=lambda s: s.expiry_date)
+    plan = first.bundled_plan
+    product_names = [s.product.name for s in subscriptions if s.product]
+    context = {
+        'user': first.user,
+        'product_name': plan.name if plan else (product_names[0] if product_names else 'your plan'),
+        'included_products': product_names if plan else [],
+        'expiry_date': timezone.localtime(first.expiry_date),
+        'days_left': max(math.ceil((first.expiry_date - now).total_seconds() / 86400), 0),
+        'renew_url': renew_url(first),
+    }
+    return EmailMessage(
+        subject=f"Your {context['product_name']} access expires on {context['expiry_date']:%d %b %Y}",
+        body=template.render(context),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[first.user.email],
+        connection=connection,
+    )
+
+
+def send_expiry_notifications(days=7, page_size=500, batch_size=50, rate_limit=None, connection=None, progress=None):
+    """
+    Send reminders to users whose subscriptions expire within `days`
+    - users are paged `page_size` at a time, so all of a user's subscriptions are grouped together
+    - one mail connection for the whole run, messages handed over `batch_size` at a time
+    - at most `rate_limit` messages per second (EXPIRY_NOTIFICATION_RATE_LIMIT, 0 = unlimited)
+    - each sent reminder is logged against all its subscriptions so re-runs skip them
+    `progress(sent)` is called after every batch.
+    Returns: number of notifications sent
+    """
+    if rate_limit is None:
+        rate_limit = settings.EXPIRY_NOTIFICATION_RATE_LIMIT
+    now = timezone.now()
+    template = get_template(EXPIRY_NOTICE_TEMPLATE)
+    limiter = RateLimiter(rate_limit)
+    connection = connection or get_connection()
+    expiring = get_expiring_subscriptions(days, now)
+    users = expiring.order_by('user_id').values_list('user_id', flat=True).distinct()
+
+    notifications_sent = 0
+    last_user_id = 0
+    connection.open()
+    try:
+        while True:
+            user_ids = list(users.filter(user_id__gt=last_user_id)[:page_size])
+            if not user_ids:
+                break
+            last_user_id = user_ids[-1]
+            page = expiring.filter(user_id__in=user_ids).select_related('user', 'product', 'bundled_plan')
+            reminders = group_reminders(page.order_by('user_id', 'id'))
+
+            for start in range(0, len(reminders), batch_size):
+                batch = reminders[start:start + batch_size]
+                messages = [build_expiry_message(template, group, now, connection) for group in batch]
+                limiter.wait(len(messages))
+                connection.send_messages(messages)
+
+                ExpiryNotification.objects.bulk_create(
+                    [ExpiryNotification(subscription=sub, expiry_date=sub.expiry_date) for group in batch for sub in group],
+                    ignore_conflicts=True
+                )
+                notifications_sent += len(batch)
+                if progress:
+                    progress(notifications_sent)
+    finally:
+        connection.close()
+
+    return notifications_sent
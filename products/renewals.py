@@ -0,0 +1,161 @@
+"""
+Renewals & Upgrades
+Every completed order gets its own subscription row per product, so each order keeps
+showing what it granted; a purchase of something the user already holds is chained
+onto their existing rows instead of overlapping them:
+- renewal: buying what you already hold starts the new row's term when the last
+  current one ends, so stacked purchases run back to back
+- upgrade: buying a bundle that covers products held through another purchase starts
+  the bundle's rows now and cancels the rows it replaces; all of their unused time,
+  including terms stacked after the current one, is credited against the bundle's price
+The rows an upgrade was credited for are stored on its order, and only those are
+cancelled when it completes, so a second pending upgrade can't take the same credit
+or cancel the rows the first one created.
+"""
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .models import Order, PlanProduct, UserSubscription
+
+
+def current_subscriptions(user_id, product_ids, now, lock=False):
+    """
+    The user's current and upcoming subscription rows, as lists keyed by product id
+    With lock, the rows are read with SELECT ... FOR UPDATE (call inside a transaction).
+    """
+    rows = UserSubscription.objects.filter(
+        user_id=user_id, product_id__in=product_ids, status='active', is_active=True, expiry_date__gt=now
+    ).select_related('order').order_by('product_id', 'expiry_date')
+    if lock:
+        rows = rows.select_for_update()
+    current = {}
+    for subscription in rows:
+        current.setdefault(subscription.product_id, []).append(subscription)
+    return current
+
+
+def is_upgrade(subscription, bundled_plan_id):
+    """True if buying this bundle replaces a current term bought through something else"""
+    return bool(bundled_plan_id) and subscription.bundled_plan_id != bundled_plan_id
+
+
+def term_values(subscriptions):
+    """
+    What the user paid (before tax) for each subscription's term
+    A bundle order's amount is split across its products by their base price.
+    """
+    bundle_ids = {s.order.bundled_plan_id for s in subscriptions if s.order.bundled_plan_id}
+    weights = {}
+    for plan_id, product_id, base_price in PlanProduct.objects.filter(plan_id__in=bundle_ids).values_list(
+        'plan_id', 'product_id', 'product__base_price'
+    ):
+        weights.setdefault(plan_id, {})[product_id] = base_price
+
+    values = {}
+    for subscription in subscriptions:
+        order = subscription.order
+        paid = order.final_price - order.tax_amount
+        if order.bundled_plan_id:
+            plan_weights = weights.get(order.bundled_plan_id, {})
+            total = sum(plan_weights.values())
+            share = plan_weights.get(subscription.product_id, 0) / total if total else 0
+            paid = paid * Decimal(share)
+        values[subscription.pk] = paid
+    return values
+
+
+def remaining_fraction(subscription, now):
+    """Unused share of a row's term: all of it for a term that hasn't started yet"""
+    term_seconds = subscription.validity_days * 86400
+    if term_seconds <= 0:
+        return Decimal('0')
+    remaining = max((subscription.expiry_date - max(subscription.start_date, now)).total_seconds(), 0)
+    return Decimal(remaining / term_seconds)
+
+
+def replaced_subscriptions(current, bundled_plan_id):
+    """Rows a bundle purchase replaces, from current_subscriptions()"""
+    return [s for rows in current.values() for s in rows if is_upgrade(s, bundled_plan_id)]
+
+
+def pending_credits(user_id, bundled_plan_id, now):
+    """
+    Ids of the user's rows already credited to a live pending upgrade to another bundle
+    Pending orders for the same bundle are left out: checkout retries reuse them.
+    """
+    since = now - timezone.timedelta(minutes=settings.ORDER_IDEMPOTENCY_WINDOW_MINUTES)
+    return set(Order.credited_subscriptions.through.objects.filter(
+        order__user_id=user_id, order__status='pending', order__created_at__gte=since
+    ).exclude(order__bundled_plan_id=bundled_plan_id).values_list('usersubscription_id', flat=True))
+
+
+def upgrade_credit(user, bundled_plan_id, now=None):
+    """
+    Prorated credit towards a bundle for all the unused time on products it replaces
+    Returns: (credit, credited subscriptions)
+    """
+    if not getattr(user, 'is_authenticated', False):
+        return Decimal('0'), []
+    now = now or timezone.now()
+    product_ids = list(PlanProduct.objects.filter(plan_id=bundled_plan_id).values_list('product_id', flat=True))
+    replaced = replaced_subscriptions(current_subscriptions(user.pk, product_ids, now), bundled_plan_id)
+    if replaced:
+        taken = pending_credits(user.pk, bundled_plan_id, now)
+        replaced = [s for s in replaced if s.pk not in taken]
+    if not replaced:
+        return Decimal('0'), []
+
+    values = term_values(replaced)
+    credit = sum((values[s.pk] * remaining_fraction(s, now) for s in replaced), Decimal('0'))
+    return credit.quantize(Decimal('0.01')), replaced
+
+
+def apply_purchase(order, items, now=None):
+    """
+    Create the order's subscription row for each (product, validity_days)
+    Runs inside the order's finalisation transaction. The buyer's row is locked first, so
+    concurrent orders for the same user are chained one after the other rather than both
+    starting from the same expiry, then their current rows are read with FOR UPDATE.
+    Returns: the created subscriptions
+    """
+    now = now or timezone.now()
+    User.objects.select_for_update().filter(pk=order.user_id).first()
+    current = current_subscriptions(order.user_id, [product.id for product, _ in items], now, lock=True)
+
+    # The order was priced with a credit for the rows it replaces: end those that are still
+    # current (now locked), and note any that another order or an admin ended first
+    credited_ids = set(order.credited_subscriptions.values_list('pk', flat=True)) if order.proration_credit > 0 else set()
+    replaced = [
+        s for rows in current.values() for s in rows
+        if s.pk in credited_ids and is_upgrade(s, order.bundled_plan_id)
+    ]
+    if replaced:
+        UserSubscription.objects.filter(pk__in=[s.pk for s in replaced]).update(
+            status='cancelled', is_active=False, updated_at=now
+        )
+    replaced_ids = {s.pk for s in replaced}
+    gone = sorted(credited_ids - replaced_ids)
+    if gone:
+        note = f"Credited subscriptions no longer current at completion: {', '.join(map(str, gone))}"
+        order.notes = f"{order.notes}\n{note}" if order.notes else note
+        order.save(update_fields=['notes', 'updated_at'])
+
+    created = []
+    for product, validity_days in items:
+        kept = [s for s in current.get(product.id, []) if s.pk not in replaced_ids]
+        # Renewal: the new term starts when the last current one ends
+        start = max([now] + [s.expiry_date for s in kept])
+        created.append(UserSubscription(
+            user_id=order.user_id,
+            order=order,
+            bundled_plan_id=order.bundled_plan_id,
+            product=product,
+            validity_days=validity_days,
+            start_date=start,
+            expiry_date=start + timezone.timedelta(days=validity_days)
+        ))
+    return UserSubscription.objects.bulk_create(created)
@@ -0,0 +1,207 @@
+"""
+Subscription Analytics Rollups
+Aggregates orders, subscriptions and coupon usage into the rollup tables with one
+grouped query per table, ranged on the created_at / expiry_date indexes. A full
+rebuild recomputes everything back to the archive horizon (run nightly); an
+incremental run only recomputes the trailing ROLLUP_INCREMENTAL_DAYS, which covers
+orders still being completed or reconciled. Rollups older than the archive horizon
+are left as they are, since their source rows may have moved to the archive.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import Trunc, TruncDate
+from django.utils import timezone
+
+from .archive import archive_horizon
+from .models import (
+    Order, UserSubscription, CouponUsage,
+    DailyRevenueRollup, ActiveSubscriberRollup, WeeklyExpiryRollup, CouponRevenueRollup
+)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def _replace(model, stale, rows):
+    """Swap a range of rollup rows for freshly computed ones in one transaction"""
+    with transaction.atomic():
+        stale.delete()
+        model.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+def build_daily_revenue(since=None):
+    orders = Order.objects.filter(status='completed')
+    stale = DailyRevenueRollup.objects.all()
+    if since:
+        orders = orders.filter(created_at__gte=_day_start(since))
+        stale = stale.filter(date__gte=since)
+
+    totals = orders.annotate(day=TruncDate('created_at')).values(
+        'day', 'product_id', 'bundled_plan_id'
+    ).annotate(
+        order_count=Count('id'),
+        gross_amount=Sum('original_price'),
+        discount_amount=Sum('discount_amount'),
+        tax_amount=Sum('tax_amount'),
+        revenue=Sum('final_price'),
+    ).order_by()
+
+    return _replace(DailyRevenueRollup, stale, [
+        DailyRevenueRollup(
+            date=row['day'],
+            product_id=row['product_id'],
+            bundled_plan_id=row['bundled_plan_id'],
+            order_count=row['order_count'],
+            gross_amount=row['gross_amount'],
+            discount_amount=row['discount_amount'],
+            tax_amount=row['tax_amount'],
+            revenue=row['revenue'],
+        )
+        for row in totals
+    ])
+
+
+def build_coupon_revenue(since=None):
+    usages = CouponUsage.objects.filter(order__status='completed')
+    stale = CouponRevenueRollup.objects.all()
+    if since:
+        usages = usages.filter(order__created_at__gte=_day_start(since))
+        stale = stale.filter(date__gte=since)
+
+    totals = usages.annotate(day=TruncDate('order__created_at')).values(
+        'day', 'coupon_id'
+    ).annotate(
+        order_count=Count('order_id', distinct=True),
+        discount_amount=Sum('discount_amount'),
+        revenue=Sum('order__final_price'),
+    ).order_by()
+
+    return _replace(CouponRevenueRollup, stale, [
+        CouponRevenueRollup(
+            date=row['day'],
+            coupon_id=row['coupon_id'],
+            order_count=row['order_count'],
+            discount_amount=row['discount_amount'],
+            revenue=row['revenue'],
+        )
+        for row in totals
+    ])
+
+
+def build_active_subscribers(now=None):
+    """Snapshot today's active subscribers; history builds up one day per run"""
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    totals = UserSubscription.objects.filter(
+        status='active',
+        is_active=True,
+        start_date__lte=now,
+        expiry_date__gt=now,
+        product__isnull=False
+    ).values('product_id').annotate(
+        active_subscribers=Count('user_id', distinct=True),
+        active_subscriptions=Count('id'),
+    ).order_by()
+
+    return _replace(ActiveSubscriberRollup, ActiveSubscriberRollup.objects.filter(date=today), [
+        ActiveSubscriberRollup(date=today, **row)
+        for row in totals
+    ])
+
+
+def build_weekly_expiries(since=None):
+    subscriptions = UserSubscription.objects.exclude(status='cancelled').filter(product__isnull=False)
+    stale = WeeklyExpiryRollup.objects.all()
+    if since:
+        week_start = since - datetime.timedelta(days=since.weekday())
+        subscriptions = subscriptions.filter(expiry_date__gte=_day_start(week_start))
+        stale = stale.filter(week_start__gte=week_start)
+
+    totals = subscriptions.annotate(
+        week=Trunc('expiry_date', 'week', output_field=DateField())
+    ).values('week', 'product_id').annotate(
+        expiring_subscriptions=Count('id')
+    ).order_by()
+
+    return _replace(WeeklyExpiryRollup, stale, [
+        WeeklyExpiryRollup(
+            week_start=row['week'],
+            product_id=row['product_id'],
+            expiring_subscriptions=row['expiring_subscriptions'],
+        )
+        for row in totals
+    ])
+
+
+def build_rollups(full=False, since=None):
+    """
+    Recompute all rollup tables
+    - full: rebuild every table back to the archive horizon
+    - otherwise: recompute from `since` (default: ROLLUP_INCREMENTAL_DAYS ago) onwards
+    Returns: dict of rows written per rollup
+    """
+    if not full and since is None:
+        since = timezone.localdate() - datetime.timedelta(days=settings.ROLLUP_INCREMENTAL_DAYS)
+    if full:
+        since = archive_horizon()
+
+    return {
+        'daily_revenue': build_daily_revenue(since),
+        'coupon_revenue': build_coupon_revenue(since),
+        'active_subscribers': build_active_subscribers(),
+        'weekly_expiries': build_weekly_expiries(since),
+    }
+
+
+def dashboard_summary(days=30, weeks=8):
+    """Figures for the admin analytics dashboard, read from the rollup tables only"""
+    today = timezone.localdate()
+    since = today - datetime.timedelta(days=days - 1)
+    current_week = today - datetime.timedelta(days=today.weekday())
+
+    revenue = DailyRevenueRollup.objects.filter(date__gte=since)
+    latest_snapshot = ActiveSubscriberRollup.objects.order_by('-date').values_list('date', flat=True).first()
+
+    return {
+        'since': since,
+        'totals': revenue.aggregate(
+            orders=Sum('order_count'),
+            revenue=Sum('revenue'),
+            discounts=Sum('discount_amount'),
+            tax=Sum('tax_amount'),
+        ),
+        'revenue_by_day': revenue.values('date').annotate(
+            orders=Sum('order_count'),
+            revenue=Sum('revenue'),
+        ).order_by('-date'),
+        'revenue_by_item': revenue.values(
+            'product__name', 'bundled_plan__name'
+        ).annotate(
+            orders=Sum('order_count'),
+            revenue=Sum('revenue'),
+        ).order_by('-revenue'),
+        'snapshot_date': latest_snapshot,
+        'active_subscribers': ActiveSubscriberRollup.objects.filter(
+            date=latest_snapshot
+        ).select_related('product').order_by('-active_subscribers'),
+        'weekly_expiries': WeeklyExpiryRollup.objects.filter(
+            week_start__gte=current_week,
+            week_start__lt=current_week + datetime.timedelta(weeks=weeks)
+        ).values('week_start').annotate(
+            expiring=Sum('expiring_subscriptions')
+        ).order_by('week_start'),
+        'coupon_revenue': CouponRevenueRollup.objects.filter(date__gte=since).values(
+            'coupon__code'
+        ).annotate(
+            orders=Sum('order_count'),
+            discounts=Sum('discount_amount'),
+            revenue=Sum('revenue'),
+        ).order_by('-revenue'),
+        'computed_at': DailyRevenueRollup.objects.order_by('-computed_at').values_list('computed_at', flat=True).first(),
+    }
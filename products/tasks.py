@@ -0,0 +1,38 @@
+"""
+Periodic subscription jobs, run by the job queue workers (manage.py run_jobs)
+The matching management commands remain for running them by hand.
+"""
+
+import datetime
+
+from jobs.queue import job
+
+from .archive import archive_records
+from .notifications import send_expiry_notifications
+from .rollups import build_rollups
+from .utils import update_expired_subscriptions
+
+
+@job(every=datetime.timedelta(hours=1), timeout=3600)
+def expire_subscriptions():
+    update_expired_subscriptions()
+
+
+@job(every=datetime.timedelta(days=1), timeout=4 * 3600)
+def send_expiry_reminders(days=7):
+    send_expiry_notifications(days=days)
+
+
+@job(every=datetime.timedelta(minutes=15))
+def build_incremental_rollups():
+    build_rollups()
+
+
+@job(every=datetime.timedelta(days=1), timeout=2 * 3600)
+def build_full_rollups():
+    build_rollups(full=True)
+
+
+@job(every=datetime.timedelta(days=1), timeout=4 * 3600)
+def archive_old_records():
+    archive_records()
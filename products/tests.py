@@ -1,3 +1,412 @@
-from django.test import TestCase
+import gzip
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    ActiveSubscriberRollup, ArchivedOrder, ArchivedSubscription, BundledPlan, DailyRevenueRollup,
+    ExpiryNotification, MyProducts, Order, PlanProduct, ProductCategory, UserSubscription,
+)
+from .archive import archive_records
+from .rollups import build_rollups, dashboard_summary
+from .access_tracking import AccessBuffer
+from .entitlements import get_cached_entitlements, invalidate_entitlements, load_entitlements
+from .notifications import send_expiry_notifications
+from .renewals import upgrade_credit
+from .utils import SubscriptionManager, get_products_by_type, in_peak_hours, update_expired_subscriptions
+
+
+def make_product(slug, **kwargs):
+    return MyProducts.objects.create(name=slug.title(), slug=slug, base_price=100, validity_days=365, **kwargs)
+
+
+def make_bundle(slug, products, **kwargs):
+    plan = BundledPlan.objects.create(
+        name=slug.title(), slug=slug, plan_type='premium', original_price=1000, selling_price=800, **kwargs
+    )
+    for product in products:
+        PlanProduct.objects.create(plan=plan, product=product)
+    return plan
+
+
+def buy(user, product=None, plan=None, price=100):
+    order = Order.objects.create(
+        user=user, product=product, bundled_plan=plan, original_price=price, final_price=price, status='pending'
+    )
+    order.mark_completed()
+    return order
+
+
+@override_settings(SITE_URL='https://example.com', EXPIRY_NOTIFICATION_RATE_LIMIT=0)
+class ExpiryNotificationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        self.products = [make_product(f'product-{i}') for i in range(3)]
+
+    def expire_soon(self, order):
+        order.subscriptions.update(expiry_date=timezone.now() + timezone.timedelta(days=3))
+
+    def test_bundle_holder_gets_one_reminder_linking_to_the_bundle(self):
+        plan = make_bundle('complete', self.products)
+        self.expire_soon(buy(self.user, plan=plan, price=800))
+        self.expire_soon(buy(self.user, product=make_product('mock-tests')))
+
+        self.assertEqual(send_expiry_notifications(), 2)
+
+        self.assertEqual(len(mail.outbox), 2)
+        bundle_mail = next(m for m in mail.outbox if 'Complete' in m.subject)
+        self.assertIn('https://example.com/checkout/bundle/complete/', bundle_mail.body)
+        for product in self.products:
+            self.assertIn(product.name, bundle_mail.body)
+        self.assertEqual(ExpiryNotification.objects.count(), 4)
+
+        # Already reminded for these expiry dates
+        self.assertEqual(send_expiry_notifications(), 0)
+
+    def test_product_sold_only_in_a_retired_bundle_links_to_the_catalogue(self):
+        hidden = make_product('bundle-only', is_active=False)
+        plan = make_bundle('retired', [hidden])
+        self.expire_soon(buy(self.user, plan=plan, price=800))
+        BundledPlan.objects.filter(pk=plan.pk).update(is_active=False)
+
+        send_expiry_notifications()
+
+        self.assertNotIn('/checkout/', mail.outbox[0].body)
+
+
+class OrderSubscriptionTests(TestCase):
+
+    def test_bundle_order_creates_one_row_per_product_in_bounded_queries(self):
+        cache.clear()
+        user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        plan = make_bundle('complete', [make_product(f'product-{i}') for i in range(10)])
+        order = Order.objects.create(user=user, bundled_plan=plan, original_price=800, final_price=800)
+
+        # Savepoint, status update, entitlement version bump (2), plan products, user lock,
+        # current rows, one insert, release
+        with self.assertNumQueries(9):
+            order.mark_completed()
+
+        subscriptions = list(order.subscriptions.all())
+        self.assertEqual(len(subscriptions), 10)
+        self.assertEqual({s.bundled_plan_id for s in subscriptions}, {plan.pk})
+        self.assertEqual(len({s.start_date for s in subscriptions}), 1)
+
+
+class ExpirySweepTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        for i in range(5):
+            buy(self.user, product=make_product(f'product-{i}'))
+
+    def test_lapsed_rows_are_expired_in_chunks(self):
+        subscriptions = self.user.subscriptions.order_by('id')
+        lapsed = [s.pk for s in subscriptions[:3]]
+        UserSubscription.objects.filter(pk__in=lapsed).update(expiry_date=timezone.now() - timezone.timedelta(days=1))
+        chunks = []
+
+        with self.captureOnCommitCallbacks(execute=True):
+            count = update_expired_subscriptions(chunk_size=2, progress=lambda count, rate: chunks.append(count))
+
+        self.assertEqual(count, 3)
+        self.assertEqual(chunks, [2, 3])
+        self.assertEqual(set(UserSubscription.objects.filter(status='expired').values_list('pk', flat=True)), set(lapsed))
+        self.assertEqual(update_expired_subscriptions(), 0)
+
+    def test_peak_window_can_wrap_midnight(self):
+        def at(hour):
+            return timezone.make_aware(timezone.datetime(2026, 1, 1, hour))
+
+        self.assertTrue(in_peak_hours('9-23', at(9)))
+        self.assertFalse(in_peak_hours('9-23', at(23)))
+        self.assertTrue(in_peak_hours('22-6', at(2)))
+        self.assertFalse(in_peak_hours('', at(12)))
+
+
+class SubscriptionManagerTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        self.counselling = ProductCategory.objects.create(name='Counselling', slug='counselling')
+        self.owned = make_product('owned', category=self.counselling)
+        self.other = make_product('other')
+        buy(self.user, product=self.owned)
+
+    def test_access_checks_share_one_snapshot(self):
+        manager = SubscriptionManager(self.user)
+        with self.assertNumQueries(0):
+            self.assertTrue(manager.has_active_subscription())
+            self.assertTrue(manager.has_active_subscription(product_slug='owned'))
+            self.assertFalse(manager.has_active_subscription(product_slug='other'))
+
+    def test_service_type_is_combined_with_product(self):
+        manager = SubscriptionManager(self.user)
+        # No active subscription to the product, so the service type can't match either
+        with self.assertNumQueries(0):
+            self.assertFalse(manager.has_active_subscription(product_slug='other', service_type='counselling'))
+            self.assertTrue(manager.has_active_subscription(product_slug='owned', service_type='counselling'))
+            self.assertTrue(manager.has_active_subscription(service_type='counselling'))
+            self.assertFalse(manager.has_active_subscription(product_slug='owned', service_type='predictor'))
+        self.assertEqual(list(get_products_by_type('counselling')), [self.owned])
+
+    def test_product_page_shows_access_and_bundle_limits(self):
+        plan = make_bundle('complete', [self.other], max_purchases_per_user=1)
+        buy(self.user, plan=plan, price=800)
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('dashboard:products:product_detail', args=['product', 'owned']))
+        self.assertEqual(response.context['access_expiry'], self.user.subscriptions.get(product=self.owned).expiry_date)
+        self.assertContains(response, 'Buy Now')
+
+        response = self.client.get(reverse('dashboard:products:product_detail', args=['bundle', 'complete']))
+        self.assertFalse(response.context['can_purchase'])
+        self.assertNotContains(response, 'Buy Now')
+
+    def test_lapsed_subscription_has_no_access(self):
+        self.user.subscriptions.update(expiry_date=timezone.now() - timezone.timedelta(days=1))
+        self.assertFalse(SubscriptionManager(self.user).has_active_subscription(product_slug='owned'))
+
+
+class EntitlementCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        self.product = make_product('counselling')
+
+    def test_snapshot_is_reused_until_subscriptions_change(self):
+        self.assertFalse(get_cached_entitlements(self.user).is_enrolled(self.product))
+
+        subscription = buy(self.user, product=self.product).subscriptions.get()
+        snapshot = get_cached_entitlements(self.user)
+        self.assertTrue(snapshot.is_enrolled(self.product))
+        # Only the version lookup
+        with self.assertNumQueries(1):
+            self.assertIs(get_cached_entitlements(self.user).is_enrolled('counselling'), True)
+
+        # Access tracking doesn't change entitlements, so it keeps the cached snapshot
+        subscription.save(update_fields=['access_count', 'updated_at'])
+        with self.assertNumQueries(1):
+            get_cached_entitlements(self.user)
+
+        subscription.status = 'cancelled'
+        subscription.save()
+        self.assertFalse(get_cached_entitlements(self.user).is_enrolled(self.product))
+
+    def test_change_from_another_process_retires_the_cached_snapshot(self):
+        buy(self.user, product=self.product)
+        self.assertTrue(get_cached_entitlements(self.user).is_enrolled(self.product))
+
+        # As another server process would do it: its cache is not this one, only the database is shared
+        with mock.patch('products.entitlements.cache'):
+            self.user.subscriptions.update(status='cancelled')
+            invalidate_entitlements(self.user.pk)
+        self.assertFalse(get_cached_entitlements(self.user).is_enrolled(self.product))
+
+
+class AccessTrackingTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        buy(user, product=make_product('first'))
+        buy(user, product=make_product('second'))
+        self.first, self.second = user.subscriptions.order_by('id')
+
+    def test_accesses_are_counted_in_memory_and_flushed_together(self):
+        buffer = AccessBuffer(flush_interval=3600)
+        with mock.patch.object(buffer, '_ensure_flusher'), self.assertNumQueries(0):
+            for _ in range(3):
+                buffer.record(self.first.pk)
+            buffer.record(self.second.pk)
+        self.assertEqual(buffer.stats()['backlog_events'], 4)
+
+        # One UPDATE per distinct count
+        with self.assertNumQueries(2):
+            self.assertEqual(buffer.flush(), 2)
+
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.access_count, self.second.access_count), (3, 1))
+        self.assertIsNotNone(self.first.last_accessed)
+        self.assertEqual(buffer.stats()['backlog_rows'], 0)
+
+    def test_failed_flush_keeps_the_counts(self):
+        buffer = AccessBuffer(flush_interval=3600)
+        with mock.patch.object(buffer, '_ensure_flusher'):
+            buffer.record(self.first.pk)
+
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError), self.assertLogs('products.access_tracking', 'ERROR'):
+            buffer.flush()
+
+        self.assertEqual(buffer.stats()['backlog_events'], 1)
+
+
+class RenewalTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        self.product = make_product('counselling')
+
+    def test_renewal_chains_a_new_row_and_keeps_the_first_order(self):
+        first = buy(self.user, product=self.product)
+        second = buy(self.user, product=self.product)
+
+        old, new = first.subscriptions.get(), second.subscriptions.get()
+        self.assertEqual(new.start_date, old.expiry_date)
+        self.assertEqual((new.expiry_date - old.expiry_date).days, 365)
+        self.assertEqual(old.status, 'active')
+        self.assertEqual(load_entitlements(self.user).expiry_for(self.product.pk), new.expiry_date)
+
+    def test_repeat_bundle_purchases_are_counted_per_order(self):
+        plan = make_bundle('complete', [self.product])
+        buy(self.user, plan=plan, price=800)
+        buy(self.user, plan=plan, price=800)
+        self.assertEqual(load_entitlements(self.user).bundle_purchase_count(plan.pk), 2)
+
+    def test_upgrade_credits_stacked_time_and_replaces_rows(self):
+        first = buy(self.user, product=self.product, price=100)
+        buy(self.user, product=self.product, price=100)
+        plan = make_bundle('complete', [self.product, make_product('mock-tests')])
+
+        # Nearly all of the current term plus the whole stacked term
+        credit, credited = upgrade_credit(self.user, plan.pk)
+        self.assertGreater(credit, Decimal('199'))
+        self.assertLessEqual(credit, Decimal('200'))
+
+        order = Order.objects.create(
+            user=self.user, bundled_plan=plan, original_price=1000, final_price=800 - credit,
+            proration_credit=credit, status='pending'
+        )
+        order.credited_subscriptions.set(credited)
+        Order.finalize_payment(order.pk)
+
+        self.assertEqual(set(self.user.subscriptions.filter(order__product=self.product).values_list('status', flat=True)), {'cancelled'})
+        bundle_row = order.subscriptions.get(product=self.product)
+        self.assertLess((timezone.now() - bundle_row.start_date).total_seconds(), 60)
+        self.assertEqual(first.subscriptions.count(), 1)
+
+    def test_two_pending_upgrades_dont_share_credit(self):
+        held = buy(self.user, product=self.product, price=100).subscriptions.get()
+        first_plan = make_bundle('complete', [self.product, make_product('mock-tests')])
+        second_plan = make_bundle('premium', [self.product, make_product('sessions')])
+
+        credit, credited = upgrade_credit(self.user, first_plan.pk)
+        first = Order.objects.create(
+            user=self.user, bundled_plan=first_plan, original_price=1000, final_price=800 - credit,
+            proration_credit=credit, status='pending'
+        )
+        first.credited_subscriptions.set(credited)
+
+        # The held row is already spoken for by the first pending upgrade
+        self.assertEqual(upgrade_credit(self.user, second_plan.pk), (Decimal('0'), []))
+        self.assertEqual(upgrade_credit(self.user, first_plan.pk)[0], credit)
+
+        # A second upgrade priced before the first existed still only ends the rows it was credited for
+        second = Order.objects.create(
+            user=self.user, bundled_plan=second_plan, original_price=1000, final_price=800 - credit,
+            proration_credit=credit, status='pending'
+        )
+        second.credited_subscriptions.set([held])
+        Order.finalize_payment(first.pk)
+        Order.finalize_payment(second.pk)
+
+        held.refresh_from_db()
+        self.assertEqual(held.status, 'cancelled')
+        self.assertEqual(first.subscriptions.get(product=self.product).status, 'active')
+        second.refresh_from_db()
+        self.assertIn(str(held.pk), second.notes)
+        second_row = second.subscriptions.get(product=self.product)
+        self.assertEqual(second_row.start_date, first.subscriptions.get(product=self.product).expiry_date)
+
+    def test_renewed_rows_get_no_expiry_reminder(self):
+        buy(self.user, product=self.product)
+        self.user.subscriptions.update(expiry_date=timezone.now() + timezone.timedelta(days=2))
+        buy(self.user, product=self.product)
+
+        self.assertEqual(send_expiry_notifications(), 0)
+
+
+class RollupTests(TestCase):
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f'student{i}', email=f'student{i}@example.com', password='pass12345')
+            for i in range(2)
+        ]
+        self.product = make_product('counselling')
+
+    def test_rollups_total_completed_orders_and_can_be_rebuilt(self):
+        for user in self.users:
+            buy(user, product=self.product, price=100)
+        Order.objects.create(user=self.users[0], product=self.product, original_price=100, final_price=100)
+        # Renewal stacked after the current term: not an extra active subscriber yet
+        buy(self.users[0], product=self.product, price=90)
+
+        build_rollups(full=True)
+        build_rollups(full=True)
+
+        day = DailyRevenueRollup.objects.get()
+        self.assertEqual((day.order_count, day.revenue), (3, Decimal('290')))
+        active = ActiveSubscriberRollup.objects.get()
+        self.assertEqual((active.active_subscribers, active.active_subscriptions), (2, 2))
+        summary = dashboard_summary()
+        self.assertEqual(summary['totals']['revenue'], Decimal('290'))
+        self.assertEqual(list(summary['active_subscribers']), [active])
+
+
+@override_settings(ARCHIVE_AFTER_DAYS=730, ARCHIVE_ABANDONED_ORDERS_AFTER_DAYS=90)
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='student', email='student@example.com', password='pass12345')
+        self.product = make_product('counselling')
+        self.old_order = buy(self.user, product=self.product)
+        long_ago = timezone.now() - timezone.timedelta(days=1500)
+        Order.objects.filter(pk=self.old_order.pk).update(created_at=long_ago)
+        self.old_order.subscriptions.update(start_date=long_ago, expiry_date=long_ago + timezone.timedelta(days=365))
+        self.current_order = buy(self.user, product=self.product)
+        self.export_dir = tempfile.mkdtemp()
+
+    def exported(self, kind):
+        lines = []
+        for name in os.listdir(self.export_dir):
+            if name.startswith(kind):
+                with gzip.open(os.path.join(self.export_dir, name), 'rt') as handle:
+                    lines.extend(handle)
+        return lines
+
+    def test_old_rows_are_moved_to_the_archive_and_exported(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            counts = archive_records(export_dir=self.export_dir)
+
+        self.assertEqual(counts, {'subscriptions': 1, 'orders': 1})
+        self.assertTrue(ArchivedOrder.objects.filter(order_id=self.old_order.order_id).exists())
+        self.assertEqual(ArchivedSubscription.objects.get().order_id, self.old_order.order_id)
+        self.assertEqual(list(Order.objects.all()), [self.current_order])
+        self.assertEqual(len(self.exported('subscriptions')), 1)
+        self.assertEqual(len(self.exported('orders')), 1)
+
+    def test_rolled_back_batch_is_not_exported(self):
+        with mock.patch('products.archive.invalidate_entitlements', side_effect=RuntimeError):
+            with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+                archive_records(export_dir=self.export_dir)
+
+        self.assertEqual(UserSubscription.objects.count(), 2)
+        self.assertFalse(ArchivedSubscription.objects.exists())
+        self.assertEqual(self.exported('subscriptions'), [])
@@ -3,72 +3,61 @@ User Subscription Management Utilities
 Helper functions to check user access, manage subscriptions, etc.
 """
 
+import time
+
+from django.conf import settings
 from django.utils import timezone
 from django.db.models import Q
 from .models import UserSubscription, MyProducts, BundledPlan
+from .entitlements import get_entitlements, invalidate_entitlements
 
 
 class SubscriptionManager:
-    """Manager class for handling user subscriptions"""
+    """
+    Manager class for handling user subscriptions
+    Access checks are answered from the user's entitlement snapshot, which is
+    loaded once per request and shared with every other caller.
+    """
     
-    def __init__(self, user):
+    def __init__(self, user, snapshot=None):
         self.user = user
+        self.snapshot = snapshot or get_entitlements(user)
+    
+    def _subscriptions(self, entries):
+        return UserSubscription.objects.filter(
+            id__in=[e.subscription_id for e in entries]
+        ).select_related('product', 'bundled_plan', 'order')
     
     def has_active_subscription(self, product_slug=None, service_type=None):
         """
         Check if user has active subscription for a product or service type
+        The service type is a product category slug, e.g. 'counselling'.
         """
-        query = Q(
-            user=self.user,
-            status='active',
-            is_active=True,
-            expiry_date__gt=timezone.now()
-        )
-        
+        entries = self.snapshot.active_entries
         if product_slug:
-            query &= Q(product__slug=product_slug)
-        
+            entries = [e for e in entries if e.product_slug == product_slug]
         if service_type:
-            query &= Q(product__service_type=service_type)
-        
-        return UserSubscription.objects.filter(query).exists()
+            entries = [e for e in entries if e.product_category_slug == service_type]
+        return bool(entries)
     
     def get_active_subscriptions(self):
         """Get all active subscriptions for user"""
-        return UserSubscription.objects.filter(
-            user=self.user,
-            status='active',
-            is_active=True,
-            expiry_date__gt=timezone.now()
-        ).select_related('product', 'bundled_plan', 'order')
+        return self._subscriptions(self.snapshot.active_entries)
     
     def get_subscription_for_product(self, product_slug):
         """Get active subscription for specific product"""
-        return UserSubscription.objects.filter(
-            user=self.user,
-            product__slug=product_slug,
-            status='active',
-            is_active=True,
-            expiry_date__gt=timezone.now()
-        ).select_related('product', 'bundled_plan', 'order').first()
+        if product_slug not in self.snapshot.active_product_slugs:
+            return None
+        entries = [e for e in self.snapshot.active_entries if e.product_slug == product_slug]
+        return self._subscriptions(entries).first()
     
     def get_expired_subscriptions(self):
         """Get all expired subscriptions for user"""
-        return UserSubscription.objects.filter(
-            user=self.user,
-            expiry_date__lte=timezone.now()
-        ).select_related('product', 'bundled_plan', 'order')
+        return self._subscriptions(self.snapshot.expired_entries())
     
     def get_expiring_soon(self, days=7):
         """Get subscriptions expiring within specified days"""
-        expiry_threshold = timezone.now() + timezone.timedelta(days=days)
-        return UserSubscription.objects.filter(
-            user=self.user,
-            status='active',
-            is_active=True,
-            expiry_date__lte=expiry_threshold,
-            expiry_date__gt=timezone.now()
-        ).select_related('product', 'bundled_plan', 'order')
+        return self._subscriptions(self.snapshot.expiring_within(days))
     
     def access_product(self, product_slug):
         """
@@ -92,17 +81,16 @@ class SubscriptionManager:
     
     def get_subscription_summary(self):
         """Get summary of user's subscriptions"""
-        active = self.get_active_subscriptions()
-        expiring_soon = self.get_expiring_soon()
-        expired = self.get_expired_subscriptions()
+        active_count = len(self.snapshot.active_entries)
+        expired_count = len(self.snapshot.expired_entries())
         
         return {
-            'active_count': active.count(),
-            'active_subscriptions': active,
-            'expiring_soon_count': expiring_soon.count(),
-            'expiring_soon': expiring_soon,
-            'expired_count': expired.count(),
-            'total_subscriptions': active.count() + expired.count()
+            'active_count': active_count,
+            'active_subscriptions': self.get_active_subscriptions(),
+            'expiring_soon_count': len(self.snapshot.expiring_within(7)),
+            'expiring_soon': self.get_expiring_soon(),
+            'expired_count': expired_count,
+            'total_subscriptions': active_count + expired_count
         }
     
     def can_purchase_bundled_plan(self, bundled_plan):
@@ -115,10 +103,7 @@ class SubscriptionManager:
         
         # Check max purchases limit
         if bundled_plan.max_purchases_per_user > 0:
-            user_purchases = UserSubscription.objects.filter(
-                user=self.user,
-                bundled_plan=bundled_plan
-            ).count()
+            user_purchases = self.snapshot.bundle_purchase_count(bundled_plan.id)
             
             if user_purchases >= bundled_plan.max_purchases_per_user:
                 return False, f"You have reached the maximum purchase limit for this plan."
@@ -127,15 +112,11 @@ class SubscriptionManager:
     
     def get_products_with_access(self):
         """Get list of product slugs user has access to"""
-        active_subscriptions = self.get_active_subscriptions()
-        return [sub.product.slug for sub in active_subscriptions]
+        return [product.slug for product in self.snapshot.enrolled_products]
     
     def has_purchased_product(self, product_slug):
         """Check if user has ever purchased a product (active or expired)"""
-        return UserSubscription.objects.filter(
-            user=self.user,
-            product__slug=product_slug
-        ).exists()
+        return product_slug in self.snapshot.purchased_product_slugs
 
 
 def check_product_access(user, product_slug):
@@ -153,48 +134,76 @@ def get_user_active_products(user):
     return manager.get_products_with_access()
 
 
-def update_expired_subscriptions():
+def in_peak_hours(peak_hours=None, now=None):
+    """
+    Check if the local time falls inside the configured peak window
+    peak_hours is a 'start-end' string in 24h local time, e.g. '9-23'
+    """
+    peak_hours = peak_hours if peak_hours is not None else getattr(settings, 'EXPIRY_SWEEP_PEAK_HOURS', '')
+    if not peak_hours:
+        return False
+    start, end = (int(h) for h in peak_hours.split('-'))
+    hour = timezone.localtime(now).hour
+    return start <= hour < end if start <= end else (hour >= start or hour < end)
+
+
+def update_expired_subscriptions(chunk_size=1000, pause=0, peak_chunk_size=200, peak_pause=1.0, progress=None):
     """
     Utility function to update status of expired subscriptions
-    Can be run as a cron job or celery task
+    Walks the expiry_date index in (expiry_date, id) order and expires each chunk
+    with one UPDATE, so no statement holds locks for long. Already-expired rows drop
+    out of the filter, which makes an interrupted sweep safe to simply re-run.
+    During peak hours chunks are smaller and the pause between them longer.
+    `progress(count, rate)` is called after every chunk.
+    Runs periodically on the job queue (products.tasks) or from its management command
     """
-    expired_subscriptions = UserSubscription.objects.filter(
+    now = timezone.now()
+    expired = UserSubscription.objects.filter(
         status='active',
         is_active=True,
-        expiry_date__lte=timezone.now()
-    )
+        expiry_date__lte=now
+    ).order_by('expiry_date', 'id')
     
     count = 0
-    for subscription in expired_subscriptions:
-        subscription.status = 'expired'
-        subscription.is_active = False
-        subscription.save()
-        count += 1
+    started = time.monotonic()
+    last_expiry, last_id = None, None
+    while True:
+        peak = in_peak_hours()
+        size = min(chunk_size, peak_chunk_size) if peak else chunk_size
+        
+        chunk = expired
+        if last_expiry is not None:
+            chunk = chunk.filter(Q(expiry_date__gt=last_expiry) | Q(expiry_date=last_expiry, id__gt=last_id))
+        rows = list(chunk.values_list('id', 'expiry_date', 'user_id')[:size])
+        if not rows:
+            break
+        last_id, last_expiry, _ = rows[-1]
+        
+        count += UserSubscription.objects.filter(
+            id__in=[row[0] for row in rows],
+            status='active'
+        ).update(status='expired', is_active=False, updated_at=timezone.now())
+        invalidate_entitlements(*[row[2] for row in rows])
+        
+        elapsed = time.monotonic() - started
+        if progress:
+            progress(count, count / elapsed if elapsed > 0 else 0)
+        
+        delay = peak_pause if peak else pause
+        if delay:
+            time.sleep(delay)
     
     return count
 
 
-def send_expiry_notifications():
+def send_expiry_notifications(days=7, **kwargs):
     """
     Send notifications to users whose subscriptions are expiring soon
-    Can be run as a cron job or celery task
+    See products.notifications for batching, rate limiting and dedupe
+    Runs periodically on the job queue (products.tasks) or from its management command
     """
-    # Get subscriptions expiring in 7 days
-    expiry_threshold = timezone.now() + timezone.timedelta(days=7)
-    expiring_subscriptions = UserSubscription.objects.filter(
-        status='active',
-        is_active=True,
-        expiry_date__lte=expiry_threshold,
-        expiry_date__gt=timezone.now()
-    ).select_related('user', 'product')
-    
-    notifications_sent = 0
-    for subscription in expiring_subscriptions:
-        # Send email notification
-        # send_email_notification(subscription.user, subscription)
-        notifications_sent += 1
-    
-    return notifications_sent
+    from .notifications import send_expiry_notifications as send_notifications
+    return send_notifications(days=days, **kwargs)
 
 
 def get_popular_bundled_plans(limit=3):
@@ -231,10 +240,10 @@ def get_products_by_category(category_slug=None):
 
 
 def get_products_by_type(service_type):
-    """Get products by type (counselling, predictor, etc.)"""
+    """Get products by type, i.e. category slug (counselling, predictor, etc.)"""
     return MyProducts.objects.filter(
         is_active=True,
-        service_type=service_type
+        category__slug=service_type
     ).order_by('display_order', 'name')
 
 
@@ -2,6 +2,8 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .models import MyProducts, BundledPlan, ExamType, ProductCategory, Order
+from .utils import SubscriptionManager
+from checkout.pricing import bundle_price_entry, product_price_entry
 
 # Create your views here.
 @login_required
@@ -46,12 +48,16 @@ def products_plans(request):
 @login_required
 def product_detail(request, type, slug):
     context = {}
+    # Purchase limits and current access come from the user's entitlement snapshot
+    manager = SubscriptionManager(request.user)
     
     if type == 'bundle':
         item = get_object_or_404(BundledPlan, slug=slug, is_active=True)
         # Get related bundles
         related_items = BundledPlan.objects.filter(is_active=True).exclude(id=item.id)[:3]
         context['is_bundle'] = True
+        context['pricing'] = bundle_price_entry(item)
+        context['can_purchase'], context['purchase_message'] = manager.can_purchase_bundled_plan(item)
     else:
         item = get_object_or_404(MyProducts, slug=slug, is_active=True)
         # Get related products in same category
@@ -60,6 +66,9 @@ def product_detail(request, type, slug):
             related_items = related_items.filter(category=item.category)
         related_items = related_items[:3]
         context['is_bundle'] = False
+        context['pricing'] = product_price_entry(item)
+        context['can_purchase'] = True
+        context['access_expiry'] = manager.snapshot.expiry_for(item.pk)
 
     context.update({
         'item': item,
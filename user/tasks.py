@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import send_mail
+from django.urls import reverse
+
+from jobs.queue import job
+
+from .models import OTPVerification, PasswordResetToken
+
+# Jobs carry only record ids; the OTP and reset link are read when the email is sent,
+# so they never sit in the job table. At most 4 sends at once to spare the SMTP server.
+
+
+@job(max_attempts=5, backoff=15, concurrency=4, sensitive=True)
+def send_registration_otp(otp_id):
+    """Email the OTP for a pending registration; skipped if it was replaced, used or has expired"""
+    otp_record = OTPVerification.objects.filter(pk=otp_id).first()
+    if otp_record is None or otp_record.is_expired():
+        return
+    send_mail(
+        subject='OTP Verification for Registration',
+        message=f'Your OTP is {otp_record.otp}',
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[otp_record.email],
+        fail_silently=False,
+    )
+
+
+@job(max_attempts=5, backoff=15, concurrency=4, sensitive=True)
+def send_password_reset(token_id):
+    """Email a password reset link; skipped if the token was used, replaced or has expired"""
+    reset_token = PasswordResetToken.objects.filter(pk=token_id).first()
+    if reset_token is None or not reset_token.is_valid():
+        return
+    user = User.objects.filter(email=reset_token.email).first()
+    reset_url = settings.SITE_URL + reverse('user:reset_password', kwargs={'token': reset_token.token})
+    message = (
+        f"Hello {(user and user.first_name) or reset_token.email},\n\n"
+        "You requested a password reset. Please click the link below to reset your password:\n\n"
+        f"{reset_url}\n\n"
+        "If you did not request this password reset, please ignore this email.\n"
+    )
+    send_mail(
+        subject='Password Reset Request',
+        message=message,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[reset_token.email],
+        fail_silently=False,
+    )
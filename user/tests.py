@@ -1,3 +1,79 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from jobs.models import Job
+from jobs.queue import claim, run
+from products.models import MyProducts, Order
+
+from .models import OTPVerification, PasswordResetToken
+
+
+@override_settings(JOBS_RUN_INLINE=False, SITE_URL='https://example.com')
+class AccountEmailTests(TestCase):
+
+    def run_queued(self):
+        job = claim('test-worker')
+        self.assertIsNotNone(job)
+        self.assertTrue(run(job, 'test-worker'))
+        return job
+
+    def test_registration_otp_is_not_stored_in_the_job(self):
+        self.client.post(reverse('user:register'), {
+            'email': 'student@example.com', 'password': 'pass12345', 'confirm_password': 'pass12345',
+        })
+        otp_record = OTPVerification.objects.get()
+        job = Job.objects.get()
+        self.assertEqual(job.payload, {'otp_id': otp_record.pk})
+
+        self.run_queued()
+        self.assertIn(otp_record.otp, mail.outbox[0].body)
+        self.assertEqual(Job.objects.get().payload, {})
+
+    def test_password_reset_link_is_built_by_the_job(self):
+        User.objects.create_user(username='student@example.com', email='student@example.com', password='pass12345')
+        self.client.post(reverse('user:forgot_password'), {'email': 'student@example.com'})
+        token = PasswordResetToken.objects.get()
+        self.assertNotIn(token.token, str(Job.objects.get().payload))
+
+        self.run_queued()
+        self.assertIn(f"https://example.com/user/reset_password/{token.token}/", mail.outbox[0].body)
+
+    def test_used_reset_token_is_not_sent(self):
+        User.objects.create_user(username='student@example.com', email='student@example.com', password='pass12345')
+        self.client.post(reverse('user:forgot_password'), {'email': 'student@example.com'})
+        PasswordResetToken.objects.update(used=True)
+
+        self.run_queued()
+        self.assertEqual(mail.outbox, [])
+
+
+class PurchaseHistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='student@example.com', password='pass12345')
+        other = User.objects.create_user(username='other@example.com', password='pass12345')
+        product = MyProducts.objects.create(name='Counselling', slug='counselling', base_price=100)
+        for _ in range(12):
+            Order.objects.create(
+                user=self.user, product=product, original_price=100, final_price=100, status='pending'
+            ).mark_completed()
+        Order.objects.create(user=self.user, product=product, original_price=100, final_price=100)
+        Order.objects.create(user=other, product=product, original_price=100, final_price=100, status='completed')
+        self.client.force_login(self.user)
+
+    def test_api_pages_the_users_completed_orders(self):
+        data = self.client.get(reverse('user:purchase_history_api')).json()
+        self.assertEqual((data['count'], data['num_pages'], data['has_next']), (12, 2, True))
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(data['results'][0]['item_name'], 'Counselling')
+        self.assertEqual(len(data['results'][0]['subscriptions']), 1)
+
+        data = self.client.get(reverse('user:purchase_history_api'), {'page': 2, 'status': 'all'}).json()
+        self.assertEqual((data['count'], data['status']), (13, 'all'))
+        self.assertEqual(len(data['results']), 3)
+
+    def test_page_loads_related_rows_in_a_fixed_number_of_queries(self):
+        with self.assertNumQueries(6):
+            self.client.get(reverse('user:purchase_history_api'))
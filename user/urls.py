@@ -18,6 +18,7 @@ urlpatterns = [
     path("profile/", views.user_profile, name="user_profile"),
     path("academic_info/", views.academic_info, name="academic_info"),
     path("my_purchases/", views.my_purchases, name="my_purchases"),
+    path("api/purchases/", views.purchase_history_api, name="purchase_history_api"),
     path("settings/", views.account_settings, name="settings"),
     path("delete_account/", views.delete_account, name="delete_account"),
     path("change_password/", views.change_password, name="change_password"),
@@ -5,15 +5,17 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Prefetch
+from django.http import JsonResponse
 from django.contrib.auth.models import User
+import logging
 import random
 from .models import OTPVerification, PasswordResetToken, Profile
-from products.models import Order
-from django.contrib.auth.hashers import make_password
-from django.core.mail import send_mail
-from django.urls import reverse
-from django.conf import settings
-# Create your views here.
+from products.models import ArchivedOrder, CouponUsage, Order, UserSubscription
+from .tasks import send_password_reset, send_registration_otp
+
+logger = logging.getLogger(__name__)
 
 
 def user_login(request):
@@ -105,18 +107,13 @@ def register(request):
         )
 
         try:
-            send_mail(
-                'OTP Verification for Registration',
-                f'Your OTP is {otp}',
-                settings.DEFAULT_FROM_EMAIL,
-                [email],
-                fail_silently=False,
-            )
+            # Sent by a background worker, which retries if the mail server is unavailable
+            send_registration_otp.enqueue(otp_id=otp_record.pk)
             request.session['otp_email'] = email
             messages.success(request, "OTP sent to your email. Please enter it to complete registration.")
             return redirect('user:verify_otp')
-        except Exception as e:
-            print(f"Error sending OTP: {e}")
+        except Exception:
+            logger.exception("Error queueing registration OTP %s", otp_record.pk)
             messages.error(request, "Failed to send OTP. Please try again.")
             return render(request, 'user/register.html')
 
@@ -192,42 +189,14 @@ def forgot_password(request):
             PasswordResetToken.objects.filter(email=email, used=False).update(used=True)
             reset_token = PasswordResetToken.objects.create(email=email)
             
-            reset_url = request.build_absolute_uri(
-                reverse('user:reset_password', kwargs={'token': reset_token.token})
-            )
-
             try:
-                # Correct usage of Django's send_mail
-                subject = 'Password Reset Request'
-                message = f"""
-                Hello {user.first_name or user.email},
-                
-                You requested a password reset. Please click the link below to reset your password:
-                
-                {reset_url}
-                
-                If you did not request this password reset, please ignore this email.
-                """
-                from_email = settings.DEFAULT_FROM_EMAIL
-                recipient_list = [email]
-                
-                success = send_mail(
-                    subject=subject,
-                    message=message,
-                    from_email=from_email,
-                    recipient_list=recipient_list,
-                    fail_silently=False,
-                )
-                
-                if success:
-                    messages.success(request, "Password reset link has been sent to your registered email.")
-                    return redirect('user:login')
-                else:
-                    messages.error(request, "Failed to send password reset link. Please try again later.")
-                    return render(request, 'user/forgot_password.html')
+                # Sent by a background worker, which retries if the mail server is unavailable
+                send_password_reset.enqueue(token_id=reset_token.pk)
+                messages.success(request, "Password reset link has been sent to your registered email.")
+                return redirect('user:login')
             
-            except Exception as e:
-                print(f"ERROR sending password reset email: {e}") 
+            except Exception:
+                logger.exception("Error queueing password reset email for token %s", reset_token.pk)
                 messages.error(request, f"Failed to send password reset email. Please try again")
                 return render(request, 'user/forgot_password.html')
         except User.DoesNotExist:
@@ -395,11 +364,102 @@ def academic_info(request):
     return render(request, 'user/academic_info.html', {'profile': profile})
 
 
+PURCHASE_HISTORY_PAGE_SIZE = 10
+
+# Abandoned checkouts are left out of purchase history unless asked for
+HIDDEN_ORDER_STATUSES = ['pending', 'failed', 'cancelled']
+
+
+def _purchase_history_page(request):
+    """
+    One page of the user's purchase history
+    ?status=<status> or ?status=all widens the default filter; ?archived=1 reads the
+    orders moved to the archive (products.archive).
+    Returns: (page, status, archived)
+    """
+    status = request.GET.get('status', '')
+    archived = bool(request.GET.get('archived'))
+    if archived:
+        orders = ArchivedOrder.objects.filter(user=request.user)
+    else:
+        # Related rows for the whole page in two queries rather than per order
+        orders = Order.objects.filter(user=request.user).select_related('product', 'bundled_plan').prefetch_related(
+            Prefetch('subscriptions', queryset=UserSubscription.objects.select_related('product')),
+            Prefetch('coupon_usage', queryset=CouponUsage.objects.select_related('coupon')),
+        )
+
+    if status in dict(Order.STATUS_CHOICES):
+        orders = orders.filter(status=status)
+    elif status != 'all':
+        status = ''
+        orders = orders.exclude(status__in=HIDDEN_ORDER_STATUSES)
+
+    page = Paginator(orders.order_by('-created_at', '-id'), PURCHASE_HISTORY_PAGE_SIZE).get_page(request.GET.get('page'))
+    return page, status, archived
+
+
+def _serialize_order(order, archived=False):
+    if archived:
+        return {
+            'order_id': order.order_id,
+            'created_at': order.created_at.isoformat(),
+            'status': order.status,
+            'status_display': order.get_status_display(),
+            'item_type': order.item_type,
+            'item_name': order.item_name,
+            'final_price': str(order.final_price),
+            'archived': True,
+        }
+
+    item = order.bundled_plan or order.product
+    return {
+        'order_id': order.order_id,
+        'created_at': order.created_at.isoformat(),
+        'status': order.status,
+        'status_display': order.get_status_display(),
+        'item_type': 'bundle' if order.bundled_plan_id else 'product',
+        'item_name': item.name if item else None,
+        'final_price': str(order.final_price),
+        'coupon_codes': [usage.coupon.code for usage in order.coupon_usage.all()],
+        'subscriptions': [
+            {
+                'product_name': subscription.product.name if subscription.product else None,
+                'status': subscription.status,
+                'expiry_date': subscription.expiry_date.isoformat(),
+            }
+            for subscription in order.subscriptions.all()
+        ],
+        'archived': False,
+    }
+
+
 @login_required(login_url='user:login')
 def my_purchases(request):
     profile = _get_profile(request.user)
-    orders = Order.objects.filter(user=request.user).select_related('product', 'bundled_plan').order_by('-created_at')
-    return render(request, 'user/my_purchases.html', {'profile': profile, 'orders': orders})
+    page, status, archived = _purchase_history_page(request)
+    return render(request, 'user/my_purchases.html', {
+        'profile': profile,
+        'orders': page,
+        'page_obj': page,
+        'status': status,
+        'archived': archived,
+        'has_archived_orders': archived or ArchivedOrder.objects.filter(user=request.user).exists(),
+    })
+
+
+@login_required(login_url='user:login')
+def purchase_history_api(request):
+    """Purchase history as JSON, with the same filters and pages as my_purchases"""
+    page, status, archived = _purchase_history_page(request)
+    return JsonResponse({
+        'results': [_serialize_order(order, archived) for order in page],
+        'page': page.number,
+        'num_pages': page.paginator.num_pages,
+        'count': page.paginator.count,
+        'has_next': page.has_next(),
+        'status': status or 'default',
+        'archived': archived,
+    })
 
 
 @login_required(login_url='user:login')